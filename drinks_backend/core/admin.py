@@ -9,3 +9,7 @@ admin.site.register(Cocktails)
 admin.site.register(CocktailsCategory)
 admin.site.register(Offer)
 admin.site.register(Contact)
+admin.site.register(ImportJob)
+admin.site.register(OrderItem)
+admin.site.register(DailySalesSummary)
+admin.site.register(IdempotencyKey)
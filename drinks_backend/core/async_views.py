@@ -0,0 +1,72 @@
+'''Async versions of the payment endpoints, routed when ASYNC_VIEWS is set.
+
+Under an ASGI server these wait on Safaricom without holding a thread, so
+one worker can have many checkouts in flight. The DRF views stay in use for
+everything else: DRF is sync-only and Django runs those views in a thread.
+'''
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .models import Order, normalize_phone
+from .payments import (
+    adispatch_stk_push, claim_stk_push, handle_stk_callback, stk_push_error, stk_push_forbidden, valid_callback_token,
+)
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+def request_user(request):
+    '''The user DRF would authenticate from the JWT, else the session user.'''
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        authenticated = None
+    return authenticated[0] if authenticated else request.user
+
+
+@csrf_exempt
+@require_POST
+async def stk_push(request, order_id):
+    '''Send the STK push inline; 202 once Daraja has accepted it.'''
+    order = await Order.objects.select_related('customer').filter(order_id=order_id).afirst()
+    if order is None:
+        return JsonResponse({'detail': 'No Order matches the given query.'}, status=404)
+    data = request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Malformed JSON'}, status=400)
+    phone = normalize_phone(data.get('phone') or (order.customer.phone if order.customer else ''))
+    if stk_push_forbidden(order, phone, await sync_to_async(request_user)(request)):
+        return JsonResponse({'error': 'Only staff can prompt another phone'}, status=403)
+    if error := stk_push_error(order, phone):
+        return JsonResponse({'error': error}, status=400)
+    if not await sync_to_async(claim_stk_push)(order.pk):
+        response = JsonResponse({'error': 'A payment prompt was already sent for this order'}, status=429)
+        response['Retry-After'] = str(settings.STK_PUSH_INTERVAL)
+        return response
+
+    if await adispatch_stk_push(order, phone) is None:
+        return JsonResponse({'order_id': order.order_id, 'status': 'failed'}, status=502)
+    # Not the CheckoutRequestID: it is what callbacks and STK queries are matched on
+    return JsonResponse({'order_id': order.order_id, 'status': 'sent'}, status=202)
+
+
+@csrf_exempt
+@require_POST
+async def mpesa_callback(request, token):
+    '''Receives Daraja STK results; always acknowledged so Daraja does not retry.'''
+    if not valid_callback_token(token):
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    await sync_to_async(handle_stk_callback)(request_data(request) or {})
+    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
@@ -0,0 +1,45 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    '''Process-wide worker pool, created on first use so forked workers get their own.'''
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_WORKERS,
+                thread_name_prefix='core-background',
+            )
+    return _executor
+
+
+def _run(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Background task {fn.__name__} failed")
+        raise
+    finally:
+        # Worker threads must not keep their own database connections open
+        connections.close_all()
+
+
+def submit(fn, *args, **kwargs):
+    '''Run fn on the background pool; runs inline when BACKGROUND_TASKS_EAGER is set.'''
+    if settings.BACKGROUND_TASKS_EAGER:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return get_executor().submit(_run, fn, *args, **kwargs)
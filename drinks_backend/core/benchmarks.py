@@ -0,0 +1,89 @@
+import contextlib
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, pct):
+    '''Nearest-rank percentile of a non-empty sequence.'''
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+@contextlib.contextmanager
+def scratch_database(sqlite_path=None):
+    '''Create, migrate and finally drop a throwaway copy of the default database.
+
+    Benchmarks write a lot of rows; they must never touch real data.
+    '''
+    if connection.vendor == 'sqlite' and sqlite_path:
+        connection.settings_dict['TEST']['NAME'] = sqlite_path
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(request, repeat=50, warmup=3, profile_calls=10, before_each=None):
+    '''Call request(i) repeatedly and summarise latency, queries and memory.
+
+    Latency comes from an uninstrumented pass of `repeat` calls. Query
+    counts and tracemalloc peaks come from a second pass of `profile_calls`,
+    because tracing allocations slows every call down.
+    '''
+    for i in range(warmup):
+        if before_each:
+            before_each()
+        request(i)
+
+    latencies = []
+    statuses = Counter()
+    for i in range(repeat):
+        if before_each:
+            before_each()
+        started = time.perf_counter()
+        response = request(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[response.status_code] += 1
+
+    queries = []
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(profile_calls):
+            if before_each:
+                before_each()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            with CaptureQueriesContext(connection) as captured:
+                request(repeat + i)
+            peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+            queries.append(len(captured))
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'requests': repeat,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries_mean': round(statistics.fmean(queries), 2) if queries else None,
+        'queries_max': max(queries, default=None),
+        'peak_kb': round(max(peaks), 1) if peaks else None,
+    }
@@ -0,0 +1,96 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from rest_framework.response import Response
+from .conditional import ConditionalGetMixin
+
+VERSION_KEY = 'catalogue:version'
+HITS_KEY = 'catalogue:hits'
+MISSES_KEY = 'catalogue:misses'
+
+
+def get_cache():
+    return caches[settings.CATALOGUE_CACHE]
+
+
+def current_version():
+    # Seeded from the clock so an evicted counter never reuses an old version
+    return get_cache().get_or_set(VERSION_KEY, lambda: time.time_ns(), timeout=None)
+
+
+def invalidate_catalogue():
+    '''Drop every cached catalogue response by moving to a new version.'''
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_catalogue_on_commit():
+    '''Invalidate now and again at commit, so readers cannot re-cache uncommitted state.'''
+    invalidate_catalogue()
+    if connection.in_atomic_block:
+        transaction.on_commit(invalidate_catalogue)
+
+
+def _count(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cache_stats():
+    cache = get_cache()
+    values = cache.get_many([HITS_KEY, MISSES_KEY, VERSION_KEY])
+    hits, misses = values.get(HITS_KEY, 0), values.get(MISSES_KEY, 0)
+    return {
+        'backend': settings.CACHES[settings.CATALOGUE_CACHE]['BACKEND'],
+        'version': values.get(VERSION_KEY),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+
+class CatalogueCacheMixin(ConditionalGetMixin):
+    '''Read-through cache for list and retrieve on catalogue ViewSets.
+
+    Response data and the conditional-GET validators are stored under the
+    current catalogue version, so a single invalidate_catalogue() call makes
+    every dependent entry unreachable.
+    '''
+
+    def cache_key(self, kind):
+        path = hashlib.md5(f'{self.request.get_full_path()}:{self.request.accepted_media_type}'.encode()).hexdigest()
+        return f'catalogue:{current_version()}:{kind}:{self.basename}:{path}'
+
+    def load_validators(self, compute):
+        cache = get_cache()
+        key = self.cache_key('validators')
+        validators = cache.get(key)
+        if validators is None:
+            validators = super().load_validators(compute)
+            cache.set(key, validators)
+        return validators
+
+    def get_response(self, view, request, *args, **kwargs):
+        cache = get_cache()
+        key = self.cache_key('data')
+
+        data = cache.get(key)
+        if data is not None:
+            _count(HITS_KEY)
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _count(MISSES_KEY)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,67 @@
+import hashlib
+from django.db.models import Count, F, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    '''Strong ETag and Last-Modified for list and retrieve.
+
+    Validators come from max(updated_at) and the row count of the queryset,
+    so a matching If-None-Match is answered with 304 without serializing.
+    '''
+    validator_field = 'updated_at'
+
+    def last_modified_expression(self):
+        '''When a row last changed; override to cover related rows the serializer embeds.'''
+        return F(self.validator_field)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(self.list_validators, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(self.retrieve_validators, super().retrieve, request, *args, **kwargs)
+
+    def list_validators(self):
+        state = self.filter_queryset(self.get_queryset()).aggregate(
+            last_modified=Max(self.last_modified_expression()), count=Count('pk')
+        )
+        return state['last_modified'], state['count']
+
+    def retrieve_validators(self):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        last_modified = (
+            self.get_queryset().filter(**{self.lookup_field: self.kwargs[lookup]})
+            .annotate(validator_last_modified=self.last_modified_expression())
+            .values_list('validator_last_modified', flat=True).first()
+        )
+        return last_modified, 1
+
+    def load_validators(self, compute):
+        '''Return (etag, last_modified); subclasses may cache this.'''
+        last_modified, count = compute()
+        if last_modified is None:
+            return None, None
+        tag = f'{self.basename}:{count}:{last_modified.isoformat()}:{self.request.get_full_path()}:{self.request.accepted_media_type}'
+        return f'"{hashlib.md5(tag.encode()).hexdigest()}"', last_modified
+
+    def get_response(self, view, request, *args, **kwargs):
+        return view(request, *args, **kwargs)
+
+    def conditional_response(self, compute, view, request, *args, **kwargs):
+        etag, last_modified = self.load_validators(compute)
+        if etag is None:
+            # Empty or missing: nothing to validate against
+            return self.get_response(view, request, *args, **kwargs)
+
+        timestamp = int(last_modified.timestamp())
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        response = self.get_response(view, request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(timestamp)
+        return response
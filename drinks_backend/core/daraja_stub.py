@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class DarajaStub:
+    '''Local stand-in for the Daraja API, used by tests and benchmarks.
+
+    Counts OAuth, STK push and STK query calls, keeps each push by
+    CheckoutRequestID so matching callbacks and query results can be set up,
+    can add latency, and can fail the next few OAuth calls or STK pushes
+    with a given status to exercise retries and rejections.
+    '''
+
+    def __init__(self, expires_in=3599, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.oauth_calls = 0
+        self.stk_pushes = 0
+        self.oauth_failures = []
+        self.push_failures = []
+        self.tokens = set()
+        self.pushes = {}
+        self.stk_queries = 0
+        self.results = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def issue_token(self):
+        with self._lock:
+            self.oauth_calls += 1
+            if self.oauth_failures:
+                return self.oauth_failures.pop(0), {'errorMessage': 'Service unavailable'}
+            token = uuid.uuid4().hex
+            self.tokens.add(token)
+        return 200, {'access_token': token, 'expires_in': str(self.expires_in)}
+
+    def stk_push(self, payload):
+        checkout_request_id = f'ws_CO_{uuid.uuid4().hex}'
+        with self._lock:
+            self.stk_pushes += 1
+            if self.push_failures:
+                return self.push_failures.pop(0)
+            self.pushes[checkout_request_id] = payload
+        return 200, {
+            'MerchantRequestID': uuid.uuid4().hex,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def stk_query(self, payload):
+        '''Result set in self.results[CheckoutRequestID]; still processing when absent.'''
+        checkout_request_id = payload.get('CheckoutRequestID')
+        with self._lock:
+            self.stk_queries += 1
+            result_code = self.results.get(checkout_request_id)
+        if checkout_request_id not in self.pushes:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if result_code is None:
+            return 500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': str(result_code),
+            'ResultDesc': 'The service request is processed successfully.' if result_code == 0 else 'Request cancelled by user',
+        }
+
+    @staticmethod
+    def callback(checkout_request_id, paid=True, amount=1, receipt='SIM0000000'):
+        '''The body Daraja posts to CallBackURL once the customer answers the prompt.'''
+        result = {
+            'MerchantRequestID': uuid.uuid4().hex,
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': 0 if paid else 1032,
+            'ResultDesc': 'The service request is processed successfully.' if paid else 'Request cancelled by user',
+        }
+        if paid:
+            result['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': amount},
+                {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            ]}
+        return {'Body': {'stkCallback': result}}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body):
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                try:
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out before a delayed reply
+
+            def authorized(self):
+                token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+                return token in stub.tokens
+
+            def do_GET(self):
+                if self.path.startswith('/oauth/v1/generate'):
+                    return self.reply(*stub.issue_token())
+                self.reply(404, {'errorMessage': 'Not found'})
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if not self.authorized():
+                    return self.reply(401, {'errorMessage': 'Invalid Access Token'})
+                if self.path == '/mpesa/stkpush/v1/processrequest':
+                    return self.reply(*stub.stk_push(payload))
+                if self.path == '/mpesa/stkpushquery/v1/query':
+                    return self.reply(*stub.stk_query(payload))
+                self.reply(404, {'errorMessage': 'Not found'})
+
+        return Handler
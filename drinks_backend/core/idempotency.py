@@ -0,0 +1,94 @@
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def key_owner(request, fingerprint):
+    '''Who a key belongs to: the user, else the anonymous caller's exact request.'''
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'anonymous:{fingerprint}'
+
+
+class IdempotentCreateMixin:
+    '''Honour an Idempotency-Key header on create.
+
+    The first request claims the key through a unique constraint, so
+    concurrent duplicates collapse onto one write. The response is stored in
+    the same transaction as the created rows; retries inside the TTL get it
+    back without touching the serializer. A claim that never completed
+    (crashed worker) can be taken over after claim_timeout seconds.
+    '''
+    idempotency_scope = None
+    claim_timeout = 60
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response({'error': f'{HEADER} is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request.data)
+        claim, existing = self.claim_idempotency_key(key_owner(request, fingerprint), key, fingerprint)
+        if claim is None:
+            return self.replay(existing, fingerprint)
+
+        try:
+            with transaction.atomic():
+                response = super().create(request, *args, **kwargs)
+                claim.status_code = response.status_code
+                claim.response = response.data
+                claim.save(update_fields=['status_code', 'response'])
+        except Exception:
+            # Nothing was written, so a retry may run the request again
+            claim.delete()
+            raise
+        return response
+
+    def claim_idempotency_key(self, owner, key, fingerprint):
+        '''Return (claim, None) if this request owns the key, else (None, existing row).'''
+        scope = self.idempotency_scope or self.basename
+        now = timezone.now()
+        claims = IdempotencyKey.objects.filter(scope=scope, owner=owner, key=key)
+        existing = claims.first()
+        if existing is not None:
+            abandoned = existing.status_code is None and existing.created_at < now - timedelta(seconds=self.claim_timeout)
+            if existing.expires_at > now and not abandoned:
+                return None, existing
+            IdempotencyKey.objects.filter(pk=existing.pk).delete()
+
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    scope=scope, owner=owner, key=key, request_hash=fingerprint,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                ), None
+        except IntegrityError:
+            # A concurrent request claimed it first
+            return None, claims.first()
+
+    def replay(self, existing, fingerprint):
+        if existing is None or existing.status_code is None:
+            return Response(
+                {'error': f'A request with this {HEADER} is still in progress'},
+                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'},
+            )
+        if existing.request_hash != fingerprint:
+            return Response(
+                {'error': f'{HEADER} was already used with a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        return Response(existing.response, status=existing.status_code, headers={'Idempotent-Replayed': 'true'})
@@ -0,0 +1,126 @@
+import io
+import os
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+VARIANT_WIDTHS = (320, 640, 1024)
+# (extension, Pillow format, save options); quality chosen for product shots on a grid
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+VARIANTS_DIR = 'variants'
+
+
+class ImageProcessingError(Exception):
+    pass
+
+
+def variant_name(name, width, extension):
+    '''products/tusker.jpg -> products/variants/tusker-jpg-320w.webp
+
+    The source extension is kept so tusker.jpg and tusker.png, which
+    storage allows side by side, do not overwrite each other's variants.
+    '''
+    directory, filename = os.path.split(name)
+    stem, source_extension = os.path.splitext(filename)
+    if source_extension:
+        stem = f'{stem}-{source_extension[1:].lower()}'
+    return os.path.join(directory, VARIANTS_DIR, f'{stem}-{width}w.{extension}')
+
+
+def render_variants(source):
+    '''Yield (width, extension, bytes) for every variant of an image file object.
+
+    EXIF orientation is applied first and nothing but pixels is written, so
+    camera metadata (GPS, device, timestamps) does not reach the storefront.
+    Widths larger than the original are skipped rather than upscaled.
+    '''
+    # Pillow is only needed by the background task, not by every worker at boot
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(source)
+        # JPEG can decode straight to a smaller scale, which is much cheaper for camera photos
+        image.draft('RGB', (max(VARIANT_WIDTHS), max(VARIANT_WIDTHS)))
+        image = ImageOps.exif_transpose(image)
+    except OSError as e:  # includes UnidentifiedImageError
+        raise ImageProcessingError(f'Cannot read image: {e}')
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    widths = [width for width in VARIANT_WIDTHS if width < image.width] or [image.width]
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.convert('RGBA' if has_alpha else 'RGB').resize((width, height), Image.Resampling.LANCZOS)
+        for extension, image_format, options in VARIANT_FORMATS:
+            frame = resized
+            if image_format == 'JPEG' and has_alpha:
+                # JPEG has no alpha channel: flatten onto white like the storefront background
+                frame = Image.new('RGB', resized.size, 'white')
+                frame.paste(resized, mask=resized.getchannel('A'))
+            buffer = io.BytesIO()
+            frame.save(buffer, image_format, **options)
+            yield width, extension, buffer.getvalue()
+
+
+def generate_variants(name, storage=default_storage):
+    '''Write all variants of a stored image; returns {extension: {width: variant name}}.
+
+    Safe to call from worker processes: it only touches storage, never the database.
+    '''
+    variants = {}
+    with storage.open(name, 'rb') as source:
+        for width, extension, content in render_variants(source):
+            target = variant_name(name, width, extension)
+            if storage.exists(target):
+                storage.delete(target)
+            variants.setdefault(extension, {})[str(width)] = storage.save(target, ContentFile(content))
+    return variants
+
+
+def delete_variants(variants, storage=default_storage):
+    '''Remove the stored files of a {extension: {width: variant name}} set.'''
+    for sizes in (variants or {}).values():
+        for name in sizes.values():
+            storage.delete(name)
+
+
+def process_product_image(model_label, pk, name):
+    '''Background task: build variants for one product image and store their names.'''
+    from .cache import invalidate_catalogue
+
+    variants = generate_variants(name)
+    model = apps.get_model(model_label)
+    # Skip the write if another upload replaced the image in the meantime
+    if model.objects.filter(pk=pk, image=name).update(image_variants=variants, updated_at=timezone.now()):
+        invalidate_catalogue()
+    else:
+        delete_variants(variants)
+    return variants
+
+
+def delete_variants_on_commit(variants):
+    if variants:
+        transaction.on_commit(lambda: delete_variants(variants))
+
+
+def queue_image_variants(instances):
+    '''Schedule variant generation after the current transaction commits.'''
+    from .background import submit
+
+    for instance in instances:
+        if instance.image:
+            label, pk, name = instance._meta.label, instance.pk, instance.image.name
+            transaction.on_commit(lambda: submit(process_product_image, label, pk, name))
+
+
+def variant_urls(variants, storage=default_storage, build_url=None):
+    '''Map stored variant names to URLs for API responses.'''
+    build_url = build_url or (lambda url: url)
+    return {
+        extension: {width: build_url(storage.url(name)) for width, name in sizes.items()}
+        for extension, sizes in (variants or {}).items()
+    }
@@ -0,0 +1,325 @@
+import logging
+import os
+import re
+import tempfile
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .cache import invalidate_catalogue
+from .models import Drinks, DrinksCategory, ImportJob
+from .search import index_products
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_HEADERS = {'name', 'description', 'category', 'price'}
+UPLOAD_NAME_RE = re.compile(r'import-(\d+)-\w+\.csv')
+
+
+class CSVFileError(Exception):
+    '''The uploaded file cannot be read as a drinks CSV.'''
+
+
+def iter_csv_chunks(file, chunksize=200):
+    '''Yield validated chunks of a drinks CSV without reading the whole file.
+
+    Rows missing a required value are dropped and names are de-duplicated
+    across chunks (first occurrence wins), so memory stays bounded by the
+    chunk size plus the set of names seen so far.
+    '''
+    # pandas (and numpy) cost ~0.7s and tens of MB per worker; load them on the first import only
+    import pandas
+
+    seen = set()
+    try:
+        reader = pandas.read_csv(
+            file,
+            chunksize=chunksize,
+            dtype={'price': str},  # Handle price as string initially
+            on_bad_lines='skip'  # Skip malformed rows
+        )
+        for number, chunk in enumerate(reader):
+            if number == 0 and (missing := REQUIRED_HEADERS - set(chunk.columns)):
+                raise CSVFileError(f"Missing headers: {missing}")
+
+            chunk = chunk.dropna(subset=['name', 'description', 'category', 'price'])
+            chunk = chunk.drop_duplicates(subset=['name'])
+            # Plain set lookups; Series.isin() would copy the whole set on every chunk
+            chunk = chunk[[name not in seen for name in chunk['name']]]
+            seen.update(chunk['name'])
+            yield chunk
+    except CSVFileError:
+        raise
+    except Exception as e:
+        logger.error(f"CSV read failed: {str(e)}")
+        raise CSVFileError(f"Invalid CSV file: {str(e)}")
+
+
+class DrinksImporter:
+    '''Set-based import of drink rows into the catalogue.
+
+    Rows are validated up front, categories are resolved for the whole frame
+    with one lookup plus one bulk_create, and drinks are split into inserts
+    and updates by a bulk name lookup per batch.
+    '''
+    batch_size = 100
+    max_errors = 100  # Only a sample is kept; error_count has the total
+    update_fields = ['description', 'price', 'category', 'updated_at']
+
+    def __init__(self, batch_size=None, on_progress=None):
+        if batch_size:
+            self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self.error_count = 0
+        self._categories = {}
+        self._batch_number = 0
+
+    def import_csv(self, file, chunksize=200):
+        '''Stream a CSV file through the importer one chunk at a time.
+
+        Raises CSVFileError if the file is unreadable before any row was
+        imported; a read failure part-way through is reported as an error.
+        '''
+        try:
+            for chunk in iter_csv_chunks(file, chunksize):
+                self.import_frame(chunk)
+                if self.on_progress:
+                    self.on_progress(self)
+        except CSVFileError as e:
+            if not self.rows:
+                raise
+            self.add_error(f"Stopped after {self.rows} rows: {str(e)}")
+
+    def import_frame(self, df):
+        '''Import a validated DataFrame; the index is used for error row numbers.'''
+        self.rows += len(df)
+        rows = []
+        for index, row in zip(df.index, df.to_dict('records')):
+            try:
+                rows.append((index, *self.parse_row(row)))
+            except Exception as e:
+                self.add_error(f"Row {index+2}: {str(e)}")
+                logger.warning(f"Row error: {e}")
+
+        self.resolve_categories({category for _, _, category, _ in rows})
+
+        for i in range(0, len(rows), self.batch_size):
+            self._batch_number += 1
+            try:
+                with transaction.atomic():
+                    self.write_batch(rows[i:i + self.batch_size])
+            except Exception as e:
+                self.add_error(f"Batch {self._batch_number} failed: {str(e)}")
+                logger.error(f"Batch failed: {e}")
+
+    def add_error(self, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(message)
+
+    def parse_row(self, row):
+        name = str(row['name']).strip()
+        if not name:
+            raise ValueError("Name cannot be empty")
+
+        # Handle price conversion
+        try:
+            price_str = str(row['price']).replace(',', '').strip()
+            price = max(0, float(price_str))
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid price: {row['price']}")
+
+        category = str(row['category']).strip()
+        if not category:
+            raise ValueError("Category cannot be empty")
+
+        values = {
+            'description': str(row.get('description', ''))[:255],
+            'price': price,
+        }
+        # Ensure max_length compliance
+        return name[:100], category[:50], values
+
+    def resolve_categories(self, names):
+        missing = set(names) - self._categories.keys()
+        if not missing:
+            return
+
+        # Oldest row wins when a category name is duplicated
+        for category in DrinksCategory.objects.filter(name__in=missing).order_by('-id'):
+            self._categories[category.name] = category
+
+        new = [DrinksCategory(name=name) for name in missing - self._categories.keys()]
+        if new:
+            DrinksCategory.objects.bulk_create(new)
+            # bulk_create does not return ids on every backend
+            for category in DrinksCategory.objects.filter(name__in=[c.name for c in new]):
+                self._categories.setdefault(category.name, category)
+
+    def write_batch(self, rows):
+        existing = {}
+        for drink in Drinks.objects.filter(name__in={name for _, name, _, _ in rows}).order_by('-id'):
+            existing[drink.name] = drink
+
+        to_create = {}
+        to_update = {}
+        updated = 0
+        now = timezone.now()
+        touched = {drink.category_id for drink in existing.values()}
+        for _, name, category, values in rows:
+            drink = existing.get(name) or to_create.get(name)
+            if drink is None:
+                to_create[name] = Drinks(name=name, category=self._categories[category], **values)
+                continue
+            for attr, value in values.items():
+                setattr(drink, attr, value)
+            drink.category = self._categories[category]
+            # bulk_update does not apply auto_now
+            drink.updated_at = now
+            if drink.pk:
+                to_update[name] = drink
+            updated += 1
+
+        if to_create:
+            Drinks.objects.bulk_create(to_create.values())
+        if to_update:
+            Drinks.objects.bulk_update(to_update.values(), self.update_fields)
+
+        # Bulk writes skip model signals, so keep category counts and search in step here
+        touched.update(self._categories[category].pk for _, _, category, _ in rows)
+        DrinksCategory.objects.filter(pk__in=touched).refresh_product_counts()
+        written = [*to_create.values(), *to_update.values()]
+        # Backends without RETURNING leave created rows without a pk
+        if any(drink.pk is None for drink in written):
+            written = Drinks.objects.filter(name__in=to_create.keys() | to_update.keys())
+        index_products(Drinks, written)
+        self.created += len(to_create)
+        self.updated += updated
+
+
+def store_upload(job_id, upload):
+    '''Copy an uploaded CSV into IMPORT_UPLOAD_DIR for its job; returns the path.'''
+    os.makedirs(settings.IMPORT_UPLOAD_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        prefix=f'import-{job_id}-', suffix='.csv', dir=settings.IMPORT_UPLOAD_DIR, delete=False,
+    ) as stored:
+        try:
+            for chunk in upload.chunks():
+                stored.write(chunk)
+        except BaseException:
+            remove_upload(stored.name)
+            raise
+    return stored.name
+
+
+def remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def fail_stale_import_jobs():
+    '''Fail jobs whose worker died with its process (a restart or deploy); returns how many.
+
+    A running job saves progress after every chunk, so one silent for
+    IMPORT_JOB_STALE_AFTER has lost its worker. A queued job may only be
+    waiting behind a long import, so it gets IMPORT_QUEUED_JOB_STALE_AFTER.
+    '''
+    now = timezone.now()
+    stale = ImportJob.objects.filter(
+        Q(status='running', updated_at__lt=now - timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER))
+        | Q(status='queued', updated_at__lt=now - timedelta(seconds=settings.IMPORT_QUEUED_JOB_STALE_AFTER))
+    )
+    failed = 0
+    for job in stale:
+        # Matching updated_at skips jobs that made progress since they were read
+        failed += ImportJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+            status='failed',
+            error_count=job.error_count + 1,
+            errors=[*job.errors, 'Import interrupted; upload the file again'],
+            finished_at=now,
+            updated_at=now,
+        )
+    return failed
+
+
+def remove_orphaned_uploads():
+    '''Delete stored uploads older than the stale cutoff that no live job will read; returns how many.
+
+    That covers uploads whose request rolled back after the file was written,
+    and those of jobs failed by fail_stale_import_jobs.
+    '''
+    cutoff = time.time() - settings.IMPORT_JOB_STALE_AFTER
+    try:
+        entries = list(os.scandir(settings.IMPORT_UPLOAD_DIR))
+    except FileNotFoundError:
+        return 0
+    old = {}
+    for entry in entries:
+        match = UPLOAD_NAME_RE.fullmatch(entry.name)
+        if match and entry.stat().st_mtime < cutoff:
+            old[entry.path] = int(match[1])
+    if not old:
+        return 0
+    live = set(
+        ImportJob.objects.filter(pk__in=old.values(), status__in=ImportJob.ACTIVE).values_list('pk', flat=True)
+    )
+    orphaned = [path for path, job_id in old.items() if job_id not in live]
+    for path in orphaned:
+        remove_upload(path)
+    return len(orphaned)
+
+
+def run_import_job(job_id, path):
+    '''Import a stored CSV for an ImportJob, recording progress after every chunk.
+
+    The file is deleted whatever happens. Jobs that are no longer queued,
+    such as ones already failed as stale, are not run.
+    '''
+    try:
+        return _run_import_job(job_id, path)
+    finally:
+        remove_upload(path)
+
+
+def _run_import_job(job_id, path):
+    jobs = ImportJob.objects.filter(pk=job_id)
+
+    def save_progress(importer, **extra):
+        jobs.update(
+            rows_processed=importer.rows,
+            created=importer.created,
+            updated=importer.updated,
+            error_count=importer.error_count,
+            errors=importer.errors,
+            updated_at=timezone.now(),
+            **extra
+        )
+
+    if not jobs.filter(status='queued').update(status='running', updated_at=timezone.now()):
+        logger.warning(f"Import job {job_id} is no longer queued; skipping it")
+        return None
+    importer = DrinksImporter(on_progress=save_progress)
+    try:
+        with open(path, 'rb') as file:
+            importer.import_csv(file)
+    except CSVFileError as e:
+        importer.add_error(str(e))
+        save_progress(importer, status='failed', finished_at=timezone.now())
+    except Exception as e:
+        logger.exception(f"Import job {job_id} failed")
+        importer.add_error(f"Import failed: {str(e)}")
+        save_progress(importer, status='failed', finished_at=timezone.now())
+    else:
+        save_progress(importer, status='completed', finished_at=timezone.now())
+    finally:
+        # Bulk writes bypass model signals
+        invalidate_catalogue()
+    return importer
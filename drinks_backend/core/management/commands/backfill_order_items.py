@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from core.models import Order, OrderItem
+from core.orders import build_order_items
+
+
+class Command(BaseCommand):
+    help = 'Create order_items rows from the products JSON of orders that have none.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending = Order.objects.filter(~Exists(OrderItem.objects.filter(order=OuterRef('pk'))))
+        last_pk = 0
+        orders = items = 0
+        while True:
+            # Keyset batches keep each read short and let the command resume after a failure
+            batch = list(pending.filter(pk__gt=last_pk).order_by('pk').only('pk', 'products')[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                created = OrderItem.objects.bulk_create(build_order_items(batch))
+            orders += len(batch)
+            items += len(created)
+            last_pk = batch[-1].pk
+            self.stdout.write(f'{orders} orders, {items} items')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {items} items for {orders} orders'))
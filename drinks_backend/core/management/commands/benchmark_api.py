@@ -0,0 +1,172 @@
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core.benchmarks import measure, scratch_database
+from core.cache import invalidate_catalogue
+from core.models import CustomUser, Drinks
+from core.testing import seed_data
+
+
+def upload_file(name, rows):
+    f = io.StringIO()
+    f.write('name,description,category,price\n')
+    for row in range(rows):
+        f.write(f'{name} {row},Uploaded drink {row},Upload Category {row % 10},{100 + row}\n')
+    upload = io.BytesIO(f.getvalue().encode())
+    upload.name = f'{name}.csv'
+    return upload
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the REST API in-process against seeded scratch databases: latency percentiles, '
+        'queries and peak Python memory per request, written as JSON and optionally compared to a baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10_000], help='Rows of each model to seed')
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--profile-requests', type=int, default=10, help='Requests traced for queries and memory')
+        parser.add_argument('--upload-rows', type=int, default=200, help='Rows per upload-csv request')
+        parser.add_argument('--only', nargs='+', help='Run only these endpoints')
+        parser.add_argument('--output', help='Write results as JSON to this path')
+        parser.add_argument('--compare', help='Baseline JSON from an earlier run; fail on regressions')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p95 increase')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0, help='Ignore p95 increases smaller than this')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        results = {}
+        for size in options['sizes']:
+            path = os.path.join(tempfile.mkdtemp(), f'benchmark_api_{size}.sqlite3')
+            with scratch_database(path):
+                started = time.perf_counter()
+                seed_data(size, prefix='Bench')
+                self.stdout.write(f'seeded {size} rows per model in {time.perf_counter() - started:.1f}s')
+                results[str(size)] = self.run(size, options)
+            # Cached responses for the scratch data must not outlive it
+            invalidate_catalogue()
+
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'cache': settings.CACHES[settings.CATALOGUE_CACHE]['BACKEND'],
+                'requests': options['requests'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"results written to {options['output']}")
+
+        if baseline:
+            regressions = self.compare(baseline['results'], results, options)
+            for line in regressions:
+                self.stderr.write(line)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}')
+            self.stdout.write(self.style.SUCCESS(f'no regressions against {options["compare"]}'))
+
+    def endpoints(self, size, options):
+        '''(name, request(i), before_each) for every benchmarked endpoint.'''
+        client = APIClient(SERVER_NAME='localhost')
+        admin = APIClient(SERVER_NAME='localhost')
+        admin.force_authenticate(CustomUser.objects.create_user(
+            email='bench@example.com', username='bench', password='bench', role='admin', is_staff=True,
+        ))
+        last_page = max(1, -(-size // settings.REST_FRAMEWORK['PAGE_SIZE']))
+        drink_pks = list(Drinks.objects.order_by('pk').values_list('pk', flat=True)[:100])
+        customer = {
+            'name': 'Bench', 'email': 'bench-customer@example.com', 'phone': '0712345678', 'county': 'Nairobi',
+            'delivery_area': 'Westlands', 'latitude': '0', 'longitude': '0',
+        }
+
+        def create_order(i):
+            return client.post('/api/orders/', {
+                'customer': customer,
+                'products': {f'Bench Drink {i % size}': {'quantity': 2}},
+                'order_total': '250',
+            }, format='json')
+
+        def upload(i):
+            with override_settings(BACKGROUND_TASKS_EAGER=True):
+                # Eager tasks: the import runs inside the request once the job row commits
+                return client.post(
+                    '/api/drinks/upload-csv/',
+                    {'file': upload_file(f'Upload {i}', options['upload_rows'])},
+                    format='multipart',
+                )
+
+        return [
+            ('drinks list (cached)', lambda i: client.get('/api/drinks/'), None),
+            ('drinks list', lambda i: client.get('/api/drinks/'), invalidate_catalogue),
+            # Numbered pages use OFFSET, so the last one shows how that scales with the table
+            ('drinks list (last page)', lambda i: client.get(f'/api/drinks/?page={last_page}'), invalidate_catalogue),
+            ('drink detail', lambda i: client.get(f'/api/drinks/{drink_pks[i % len(drink_pks)]}/'), invalidate_catalogue),
+            ('drinks-categories list', lambda i: client.get('/api/drinks-categories/'), invalidate_catalogue),
+            ('cocktails-categories list', lambda i: client.get('/api/cocktails-categories/'), invalidate_catalogue),
+            ('search', lambda i: client.get(f'/api/search/?q=bench drink {i % size}'), None),
+            ('search (typo)', lambda i: client.get('/api/search/?q=cocktial'), None),
+            ('orders list', lambda i: client.get('/api/orders/'), None),
+            ('order create', create_order, None),
+            ('revenue report', lambda i: admin.get('/api/reports/revenue/'), None),
+            (f"upload-csv ({options['upload_rows']} rows)", upload, None),
+        ]
+
+    def run(self, size, options):
+        results = {}
+        self.stdout.write(
+            f"{'endpoint':<30} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'queries':>8} {'peak KB':>9}  statuses"
+        )
+        for name, request, before_each in self.endpoints(size, options):
+            if options['only'] and name.split(' (')[0] not in options['only'] and name not in options['only']:
+                continue
+            result = measure(
+                request, repeat=options['requests'], warmup=options['warmup'],
+                profile_calls=options['profile_requests'], before_each=before_each,
+            )
+            results[name] = result
+            statuses = ' '.join(f'{code}x{count}' for code, count in result['statuses'].items())
+            self.stdout.write(
+                f"{name:<30} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                f"{result['max_ms']:>8.1f} {result['queries_max']:>8} {result['peak_kb']:>9.0f}  {statuses}"
+            )
+        return results
+
+    def compare(self, baseline, results, options):
+        '''Slower p95 beyond the tolerance, or more queries per request, than the baseline.'''
+        regressions = []
+        for size, endpoints in results.items():
+            for name, current in endpoints.items():
+                before = baseline.get(size, {}).get(name)
+                if not before:
+                    continue
+                limit = before['p95_ms'] * (1 + options['tolerance'])
+                if current['p95_ms'] > limit and current['p95_ms'] - before['p95_ms'] >= options['min_delta_ms']:
+                    regressions.append(
+                        f"{size} rows, {name}: p95 {current['p95_ms']:.1f}ms, baseline {before['p95_ms']:.1f}ms"
+                    )
+                if (current['queries_max'] or 0) > (before['queries_max'] or 0):
+                    regressions.append(
+                        f"{size} rows, {name}: {current['queries_max']} queries, baseline {before['queries_max']}"
+                    )
+        return regressions
@@ -0,0 +1,126 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.benchmarks import percentile, scratch_database
+from core.daraja_stub import DarajaStub
+from core.models import CustomerInfo, Order
+
+SERVERS = {
+    # One sync worker: pushes wait for the background pool's threads
+    'wsgi': lambda port: [
+        sys.executable, '-m', 'gunicorn', 'drinks_backend.wsgi:application',
+        '--workers', '1', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+    ],
+    # One event loop: pushes are awaited by the async views
+    'asgi': lambda port: [
+        sys.executable, '-m', 'uvicorn', 'drinks_backend.asgi:application',
+        '--workers', '1', '--port', str(port), '--log-level', 'warning', '--no-access-log',
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent STK push checkouts on one gunicorn (WSGI) and one uvicorn (ASGI) worker against a slow Daraja stub.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50, help='Parallel HTTP clients')
+        parser.add_argument('--latency', type=float, default=0.5, help='Seconds the stub waits per Daraja call')
+        parser.add_argument('--background-workers', type=int, default=settings.BACKGROUND_WORKERS, help='Background pool size under WSGI')
+        parser.add_argument('--pool-size', type=int, default=100, help='Connections to Daraja (DARJA_POOL_SIZE)')
+        parser.add_argument('--timeout', type=float, default=300)
+
+    def handle(self, *args, **options):
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('benchmark_checkout shares a scratch SQLite file with the servers; run it with a sqlite DATABASE_URL')
+
+        self.stdout.write(
+            f"{options['orders']} checkouts, {options['concurrency']} clients, {options['latency']}s Daraja latency"
+        )
+        self.stdout.write(f"{'mode':<6} {'ok':>9} {'p50 ms':>9} {'p95 ms':>9} {'all sent s':>11} {'pushes/s':>9}")
+        for mode in options['modes']:
+            path = os.path.join(tempfile.mkdtemp(), f'benchmark_checkout_{mode}.sqlite3')
+            with scratch_database(path), DarajaStub(delay=options['latency']) as stub:
+                self.run(mode, path, stub, options)
+
+    def run(self, mode, path, stub, options):
+        customer = CustomerInfo.objects.create(name='Bench', phone='0712345678')
+        Order.objects.bulk_create(
+            Order(order_id=f'CHECKOUT-{i}', customer=customer, order_total=100 + i, payment_method='mpesa')
+            for i in range(options['orders'])
+        )
+        order_ids = list(Order.objects.values_list('order_id', flat=True))
+
+        port = free_port()
+        env = dict(
+            os.environ,
+            DATABASE_URL=f'sqlite:///{path}',
+            ASYNC_VIEWS=str(mode == 'asgi'),
+            BACKGROUND_WORKERS=str(options['background_workers']),
+            DARJA_POOL_SIZE=str(options['pool_size']),
+            DARJA_BASE_URL=stub.base_url,
+            DARJA_CONSUMER_KEY='bench', DARJA_CONSUMER_SECRET='bench',
+            DARJA_SHORTCODE='174379', DARJA_PASSKEY='passkey',
+            MPESA_CALLBACK_URL=f'http://127.0.0.1:{port}/api/payments/mpesa/callback/', MPESA_CALLBACK_TOKEN='bench',
+            SLOW_REQUEST_MS='0',
+        )
+        server = subprocess.Popen(SERVERS[mode](port), env=env, cwd=settings.BASE_DIR)
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            self.wait_until_up(base_url, server)
+            self.stdout.write(self.checkout(mode, base_url, order_ids, stub, options))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    def wait_until_up(self, base_url, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'Server exited with {server.returncode}')
+            try:
+                requests.get(f'{base_url}/api/drinks-categories/', timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        raise CommandError(f'Server did not start within {timeout}s')
+
+    def checkout(self, mode, base_url, order_ids, stub, options):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=options['concurrency'])
+        session.mount('http://', adapter)
+
+        def post(order_id):
+            started = time.perf_counter()
+            response = session.post(f'{base_url}/api/orders/{order_id}/stk-push/', json={}, timeout=options['timeout'])
+            return response.status_code, (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(post, order_ids))
+
+        # Under WSGI the response comes before the push; wait until Daraja has seen them all
+        while stub.stk_pushes < len(order_ids) and time.perf_counter() - started < options['timeout']:
+            time.sleep(0.05)
+        sent_in = time.perf_counter() - started
+
+        latencies = [latency for _, latency in results]
+        ok = sum(code == 202 for code, _ in results)
+        return (
+            f"{mode:<6} {f'{ok}/{len(results)}':>9} {percentile(latencies, 50):>9.0f} {percentile(latencies, 95):>9.0f} "
+            f"{sent_in:>11.2f} {stub.stk_pushes / sent_in:>9.1f}"
+        )
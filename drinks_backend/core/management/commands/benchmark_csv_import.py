@@ -0,0 +1,116 @@
+import contextlib
+import csv
+import io
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core.benchmarks import peak_rss_mb
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'description', 'category', 'price'])
+        for i in range(rows):
+            writer.writerow([f'Benchmark Drink {i}', f'Description for drink {i}', f'Category {i % 25}', 100 + i % 5000])
+
+
+def run_import(path, chunksize, write, results):
+    '''Runs in a fresh process so ru_maxrss only reflects this import.'''
+    import django
+    django.setup()
+    from core.benchmarks import scratch_database
+    from core.importer import DrinksImporter, iter_csv_chunks
+    from core.models import Drinks, DrinksCategory
+
+    database = scratch_database(f'{path}.sqlite3') if write else contextlib.nullcontext()
+    with database:
+        before_imports = peak_rss_mb()
+        # Load pandas' CSV parser and the ORM's query machinery first, so the
+        # delta below is the streaming import and not one-off module loading
+        for _ in iter_csv_chunks(io.StringIO('name,description,category,price\nWarm-up,Warm-up,Warm-up,1\n')):
+            pass
+        if write:
+            Drinks.objects.exists()
+            DrinksCategory.objects.exists()
+        baseline = peak_rss_mb()
+        started = time.perf_counter()
+        rows = 0
+        with open(path) as f:
+            if write:
+                importer = DrinksImporter()
+                importer.import_csv(f, chunksize)
+                rows = importer.rows
+            else:
+                for chunk in iter_csv_chunks(f, chunksize):
+                    rows += len(chunk)
+        seconds = time.perf_counter() - started
+
+    results.put({
+        'rows': rows,
+        'seconds': seconds,
+        'imports_mb': baseline - before_imports,
+        'baseline_mb': baseline,
+        'peak_mb': peak_rss_mb(),
+    })
+
+
+class Command(BaseCommand):
+    help = 'Measure peak RSS of the streaming CSV import for several input sizes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--chunksize', type=int, default=200)
+        parser.add_argument('--no-write', action='store_true', help='Only read and validate, skip database writes.')
+        parser.add_argument('--timeout', type=float, default=1800, help='Seconds to wait for each import')
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('spawn')
+        self.stdout.write(
+            f"{'rows':>10} {'seconds':>9} {'imports MB':>11} {'baseline MB':>12} {'peak MB':>9} {'delta MB':>9}"
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for size in options['sizes']:
+                path = os.path.join(tmp, f'drinks_{size}.csv')
+                write_csv(path, size)
+
+                results = context.Queue()
+                process = context.Process(
+                    target=run_import,
+                    args=(path, options['chunksize'], not options['no_write'], results),
+                )
+                process.start()
+                try:
+                    result = self.wait_for(process, results, options['timeout'])
+                finally:
+                    if process.is_alive():
+                        process.kill()
+                    process.join()
+                    os.remove(path)
+
+                self.stdout.write(
+                    f"{result['rows']:>10} {result['seconds']:>9.2f} {result['imports_mb']:>11.1f} {result['baseline_mb']:>12.1f} "
+                    f"{result['peak_mb']:>9.1f} {result['peak_mb'] - result['baseline_mb']:>9.1f}"
+                )
+
+    def wait_for(self, process, results, timeout):
+        '''The worker's result, or CommandError if it died or ran out of time first.'''
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                # Short waits so a crashed worker is noticed without waiting out the timeout
+                return results.get(timeout=min(1, max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            if not process.is_alive():
+                # The result may have landed just before the process exited
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    raise CommandError(f'Import worker exited with code {process.exitcode} before reporting')
+            if time.monotonic() >= deadline:
+                raise CommandError(f'Import worker did not finish within {timeout}s')
@@ -0,0 +1,44 @@
+import random
+import string
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from core.benchmarks import scratch_database
+from core.models import CustomerInfo, Order, generate_order_id
+
+
+def legacy_order_id():
+    '''The previous generator: a random id checked against the table until unused.'''
+    while True:
+        random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+        order_id = f"ORD-{int(time.time())}-{random_part}"
+        if not Order.objects.filter(order_id=order_id).exists():
+            return order_id
+
+
+class Command(BaseCommand):
+    help = 'Compare checkout insert throughput of the legacy and time-ordered order id generators.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            customer = CustomerInfo.objects.create(name='Benchmark', email='bench@example.com', phone='0700000000')
+            self.stdout.write(f"{'generator':<14} {'orders/s':>10} {'queries/order':>14}")
+            for label, make_id in (('legacy', legacy_order_id), ('time-ordered', None)):
+                Order.objects.all().delete()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for _ in range(options['orders']):
+                        order = Order(customer=customer, products={'Tusker': {'quantity': 1}}, order_total='250')
+                        if make_id:
+                            order.order_id = make_id()
+                        order.save()
+                    seconds = time.perf_counter() - started
+                self.stdout.write(
+                    f"{label:<14} {options['orders'] / seconds:>10.0f} {len(queries) / options['orders']:>14.2f}"
+                )
+            sample = generate_order_id()
+            self.stdout.write(f"sample id: {sample}")
@@ -0,0 +1,47 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from core.models import Drinks, Order, OrderItem
+from core.urls import router
+
+
+def hot_queries():
+    '''Dashboard and import lookups that must stay on an index as tables grow.'''
+    since = timezone.now() - timedelta(days=7)
+    return [
+        ('orders by status, last 7 days',
+         Order.objects.filter(status='initiated', created_at__gte=since).order_by('-created_at')),
+        ('orders by payment method, last 7 days',
+         Order.objects.filter(payment_method='mpesa', created_at__gte=since).order_by('-created_at')),
+        ('orders for a customer', Order.objects.filter(customer_id=1).order_by('-created_at')),
+        ('drinks in a category', Drinks.objects.filter(category_id=1).order_by('name')),
+        ('drinks by name (CSV import)', Drinks.objects.filter(name__in=['Tusker', 'Gilbeys'])),
+        ('units sold of a drink, last 7 days',
+         OrderItem.objects.filter(drink_id=1, order__created_at__gte=since).values('drink_id').annotate(units=Sum('quantity'))),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Print the database query plan for every list endpoint and the dashboard's hot queries."
+
+    def handle(self, *args, **options):
+        page_size = api_settings.PAGE_SIZE
+        for prefix, viewset, _ in router.registry:
+            if not hasattr(viewset, 'get_queryset'):
+                continue
+            view = viewset(action='list', request=None, format_kwarg=None, kwargs={})
+            queryset = view.get_queryset()
+            ordering = getattr(view, 'cursor_ordering', None)
+            if ordering:
+                queryset = queryset.order_by(*ordering)
+            self.report(f'GET /api/{prefix}/', queryset[:page_size])
+
+        for label, queryset in hot_queries():
+            self.report(label, queryset)
+
+    def report(self, label, queryset):
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        self.stdout.write(queryset.explain())
+        self.stdout.write('')
@@ -0,0 +1,75 @@
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.cache import invalidate_catalogue
+from core.images import ImageProcessingError, delete_variants, generate_variants
+from core.models import Cocktails, Drinks
+
+
+def build(task):
+    '''Runs in a worker process; only touches storage, never the database.'''
+    pk, name = task
+    try:
+        return pk, name, generate_variants(name), None
+    except (ImageProcessingError, OSError) as e:
+        return pk, name, None, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG variants for existing product images using a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='0 runs in this process')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--force', action='store_true', help='Rebuild products that already have variants')
+
+    def handle(self, *args, **options):
+        if options['workers']:
+            context = multiprocessing.get_context('spawn')
+            pool = ProcessPoolExecutor(max_workers=options['workers'], mp_context=context, initializer=django.setup)
+        else:
+            pool = contextlib.nullcontext()
+        with pool:
+            run = pool.map if options['workers'] else map
+            for model in (Drinks, Cocktails):
+                done, failed = self.backfill(run, model, options['batch_size'], options['force'])
+                self.stdout.write(f'{model._meta.verbose_name_plural}: {done} processed, {failed} failed')
+        invalidate_catalogue()
+
+    def backfill(self, run, model, batch_size, force):
+        pending = model.objects.exclude(image='').exclude(image__isnull=True)
+        if not force:
+            pending = pending.filter(image_variants={})
+
+        done = failed = 0
+        last_pk = 0
+        while True:
+            rows = list(pending.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'image', 'image_variants')[:batch_size])
+            if not rows:
+                return done, failed
+            last_pk = rows[-1][0]
+            previous = {pk: variants for pk, _, variants in rows}
+
+            now = timezone.now()
+            updates = []
+            stale = []
+            for pk, name, variants, error in run(build, [(pk, name) for pk, name, _ in rows]):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                updates.append(model(pk=pk, image_variants=variants, updated_at=now))
+                # Files from older naming schemes that this rebuild did not overwrite
+                kept = {variant for sizes in variants.values() for variant in sizes.values()}
+                stale.append({
+                    extension: {width: old for width, old in sizes.items() if old not in kept}
+                    for extension, sizes in (previous[pk] or {}).items()
+                })
+            model.objects.bulk_update(updates, ['image_variants', 'updated_at'])
+            for variants in stale:
+                delete_variants(variants)
+            done += len(updates)
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from core.benchmarks import percentile, scratch_database
+from core.daraja_stub import DarajaStub
+from core.models import CustomerInfo, Order
+from core.stk_push import DarajaClient, set_client
+
+
+class Command(BaseCommand):
+    help = 'Push many concurrent checkouts through the STK push endpoint and callback against a local Daraja stub.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=300)
+        parser.add_argument('--concurrency', type=int, default=50, help='Parallel HTTP clients')
+        parser.add_argument('--workers', type=int, default=settings.BACKGROUND_WORKERS, help='Background pool size')
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stub waits per Daraja call')
+        parser.add_argument('--timeout', type=float, default=120)
+
+    def handle(self, *args, **options):
+        # The pool is created lazily, so this takes effect for this run
+        settings.BACKGROUND_WORKERS = options['workers']
+        # A file database: shared in-memory SQLite fails writers with "table is locked" instead of waiting
+        path = os.path.join(tempfile.mkdtemp(), 'load_test_stk_push.sqlite3')
+        with scratch_database(path), DarajaStub(delay=options['latency']) as stub, \
+                override_settings(MPESA_CALLBACK_TOKEN='load'):
+            previous = set_client(DarajaClient(
+                base_url=stub.base_url, consumer_key='load', consumer_secret='test',
+                shortcode='174379', passkey='passkey', callback_url='http://localhost/api/payments/mpesa/callback/',
+                callback_token='load', pool_size=options['workers'],
+            ))
+            try:
+                self.run(stub, options)
+            finally:
+                set_client(previous)
+
+    def run(self, stub, options):
+        customer = CustomerInfo.objects.create(name='Load', email='load@example.com', phone='0712345678')
+        Order.objects.bulk_create(
+            Order(order_id=f'LOAD-{i}', customer=customer, order_total=100 + i, payment_method='mpesa')
+            for i in range(options['orders'])
+        )
+        order_ids = list(Order.objects.values_list('order_id', flat=True))
+
+        def post(path, data):
+            try:
+                started = time.perf_counter()
+                response = Client(SERVER_NAME='localhost', raise_request_exception=False).post(path, data, content_type='application/json')
+                return response.status_code, time.perf_counter() - started
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            pushes = list(pool.map(lambda order_id: post(f'/api/orders/{order_id}/stk-push/', {}), order_ids))
+        accepted_in = time.perf_counter() - started
+
+        # The endpoint returns at once; wait for the background pool to reach Daraja
+        pending = Order.objects.filter(checkout_request_id__isnull=True, status='initiated')
+        while pending.exists() and time.perf_counter() - started < options['timeout']:
+            time.sleep(0.05)
+        dispatched_in = time.perf_counter() - started
+
+        pushed = Order.objects.exclude(checkout_request_id=None).values_list('checkout_request_id', 'mpesa_amount')
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            callbacks = list(pool.map(
+                lambda row: post('/api/payments/mpesa/callback/load/', DarajaStub.callback(row[0], amount=row[1])),
+                list(pushed),
+            ))
+        callbacks_in = time.perf_counter() - started
+
+        self.report('stk-push requests', pushes, accepted_in, 202)
+        self.stdout.write(f'background dispatch: {stub.stk_pushes} pushes, {stub.oauth_calls} token requests, done after {dispatched_in:.2f}s')
+        self.report('callbacks', callbacks, callbacks_in, 200)
+        self.stdout.write(f"orders paid: {Order.objects.filter(status='paid').count()} of {len(order_ids)}")
+
+    def report(self, label, results, seconds, expected):
+        latencies = [latency * 1000 for _, latency in results]
+        ok = sum(code == expected for code, _ in results)
+        self.stdout.write(
+            f'{label}: {ok}/{len(results)} ok in {seconds:.2f}s, '
+            f'p50 {percentile(latencies, 50):.1f}ms p95 {percentile(latencies, 95):.1f}ms max {max(latencies):.1f}ms'
+        )
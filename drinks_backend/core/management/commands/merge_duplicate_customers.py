@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Min, Value, When
+from django.utils import timezone
+from core.models import CustomerInfo, Order
+
+class Command(BaseCommand):
+    help = (
+        'Merge customers without a phone that share a normalized email and repoint their orders. '
+        'Customers with a phone are kept unique by the customer_phone_unique constraint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Duplicate groups per transaction')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        customers = CustomerInfo.objects.filter(phone_normalized='').exclude(email_normalized='')
+        groups, merged = self.merge('email_normalized', customers, options['batch_size'], options['dry_run'])
+        self.stdout.write(f'email_normalized: {groups} duplicate groups, {merged} customers merged')
+
+    def merge(self, field, customers, batch_size, dry_run):
+        duplicates = (
+            customers.values(field).annotate(rows=Count('id'), keep=Min('id')).filter(rows__gt=1).order_by(field)
+        )
+        groups = merged = 0
+        last_key = ''
+        while True:
+            # Keyset over the identity so each batch is a short indexed query
+            batch = list(duplicates.filter(**{f'{field}__gt': last_key})[:batch_size])
+            if not batch:
+                return groups, merged
+            last_key = batch[-1][field]
+            groups += len(batch)
+            keep_ids = {row[field]: row['keep'] for row in batch}
+
+            rows = customers.filter(**{f'{field}__in': keep_ids}).order_by('id').only('id', field, *CustomerInfo.DELIVERY_FIELDS)
+            keepers = {}
+            newest = {}
+            remap = {}
+            for customer in rows:
+                key = getattr(customer, field)
+                newest[key] = customer
+                if customer.pk == keep_ids[key]:
+                    keepers[key] = customer
+                else:
+                    remap[customer.pk] = keep_ids[key]
+            merged += len(remap)
+            if dry_run:
+                continue
+
+            # The oldest row keeps its id and identity; as at checkout, only the
+            # latest delivery details are taken over
+            for key, keeper in keepers.items():
+                for attr in CustomerInfo.DELIVERY_FIELDS:
+                    setattr(keeper, attr, getattr(newest[key], attr))
+                keeper.updated_at = timezone.now()
+
+            with transaction.atomic():
+                Order.objects.filter(customer_id__in=remap).update(customer_id=Case(
+                    *(When(customer_id=old, then=Value(new)) for old, new in remap.items()),
+                    output_field=IntegerField(),
+                ))
+                CustomerInfo.objects.bulk_update(keepers.values(), [*CustomerInfo.DELIVERY_FIELDS, 'updated_at'])
+                CustomerInfo.objects.filter(pk__in=remap).delete()
@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Needed only by rarely used code paths; loading them at boot is a regression
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'PIL')
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and RSS per module for a cold start of drinks_backend.wsgi.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Modules to list')
+        parser.add_argument('--max-ms', type=float, help='Fail when startup takes longer')
+        parser.add_argument('--max-rss-mb', type=float, help='Fail when the worker ends up larger')
+        parser.add_argument('--lazy', nargs='*', default=LAZY_MODULES, help='Fail if any of these load at startup')
+        parser.add_argument('--json', action='store_true', help='Print the raw measurements')
+
+    def handle(self, *args, **options):
+        result = self.probe()
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+        else:
+            self.report(result, options['top'])
+
+        problems = []
+        if options['max_ms'] and result['total_ms'] > options['max_ms']:
+            problems.append(f"startup took {result['total_ms']:.0f}ms (limit {options['max_ms']:.0f}ms)")
+        if options['max_rss_mb'] and result['rss_mb'] > options['max_rss_mb']:
+            problems.append(f"RSS is {result['rss_mb']:.1f}MB (limit {options['max_rss_mb']:.1f}MB)")
+        eager = sorted(name for name in options['lazy'] if name in result['modules'])
+        if eager:
+            problems.append(f"loaded at startup but should be lazy: {', '.join(eager)}")
+        if problems:
+            raise CommandError('; '.join(problems))
+
+    def probe(self):
+        '''Run core.startup in a fresh interpreter so nothing is already imported.'''
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'drinks_backend.settings')}
+        completed = subprocess.run(
+            [sys.executable, '-m', 'core.startup'], cwd=settings.BASE_DIR, env=env,
+            capture_output=True, text=True,
+        )
+        if completed.returncode:
+            raise CommandError(f'Startup probe failed:\n{completed.stderr}')
+        return json.loads(completed.stdout)
+
+    def report(self, result, top):
+        self.stdout.write(
+            f"wsgi application {result['wsgi_ms']:.0f}ms, with URLconf {result['total_ms']:.0f}ms, "
+            f"RSS {result['baseline_rss_mb']:.1f}MB -> {result['rss_mb']:.1f}MB, {len(result['modules'])} modules"
+        )
+        # Sum each module's own cost into its top-level package
+        packages = {}
+        for name, record in result['modules'].items():
+            package = packages.setdefault(name.partition('.')[0], {'ms': 0.0, 'rss_mb': 0.0, 'modules': 0})
+            package['ms'] += record['self_ms']
+            package['rss_mb'] += record['self_rss_mb']
+            package['modules'] += 1
+        self.stdout.write(f"{'package':<28} {'modules':>8} {'import ms':>10} {'RSS MB':>8}")
+        for name, package in sorted(packages.items(), key=lambda item: -item[1]['ms'])[:top]:
+            self.stdout.write(f"{name:<28} {package['modules']:>8} {package['ms']:>10.1f} {package['rss_mb']:>8.1f}")
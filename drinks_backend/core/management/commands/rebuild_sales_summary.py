@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from core.models import Order
+from core.rollups import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales summary from orders for a date range (default: all orders).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day, YYYY-MM-DD')
+        parser.add_argument('--end', help='Last day, YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        start = self.parse(options['start'])
+        end = self.parse(options['end']) or timezone.localdate()
+        if start is None:
+            first = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            start = timezone.localdate(first) if first else end
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        rows = rebuild_daily_sales(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} summary rows for {start} to {end}'))
+
+    def parse(self, value):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        return day
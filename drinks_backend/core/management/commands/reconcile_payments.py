@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from core.reconcile import reconcile_payments
+from core.stk_push import get_client
+
+
+class Command(BaseCommand):
+    help = 'Query Daraja for M-Pesa orders stuck in initiated and record the ones that finished.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=float, default=5, help='Only orders untouched for this long')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel Daraja queries')
+        parser.add_argument('--rate', type=float, default=10, help='Maximum Daraja queries per second')
+        parser.add_argument('--limit', type=int, help='Stop after checking this many orders')
+        parser.add_argument('--every', type=float, help='Keep running, starting a pass every N seconds')
+
+    def handle(self, *args, **options):
+        client = get_client()
+        if not all([client.consumer_key, client.consumer_secret, client.shortcode, client.passkey]):
+            # Every query would fail, which reads like Daraja having no news
+            raise CommandError('Set DARJA_CONSUMER_KEY, DARJA_CONSUMER_SECRET, DARJA_SHORTCODE and DARJA_PASSKEY')
+        while True:
+            summary = reconcile_payments(
+                stale_after=timedelta(minutes=options['stale_minutes']),
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                rate=options['rate'],
+                limit=options['limit'],
+                client=client,
+            )
+            self.stdout.write(
+                f"checked {summary['checked']} orders in {summary['batches']} batches ({summary['seconds']}s): "
+                f"{summary['paid']} paid, {summary['updaid']} unpaid, {summary['pending']} pending, {summary['errors']} errors"
+            )
+            if not options['every']:
+                break
+            time.sleep(options['every'])
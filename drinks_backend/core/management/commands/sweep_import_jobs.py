@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from core.importer import fail_stale_import_jobs, remove_orphaned_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        'Fail import jobs left queued or running by a worker that died, and delete stored uploads '
+        'no job will read. Run it where the web process keeps IMPORT_UPLOAD_DIR to reclaim files too.'
+    )
+
+    def handle(self, *args, **options):
+        failed = fail_stale_import_jobs()
+        removed = remove_orphaned_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Failed {failed} stale import jobs, deleted {removed} orphaned uploads'))
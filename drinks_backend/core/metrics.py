@@ -0,0 +1,225 @@
+import bisect
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_SAMPLED_QUERIES = 100
+
+
+class RequestMetrics:
+    '''In-process totals per (view, method, status), rendered as Prometheus text.
+
+    Every series is a handful of numbers updated under one lock, so recording
+    a request costs a dict lookup and a few additions. Totals are per process:
+    with several gunicorn workers each one reports its own.
+    '''
+
+    def __init__(self, samples=50):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.views = {}
+        self.slow_requests = deque(maxlen=samples)
+
+    def record(self, view, method, status, seconds, queries, db_seconds, size):
+        with self._lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            series = self.views.get((view, method))
+            if series is None:
+                series = self.views[(view, method)] = {
+                    'buckets': [0] * len(DURATION_BUCKETS), 'count': 0, 'seconds': 0.0,
+                    'queries': 0, 'db_seconds': 0.0, 'bytes': 0,
+                }
+            index = bisect.bisect_left(DURATION_BUCKETS, seconds)
+            if index < len(DURATION_BUCKETS):
+                series['buckets'][index] += 1
+            series['count'] += 1
+            series['seconds'] += seconds
+            series['queries'] += queries
+            series['db_seconds'] += db_seconds
+            series['bytes'] += size
+
+    def sample(self, entry):
+        with self._lock:
+            self.slow_requests.append(entry)
+
+    def samples(self):
+        with self._lock:
+            return list(reversed(self.slow_requests))
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.views.clear()
+            self.slow_requests.clear()
+
+    def render(self):
+        '''Prometheus text exposition format, version 0.0.4.'''
+        with self._lock:
+            requests = sorted(self.requests.items())
+            views = sorted((key, dict(series, buckets=list(series['buckets']))) for key, series in self.views.items())
+
+        lines = [
+            '# HELP http_requests_total Requests handled, by view, method and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (view, method, status), count in requests:
+            lines.append(f'http_requests_total{{{labels(view, method)},status="{status}"}} {count}')
+
+        lines += [
+            '# HELP http_request_duration_seconds Wall time from the middleware to the response.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (view, method), series in views:
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, series['buckets']):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels(view, method)},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels(view, method)},le="+Inf"}} {series["count"]}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels(view, method)}}} {series["seconds"]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{labels(view, method)}}} {series["count"]}')
+
+        for name, field, kind, description in (
+            ('http_request_db_queries_total', 'queries', 'd', 'Database queries run while handling requests.'),
+            ('http_request_db_duration_seconds_total', 'db_seconds', '.6f', 'Time spent in database queries.'),
+            ('http_response_size_bytes_total', 'bytes', 'd', 'Response body bytes, where the length is known.'),
+        ):
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            for (view, method), series in views:
+                lines.append(f'{name}{{{labels(view, method)}}} {series[field]:{kind}}')
+        return '\n'.join(lines) + '\n'
+
+
+def labels(view, method):
+    view = view.replace('\\', '\\\\').replace('"', '\\"')
+    return f'view="{view}",method="{method}"'
+
+
+metrics = RequestMetrics(samples=settings.SLOW_REQUEST_SAMPLES)
+
+
+def view_name(request, view_func):
+    '''ViewSet.action for DRF viewsets, the class name for class-based views, else the function.'''
+    cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        return f'{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    return cls.__name__
+
+
+class QueryTimer:
+    '''Counts and times the queries of one request, keeping the SQL only when asked to.'''
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.seconds = 0.0
+        self.sql = [] if keep_sql else None
+
+    def add(self, sql, elapsed):
+        self.count += 1
+        self.seconds += elapsed
+        if self.sql is not None and len(self.sql) < MAX_SAMPLED_QUERIES:
+            self.sql.append((sql, elapsed))
+
+
+# A context variable rather than a per-request execute_wrapper: under ASGI
+# concurrent requests share a connection, and sync_to_async copies the context
+current_timer = ContextVar('current_query_timer', default=None)
+
+
+def time_queries(execute, sql, params, many, context):
+    '''Execute wrapper installed on every connection; a no-op outside a timed request.'''
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.add(sql, time.perf_counter() - started)
+
+
+class PerformanceMiddleware:
+    '''Record wall time, query count, query time and response size per request.
+
+    Requests are tagged with the resolved view, e.g. DrinksViewSet.upload_csv,
+    and exposed by MetricsView. When SLOW_REQUEST_MS is set, the SQL of a
+    SLOW_REQUEST_SAMPLE_RATE fraction of requests is kept so that slower ones
+    can be listed with their queries. Works in sync and async stacks.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.PERFORMANCE_METRICS:
+            return self.get_response(request)
+        timer, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.finish(request, response, timer, started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.PERFORMANCE_METRICS:
+            return await self.get_response(request)
+        timer, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.finish(request, response, timer, started)
+        return response
+
+    def start(self):
+        keep_sql = settings.SLOW_REQUEST_MS is not None and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE
+        timer = QueryTimer(keep_sql)
+        return timer, current_timer.set(timer), time.perf_counter()
+
+    def finish(self, request, response, timer, started):
+        seconds = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = view_name(request, match.func) if match else 'unresolved'
+        metrics.record(view, request.method, response.status_code, seconds, timer.count, timer.seconds, response_size(response))
+
+        slow_ms = settings.SLOW_REQUEST_MS
+        if slow_ms is None or seconds * 1000 < slow_ms:
+            return
+        logger.warning('Slow request %s %s (%s): %.0fms, %d queries', request.method, request.path, view, seconds * 1000, timer.count)
+        if timer.sql is not None:
+            metrics.sample({
+                'view': view,
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'ms': round(seconds * 1000, 1),
+                'db_ms': round(timer.seconds * 1000, 1),
+                'query_count': timer.count,
+                'queries': [{'sql': sql, 'ms': round(elapsed * 1000, 2)} for sql, elapsed in timer.sql],
+                'at': time.time(),
+            })
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 11:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_product_counts(apps, schema_editor):
+    for category_name, product_name, column in (
+        ('DrinksCategory', 'Drinks', 'drinks_count'),
+        ('CocktailsCategory', 'Cocktails', 'cocktails_count'),
+    ):
+        category = apps.get_model('core', category_name)
+        product = apps.get_model('core', product_name)
+        counts = (
+            product.objects.filter(category=OuterRef('pk'))
+            .order_by().values('category').annotate(total=Count('pk')).values('total')
+        )
+        category.objects.update(**{column: Coalesce(Subquery(counts), Value(0))})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cocktailscategory',
+            name='cocktails_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='drinkscategory',
+            name='drinks_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_product_counts, migrations.RunPython.noop),
+    ]
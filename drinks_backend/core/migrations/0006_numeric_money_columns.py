@@ -0,0 +1,137 @@
+import logging
+import os
+import re
+from decimal import Decimal
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+# (model, field, max_digits of the new column)
+MONEY_FIELDS = (
+    ('Order', 'order_total', 12),
+    ('Offer', 'discount', 10),
+)
+# Set to store 0.00 for values that cannot be converted instead of failing
+COERCE_ENV = 'MONEY_MIGRATION_COERCE'
+REPORT_LINES = 50
+
+AMOUNT_RE = re.compile(
+    r'^(?:kes|kshs?|sh)?\.?\s*(-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?)\s*(?:kes|kshs?|/=|%)?$', re.IGNORECASE,
+)
+
+
+def parse_amount(value, max_digits=12):
+    '''Parse legacy strings like "KES 1,250", "1,200.50 KES", "10%" or "" (zero).
+
+    Raises ValueError for anything else, e.g. "12.5.0", and for amounts
+    the new column cannot hold.
+    '''
+    value = (value or '').strip()
+    if not value:
+        return Decimal('0.00')
+    match = AMOUNT_RE.match(value)
+    if match is None:
+        raise ValueError(f'not an amount: {value!r}')
+    amount = Decimal(match.group(1).replace(',', ''))
+    if abs(amount) >= 10 ** (max_digits - 2):
+        raise ValueError(f'too large for {max_digits} digits: {value!r}')
+    return amount.quantize(Decimal('0.01'))
+
+
+def iter_batches(model, fields):
+    '''Walk the table by primary key so each batch is a short indexed query.'''
+    last_pk = 0
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *fields)[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def strings_to_decimals(apps, schema_editor):
+    rejected = []
+    for model_name, field, max_digits in MONEY_FIELDS:
+        model = apps.get_model('core', model_name)
+        for batch in iter_batches(model, [field]):
+            for row in batch:
+                try:
+                    amount = parse_amount(getattr(row, field), max_digits)
+                except ValueError as error:
+                    rejected.append(f'{model_name} {row.pk} {field}: {error}')
+                    amount = Decimal('0.00')
+                setattr(row, f'{field}_amount', amount)
+            model.objects.bulk_update(batch, [f'{field}_amount'])
+
+    if rejected:
+        report = '\n'.join(f'    {line}' for line in rejected[:REPORT_LINES])
+        if len(rejected) > REPORT_LINES:
+            report += f'\n    ... and {len(rejected) - REPORT_LINES} more'
+        if os.getenv(COERCE_ENV) != 'True':
+            # Raising rolls the migration back, so nothing is lost
+            raise ValueError(
+                f'{len(rejected)} money values cannot be converted. Fix them, or set {COERCE_ENV}=True '
+                f'to store 0.00 for them:\n{report}'
+            )
+        logger.warning(f'Stored 0.00 for {len(rejected)} money values that could not be converted:\n{report}')
+
+
+def decimals_to_strings(apps, schema_editor):
+    for model_name, field, _ in MONEY_FIELDS:
+        model = apps.get_model('core', model_name)
+        for batch in iter_batches(model, [f'{field}_amount']):
+            for row in batch:
+                amount = getattr(row, f'{field}_amount')
+                setattr(row, field, '' if amount is None else format(amount.normalize(), 'f'))
+            model.objects.bulk_update(batch, [field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_cocktails_title_alter_contact_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='order_total_amount',
+            field=models.DecimalField(decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(strings_to_decimals, decimals_to_strings),
+        migrations.RemoveField(
+            model_name='order',
+            name='order_total',
+        ),
+        migrations.RemoveField(
+            model_name='offer',
+            name='discount',
+        ),
+        migrations.RenameField(
+            model_name='order',
+            old_name='order_total_amount',
+            new_name='order_total',
+        ),
+        migrations.RenameField(
+            model_name='offer',
+            old_name='discount_amount',
+            new_name='discount',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='offer',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+    ]
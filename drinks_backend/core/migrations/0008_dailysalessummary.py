@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_orderitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('payment_method', models.CharField(max_length=100)),
+                ('delivery_area', models.CharField(blank=True, default='', max_length=100)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Daily Sales Summary',
+                'verbose_name_plural': 'Daily Sales Summaries',
+                'constraints': [models.UniqueConstraint(fields=('day', 'status', 'payment_method', 'delivery_area'), name='daily_sales_summary_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2 on 2026-10-18 11:37
+
+import re
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+# Copies of core.models.normalize_phone/normalize_email as of this migration,
+# so later changes to them cannot alter what it writes
+def normalize_phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('0') and len(digits) == 10:
+        return '254' + digits[1:]
+    if len(digits) == 9:
+        return '254' + digits
+    return digits
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def fill_normalized_contacts(apps, schema_editor):
+    CustomerInfo = apps.get_model('core', 'CustomerInfo')
+    last_pk = 0
+    while True:
+        batch = list(CustomerInfo.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'phone', 'email')[:BATCH_SIZE])
+        if not batch:
+            break
+        for customer in batch:
+            customer.phone_normalized = normalize_phone(customer.phone)
+            customer.email_normalized = normalize_email(customer.email)
+        CustomerInfo.objects.bulk_update(batch, ['phone_normalized', 'email_normalized'])
+        last_pk = batch[-1].pk
+
+
+def copy_order_delivery_areas(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    CustomerInfo = apps.get_model('core', 'CustomerInfo')
+    areas = CustomerInfo.objects.filter(pk=OuterRef('customer_id')).values('delivery_area')[:1]
+    Order.objects.filter(customer__isnull=False).update(delivery_area=Subquery(areas))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_dailysalessummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerinfo',
+            name='email_normalized',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='customerinfo',
+            name='phone_normalized',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_area',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(fill_normalized_contacts, migrations.RunPython.noop),
+        migrations.RunPython(copy_order_delivery_areas, migrations.RunPython.noop),
+    ]
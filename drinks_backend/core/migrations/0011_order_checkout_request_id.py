@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='mpesa_receipt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.2 on 2026-10-18 12:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE core_searchdocument_fts USING fts5(
+        title, category, body,
+        content='core_searchdocument', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    # External-content FTS5: triggers keep the index in step with the table
+    """CREATE TRIGGER core_searchdocument_ai AFTER INSERT ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(rowid, title, category, body) VALUES (new.id, new.title, new.category, new.body);
+    END""",
+    """CREATE TRIGGER core_searchdocument_ad AFTER DELETE ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(core_searchdocument_fts, rowid, title, category, body)
+        VALUES ('delete', old.id, old.title, old.category, old.body);
+    END""",
+    """CREATE TRIGGER core_searchdocument_au AFTER UPDATE ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(core_searchdocument_fts, rowid, title, category, body)
+        VALUES ('delete', old.id, old.title, old.category, old.body);
+        INSERT INTO core_searchdocument_fts(rowid, title, category, body) VALUES (new.id, new.title, new.category, new.body);
+    END""",
+    # Indexed terms, for typo-tolerant matching
+    "CREATE VIRTUAL TABLE core_searchdocument_vocab USING fts5vocab(core_searchdocument_fts, 'row')",
+]
+SQLITE_BACKWARD = [
+    'DROP TABLE IF EXISTS core_searchdocument_vocab',
+    'DROP TRIGGER IF EXISTS core_searchdocument_au',
+    'DROP TRIGGER IF EXISTS core_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS core_searchdocument_ai',
+    'DROP TABLE IF EXISTS core_searchdocument_fts',
+]
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """ALTER TABLE core_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', title), 'A')
+        || setweight(to_tsvector('simple', category), 'B')
+        || setweight(to_tsvector('simple', body), 'C')
+    ) STORED""",
+    'CREATE INDEX core_searchdocument_vector_idx ON core_searchdocument USING GIN (search_vector)',
+    'CREATE INDEX core_searchdocument_title_trgm_idx ON core_searchdocument USING GIN (title gin_trgm_ops)',
+]
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS core_searchdocument_title_trgm_idx',
+    'DROP INDEX IF EXISTS core_searchdocument_vector_idx',
+    'ALTER TABLE core_searchdocument DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run_vendor_sql(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def text(value):
+    '''Flatten JSON ingredient lists like ["gin", {"name": "tonic"}] into words.'''
+    if isinstance(value, dict):
+        return ' '.join(text(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return ' '.join(text(v) for v in value)
+    return '' if value is None else str(value)
+
+
+def index_catalogue(apps, schema_editor):
+    SearchDocument = apps.get_model('core', 'SearchDocument')
+    for model_name, field, title in (('Drinks', 'drink', 'name'), ('Cocktails', 'cocktail', 'title')):
+        model = apps.get_model('core', model_name)
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(pk__gt=last_pk).select_related('category').order_by('pk')[:BATCH_SIZE])
+            if not batch:
+                break
+            SearchDocument.objects.bulk_create(
+                SearchDocument(**{
+                    field: product,
+                    'title': getattr(product, title)[:100],
+                    'category': product.category.name,
+                    'body': f"{product.description} {text(getattr(product, 'ingredients', ''))}".strip(),
+                }) for product in batch
+            )
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=100)),
+                ('category', models.CharField(blank=True, default='', max_length=50)),
+                ('body', models.TextField(blank=True, default='')),
+                ('cocktail', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='core.cocktails')),
+                ('drink', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='core.drinks')),
+            ],
+            options={
+                'verbose_name': 'Search Document',
+                'verbose_name_plural': 'Search Documents',
+            },
+        ),
+        migrations.RunPython(
+            run_vendor_sql({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_vendor_sql({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+        migrations.RunPython(index_catalogue, migrations.RunPython.noop),
+    ]
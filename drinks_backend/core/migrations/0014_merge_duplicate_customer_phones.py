@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 12:41
+
+from django.db import migrations
+from django.db.models import Count
+
+# Frozen copy of CustomerInfo.DELIVERY_FIELDS: the oldest row keeps its name,
+# email and phone and, as at checkout, takes the latest delivery details
+DELIVERY_FIELDS = ['county', 'delivery_area', 'latitude', 'longitude']
+
+
+def merge_duplicate_phones(apps, schema_editor):
+    '''Fold customers that share a normalized phone into the oldest so the constraint can be added.'''
+    CustomerInfo = apps.get_model('core', 'CustomerInfo')
+    Order = apps.get_model('core', 'Order')
+    phones = list(
+        CustomerInfo.objects.exclude(phone_normalized='').values('phone_normalized')
+        .annotate(rows=Count('id')).filter(rows__gt=1).values_list('phone_normalized', flat=True)
+    )
+    for phone in phones:
+        keeper, *duplicates = CustomerInfo.objects.filter(phone_normalized=phone).order_by('id')
+        for attr in DELIVERY_FIELDS:
+            setattr(keeper, attr, getattr(duplicates[-1], attr))
+        duplicate_ids = [customer.pk for customer in duplicates]
+        Order.objects.filter(customer_id__in=duplicate_ids).update(customer_id=keeper.pk)
+        CustomerInfo.objects.filter(pk__in=duplicate_ids).delete()
+        keeper.save(update_fields=DELIVERY_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_search_documents'),
+    ]
+
+    operations = [
+        # Separate from the constraint: PostgreSQL will not build an index on a
+        # table with deferred foreign key checks pending in the same transaction
+        migrations.RunPython(merge_duplicate_phones, migrations.RunPython.noop),
+    ]
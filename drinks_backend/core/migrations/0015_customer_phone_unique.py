@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_merge_duplicate_customer_phones'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='customerinfo',
+            constraint=models.UniqueConstraint(condition=models.Q(('phone_normalized', ''), _negated=True), fields=('phone_normalized',), name='customer_phone_unique'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 13:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_customer_phone_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerinfo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 13:30
+
+from django.db import migrations
+
+# Typo matching on PostgreSQL covers the whole document like the SQLite
+# vocabulary does, not just the title
+POSTGRES_FORWARD = [
+    """ALTER TABLE core_searchdocument ADD COLUMN search_text text GENERATED ALWAYS AS (
+        title || ' ' || category || ' ' || body
+    ) STORED""",
+    'CREATE INDEX core_searchdocument_text_trgm_idx ON core_searchdocument USING GIN (search_text gin_trgm_ops)',
+    'DROP INDEX IF EXISTS core_searchdocument_title_trgm_idx',
+]
+POSTGRES_BACKWARD = [
+    'CREATE INDEX core_searchdocument_title_trgm_idx ON core_searchdocument USING GIN (title gin_trgm_ops)',
+    'DROP INDEX IF EXISTS core_searchdocument_text_trgm_idx',
+    'ALTER TABLE core_searchdocument DROP COLUMN IF EXISTS search_text',
+]
+
+
+def run_postgres_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_customerinfo_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres_sql(POSTGRES_FORWARD), run_postgres_sql(POSTGRES_BACKWARD)),
+    ]
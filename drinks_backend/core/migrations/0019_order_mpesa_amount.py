@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_idempotency_key_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='mpesa_amount',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
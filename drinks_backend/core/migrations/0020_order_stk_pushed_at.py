@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_order_mpesa_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stk_pushed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,23 +1,48 @@
 import datetime
-from django.db import models
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Now
 from django.contrib.auth.models import AbstractUser
-import random
-import string
+import os
+import re
+import secrets
+import threading
 import time
 
-def generate_random_string(length=6):
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-
-def generate_order_id():
-    timestamp = int(time.time())
-    random_part = generate_random_string()
-    return f"ORD-{timestamp}-{random_part}"
-
-def get_unique_order_id():
-    while True:
-        order_id = generate_order_id()
-        if not Order.objects.filter(order_id=order_id).exists():
-            return order_id
+class OrderIdGenerator:
+    '''Time-ordered order ids that need no database lookup.
+
+    Ids look like ORD-<unix ms>-<node><sequence>. The node is random per
+    process and the sequence counts up within a millisecond (and across clock
+    steps backwards), so one process never repeats an id. A clash between
+    processes is left to the unique constraint on Order.order_id.
+    '''
+    def __init__(self):
+        self.reset()
+        if hasattr(os, 'register_at_fork'):
+            # gunicorn forks workers; each needs its own node and lock
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._node = secrets.randbits(24)
+        self._last_ms = 0
+        self._sequence = 0
+
+    def __call__(self):
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now > self._last_ms:
+                self._last_ms, self._sequence = now, 0
+            elif self._sequence < 0xFFFF:
+                self._sequence += 1
+            else:
+                self._last_ms, self._sequence = self._last_ms + 1, 0
+            return f"ORD-{self._last_ms}-{self._node:06X}{self._sequence:04X}"
+
+generate_order_id = OrderIdGenerator()
 
 class CustomUser(AbstractUser):
     ROLE_CHOICES = (
@@ -40,13 +65,49 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.email
 
+class CategoryQuerySet(models.QuerySet):
+    def with_product_count(self):
+        '''Annotate product_count in the same query instead of a COUNT per category.'''
+        if settings.CATEGORY_COUNTS_DENORMALIZED:
+            return self.annotate(product_count=F(self.model.product_count_field))
+        return self.annotate(product_count=Count(self.model.product_relation))
+
+    def refresh_product_counts(self):
+        '''Recompute the denormalized product count column for these categories.
+
+        The categories are locked first, in pk order. A concurrent refresh of
+        the same categories then waits for this transaction to commit, and its
+        COUNT runs on a snapshot that includes the products written here. Two
+        imports cannot each write a count that misses the other's rows.
+        '''
+        products = self.model._meta.get_field(self.model.product_relation).related_model
+        counts = (
+            products.objects.filter(category=OuterRef('pk'))
+            .order_by().values('category').annotate(total=Count('pk')).values('total')
+        )
+        # No savepoint: callers are usually already in a transaction
+        with transaction.atomic(savepoint=False):
+            pks = list(self.order_by('pk').select_for_update().values_list('pk', flat=True))
+            return self.model.objects.filter(pk__in=pks).update(**{
+                self.model.product_count_field: Coalesce(Subquery(counts), Value(0)),
+                'updated_at': Now(),
+            })
+
 class DrinksCategory(models.Model):
     '''Model definition for Drink Categories.'''
     name = models.CharField(default='', max_length=50)
     # image = models.ImageField(upload_to='categories/', default='')
     description = models.TextField()
+    drinks_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = CategoryQuerySet.as_manager()
+    product_relation = 'drinks'
+    product_count_field = 'drinks_count'
 
     def drink_product_count(self):
+        if hasattr(self, 'product_count'):
+            return self.product_count
         return self.drinks.count()
 
     class Meta:
@@ -63,8 +124,16 @@ class CocktailsCategory(models.Model):
     name = models.CharField(default='', max_length=50)
     # image = models.ImageField(upload_to='categories/', default='')
     description = models.TextField()
+    cocktails_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = CategoryQuerySet.as_manager()
+    product_relation = 'cocktails'
+    product_count_field = 'cocktails_count'
 
     def cocktail_product_count(self):
+        if hasattr(self, 'product_count'):
+            return self.product_count
         return self.cocktails.count()
 
     class Meta:
@@ -92,45 +161,74 @@ class Order(models.Model):
     order_id = models.CharField(max_length=200, unique=True, editable=False)
     customer = models.ForeignKey('CustomerInfo', on_delete=models.CASCADE, related_name='orders', null=True, blank=True)
     products = models.JSONField(default=dict)
+    # Copied from the customer at checkout so later address changes keep order history
+    delivery_area = models.CharField(max_length=100, blank=True, default='')
     status = models.CharField(max_length=20, choices=STATUS, default='initiated')
-    order_total = models.CharField(max_length=200, default='')
+    order_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     payment_method = models.CharField(max_length=100, choices=PAYMENT_METHODS,default='m-pesa')
+    # Set when Daraja accepts an STK push; the payment callback is matched on it
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True, editable=False)
+    # Whole shillings that push asked for; STK queries report success without an amount
+    mpesa_amount = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # When the last STK push was claimed; pushes are spaced by STK_PUSH_INTERVAL
+    stk_pushed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    mpesa_receipt = models.CharField(max_length=50, blank=True, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         if not self.order_id:
-            self.order_id = get_unique_order_id()
+            self.order_id = generate_order_id()
+            if not transaction.get_connection().in_atomic_block:
+                # Outside a transaction a failed insert is harmless: retry once with a new id
+                try:
+                    return super().save(*args, **kwargs)
+                except IntegrityError:
+                    if not Order.objects.filter(order_id=self.order_id).exists():
+                        raise
+                    self.order_id = generate_order_id()
         super().save(*args, **kwargs)
 
     class Meta:
         '''Meta definition for Order.'''
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            models.Index(fields=['payment_method', 'created_at'], name='order_payment_created_idx'),
+            models.Index(fields=['customer', 'created_at'], name='order_customer_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.customer} Order at {self.created_at}"
 
 class Drinks(models.Model):
     '''Model definition for Drink.'''
-    name = models.CharField(default='', max_length=50)
+    name = models.CharField(default='', max_length=50, db_index=True)
     price = models.IntegerField(default=0)
     description = models.TextField()
     category = models.ForeignKey(DrinksCategory, on_delete=models.CASCADE, related_name='drinks')
     image = models.ImageField(upload_to='products/', default='', null=True, blank=True)
+    # Resized copies of image written by core.images: {"webp": {"320": name, ...}, "jpg": {...}}
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         '''Meta definition for Drink.'''
 
         verbose_name = 'Drink'
         verbose_name_plural = 'Drinks'
+        indexes = [
+            models.Index(fields=['category', 'name'], name='drink_category_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} Details"
 
 class Cocktails(models.Model):
     '''Model definition for Cocktails'''
-    title = models.CharField(default='', max_length=50)
+    title = models.CharField(default='', max_length=50, db_index=True)
     instructions = models.JSONField(default=dict)
     time = models.CharField(default='', max_length=50)
     ingredients = models.JSONField(default=dict)
@@ -138,7 +236,9 @@ class Cocktails(models.Model):
     difficulty = models.CharField(default='', max_length=50)
     category = models.ForeignKey(CocktailsCategory, on_delete=models.CASCADE, related_name='cocktails')
     image = models.ImageField(upload_to='products/', default='', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     serve_count = models.CharField(default='', max_length=50)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         '''Meta definition for Cocktails.'''
@@ -154,7 +254,7 @@ class Contact(models.Model):
     email = models.EmailField(default='', max_length=100)
     subject = models.CharField(default='', max_length=200)
     message = models.TextField(default='')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
         '''Meta definition for Contact.'''
@@ -175,11 +275,12 @@ class Offer(models.Model):
     description = models.TextField(default='')
     category = models.CharField(default='', max_length=50)
     # image = models.ImageField(upload_to='offers/', default='')
-    discount = models.CharField(default='', max_length=50)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     code = models.CharField(default='', max_length=50)
     discount_type = models.CharField(default='percentage', choices=CHOICES, max_length=50)
     # start_date = models.DateTimeField(auto_now_add=True)
     end_date = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         '''Meta definition for Offers.'''
@@ -189,7 +290,63 @@ class Offer(models.Model):
     def __str__(self):
         return f'Offers {self.title} subject {self.end_date}'
 
+def normalize_phone(phone):
+    '''Kenyan numbers in 2547XXXXXXXX form: "0712 345 678", "+254712345678" and "712345678" all match.'''
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('0') and len(digits) == 10:
+        return '254' + digits[1:]
+    if len(digits) == 9:
+        return '254' + digits
+    return digits
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+class CustomerInfoQuerySet(models.QuerySet):
+    def matching(self, phone='', email=''):
+        '''Existing customers with the same identity, oldest first.
+
+        The phone number identifies a customer; email is only used when no
+        phone was given. Both lookups use an index on the normalized column.
+        '''
+        phone, email = normalize_phone(phone), normalize_email(email)
+        if phone:
+            return self.filter(phone_normalized=phone).order_by('id')
+        if email:
+            return self.filter(phone_normalized='', email_normalized=email).order_by('id')
+        return self.none()
+
+    def reuse_or_create(self, **data):
+        '''Checkout customer: the matching row with its delivery details refreshed, or a new one.
+
+        Name, email and phone are left as they are: matching on a phone
+        number alone must not let a checkout rewrite someone's identity.
+        Two checkouts racing to create the same phone meet at the unique
+        constraint, and the loser reuses the winner's row.
+        '''
+        customers = self.matching(data.get('phone'), data.get('email')).select_for_update()
+        customer = customers.first()
+        if customer is None:
+            try:
+                with transaction.atomic():
+                    return self.create(**data)
+            except IntegrityError:
+                customer = customers.first()
+                if customer is None:
+                    raise
+        fields = [attr for attr in self.model.DELIVERY_FIELDS if attr in data]
+        for attr in fields:
+            setattr(customer, attr, data[attr])
+        customer.save(update_fields=fields)
+        return customer
+
+
 class CustomerInfo(models.Model):
+    # Updated from the latest checkout of a returning customer
+    DELIVERY_FIELDS = ('county', 'delivery_area', 'latitude', 'longitude')
+
     county = models.CharField(max_length=100)
     name = models.CharField(max_length=100)
     latitude = models.CharField(max_length=500)
@@ -197,7 +354,159 @@ class CustomerInfo(models.Model):
     email = models.EmailField()
     phone = models.CharField(max_length=20)
     delivery_area = models.CharField(max_length=100)
-    created_at = models.DateTimeField(auto_now_add=True)
+    phone_normalized = models.CharField(max_length=20, blank=True, default='', db_index=True, editable=False)
+    email_normalized = models.CharField(max_length=254, blank=True, default='', db_index=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CustomerInfoQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone)
+        self.email_normalized = normalize_email(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'phone_normalized', 'email_normalized', 'updated_at'}
+        super().save(*args, **kwargs)
+
+    class Meta:
+        constraints = [
+            # One customer per phone; customers without one are matched on email
+            models.UniqueConstraint(
+                fields=['phone_normalized'], condition=~models.Q(phone_normalized=''), name='customer_phone_unique',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.email}"
+
+class ImportJob(models.Model):
+    '''Model definition for background CSV imports.'''
+    STATUS = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    ACTIVE = ('queued', 'running')
+    file_name = models.CharField(max_length=255, default='')
+    status = models.CharField(max_length=20, choices=STATUS, default='queued')
+    rows_processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        '''Meta definition for ImportJob.'''
+        verbose_name = 'Import Job'
+        verbose_name_plural = 'Import Jobs'
+
+    def __str__(self):
+        return f"Import {self.file_name} ({self.status})"
+
+class OrderItem(models.Model):
+    '''One product line of an order.
+
+    The name and unit price are copied at checkout so history survives
+    catalogue edits; the foreign keys are kept for product-level reports.
+    '''
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    drink = models.ForeignKey(Drinks, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_items')
+    cocktail = models.ForeignKey(Cocktails, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_items')
+    name = models.CharField(max_length=100)
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        '''Meta definition for OrderItem.'''
+        verbose_name = 'Order Item'
+        verbose_name_plural = 'Order Items'
+        indexes = [
+            # Sales per product: filter on the product, join to orders by id
+            models.Index(fields=['drink', 'order'], name='orderitem_drink_order_idx'),
+            models.Index(fields=['cocktail', 'order'], name='orderitem_cocktail_order_idx'),
+            models.Index(fields=['name'], name='orderitem_name_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.name}"
+
+class DailySalesSummary(models.Model):
+    '''Orders and revenue per local day, status, payment method and delivery area.
+
+    Kept current by core.rollups as orders change, so dashboards read a few
+    rows per day instead of scanning orders. rebuild_sales_summary recomputes
+    any date range from the orders table.
+    '''
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    payment_method = models.CharField(max_length=100)
+    delivery_area = models.CharField(max_length=100, blank=True, default='')
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        '''Meta definition for DailySalesSummary.'''
+        verbose_name = 'Daily Sales Summary'
+        verbose_name_plural = 'Daily Sales Summaries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'status', 'payment_method', 'delivery_area'], name='daily_sales_summary_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.status} {self.payment_method} {self.delivery_area}: {self.orders}"
+
+class IdempotencyKey(models.Model):
+    '''A client-supplied Idempotency-Key and the response it produced.
+
+    The row is claimed before the write runs; status_code stays null until
+    the response is stored, which marks the request as still in progress.
+    Keys belong to their caller: the user, or for anonymous callers the
+    request body, so nobody can replay another client's response.
+    '''
+    scope = models.CharField(max_length=50)
+    owner = models.CharField(max_length=80, default='')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        '''Meta definition for IdempotencyKey.'''
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'owner', 'key'], name='idempotency_key_owner_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+class SearchDocument(models.Model):
+    '''Searchable text of one drink or cocktail.
+
+    core.search keeps these rows in step with the catalogue; the full-text
+    index on top of them (FTS5 on SQLite, tsvector and trigram on
+    PostgreSQL) is created by migration 0013 and follows the table.
+    '''
+    drink = models.OneToOneField(Drinks, null=True, blank=True, on_delete=models.CASCADE, related_name='search_document')
+    cocktail = models.OneToOneField(Cocktails, null=True, blank=True, on_delete=models.CASCADE, related_name='search_document')
+    title = models.CharField(max_length=100)
+    category = models.CharField(max_length=50, blank=True, default='')
+    body = models.TextField(blank=True, default='')
+
+    class Meta:
+        '''Meta definition for SearchDocument.'''
+        verbose_name = 'Search Document'
+        verbose_name_plural = 'Search Documents'
+
+    def __str__(self):
+        return self.title
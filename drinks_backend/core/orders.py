@@ -0,0 +1,63 @@
+from decimal import Decimal, InvalidOperation
+from .models import Cocktails, Drinks, OrderItem
+
+
+def iter_product_lines(products):
+    '''Yield (name, quantity, unit_price or None) from an order's products blob.
+
+    Accepts the shapes the storefront has sent over time:
+    {"Tusker": {"quantity": 2, "price": 250}}, {"Tusker": 2} and
+    [{"name": "Tusker", "quantity": 2, "price": 250}].
+    '''
+    if isinstance(products, dict):
+        entries = (
+            {'name': name, **details} if isinstance(details, dict) else {'name': name, 'quantity': details}
+            for name, details in products.items()
+        )
+    elif isinstance(products, list):
+        entries = (entry for entry in products if isinstance(entry, dict))
+    else:
+        return
+
+    for entry in entries:
+        name = str(entry.get('name') or entry.get('title') or '').strip()
+        if not name:
+            continue
+        try:
+            quantity = max(1, int(entry.get('quantity') or 1))
+        except (TypeError, ValueError):
+            quantity = 1
+        try:
+            price = Decimal(str(entry['price'])) if entry.get('price') not in (None, '') else None
+        except InvalidOperation:
+            price = None
+        yield name[:100], quantity, price
+
+
+def build_order_items(orders):
+    '''Unsaved OrderItems for every order, resolving products in two queries.'''
+    lines = [(order, *line) for order in orders for line in iter_product_lines(order.products)]
+    names = {name for _, name, _, _ in lines}
+    if not names:
+        return []
+
+    # Oldest row wins when a product name is duplicated, as in the importer
+    drinks = {
+        drink.name: drink
+        for drink in Drinks.objects.filter(name__in=names).order_by('-id').only('id', 'name', 'price')
+    }
+    cocktails = {
+        cocktail.title: cocktail
+        for cocktail in Cocktails.objects.filter(title__in=names - drinks.keys()).order_by('-id').only('id', 'title')
+    }
+
+    items = []
+    for order, name, quantity, price in lines:
+        drink = drinks.get(name)
+        if price is None:
+            price = Decimal(drink.price) if drink else Decimal('0')
+        items.append(OrderItem(
+            order=order, drink=drink, cocktail=None if drink else cocktails.get(name),
+            name=name, quantity=quantity, unit_price=price,
+        ))
+    return items
@@ -0,0 +1,37 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class NumberedPagination(PageNumberPagination):
+    '''Classic ?page=N pagination for the admin UI.'''
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class KeysetPagination(CursorPagination):
+    '''Cursor (keyset) pagination, so deep pages cost the same as the first one.
+
+    Views set `cursor_ordering`, which must end in a unique column. Passing
+    ?page=N switches to numbered pages for clients that need page counts.
+    '''
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-id',)
+    numbered_pagination_class = NumberedPagination
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.numbered = None
+        if request.query_params.get(self.numbered_pagination_class.page_query_param):
+            self.numbered = self.numbered_pagination_class()
+            ordering = self.get_ordering(request, queryset, view)
+            return self.numbered.paginate_queryset(queryset.order_by(*ordering), request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.numbered:
+            return self.numbered.get_paginated_response(data)
+        return super().get_paginated_response(data)
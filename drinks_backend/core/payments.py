@@ -0,0 +1,152 @@
+import hmac
+import logging
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Order
+from .rollups import order_contribution, record_order_change
+from .stk_push import get_async_client, get_client, stk_amount
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ('paid', 'delivered')
+
+
+def set_order_status(order_pk, new_status, keep=(), **fields):
+    '''Change an order's status under a row lock and move it in the sales summary.
+
+    Orders whose current status is in `keep` are left alone, so a late
+    failure callback cannot undo a payment.
+    '''
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order_pk)
+        if order.status in keep:
+            return order
+        before = order_contribution(order)
+        order.status = new_status
+        for attr, value in fields.items():
+            setattr(order, attr, value)
+        order.save(update_fields=['status', *fields, 'updated_at'])
+        record_order_change(before, order_contribution(order))
+    return order
+
+
+def stk_push_error(order, phone):
+    '''Why an STK push for this order cannot be sent, or None.'''
+    if order.status in FINAL_STATUSES:
+        return f'Order is already {order.status}'
+    if not phone:
+        return 'A phone number is required'
+    return None
+
+
+def stk_push_forbidden(order, phone, user):
+    '''Anyone may prompt the phone an order was placed with; only staff may name another.'''
+    customer_phone = order.customer.phone_normalized if order.customer else ''
+    return phone != customer_phone and not user.is_staff
+
+
+def claim_stk_push(order_pk):
+    '''Reserve the next STK push for an order; False if one went out within STK_PUSH_INTERVAL.
+
+    A conditional UPDATE, so concurrent requests in any worker get one push.
+    '''
+    now = timezone.now()
+    recent = Q(stk_pushed_at__gt=now - timedelta(seconds=settings.STK_PUSH_INTERVAL))
+    return bool(Order.objects.filter(pk=order_pk).exclude(recent).update(stk_pushed_at=now))
+
+
+def release_stk_push(order_pk):
+    '''Let the push be sent again at once; Daraja never answered, so nobody was prompted.'''
+    Order.objects.filter(pk=order_pk).update(stk_pushed_at=None)
+
+
+def dispatch_stk_push(order_pk, phone):
+    '''Background task: ask Daraja to prompt the customer and remember the CheckoutRequestID.'''
+    order = Order.objects.only('pk', 'order_id', 'order_total').get(pk=order_pk)
+    try:
+        response = get_client().initiate_stk_push(phone, order.order_total, account_reference=order.order_id)
+    except (requests.RequestException, ValueError):
+        # Daraja never answered: the order stays initiated so the push can be sent again
+        logger.exception(f"STK push for order {order.order_id} failed")
+        release_stk_push(order.pk)
+        return None
+    return record_push_response(order, response)
+
+
+async def adispatch_stk_push(order, phone):
+    '''dispatch_stk_push for async views: awaits Daraja instead of holding a thread.'''
+    try:
+        response = await get_async_client().initiate_stk_push(phone, order.order_total, account_reference=order.order_id)
+    except (httpx.HTTPError, ValueError):
+        logger.exception(f"STK push for order {order.order_id} failed")
+        await sync_to_async(release_stk_push)(order.pk)
+        return None
+    return await sync_to_async(record_push_response)(order, response)
+
+
+def record_push_response(order, response):
+    '''Store the CheckoutRequestID of an accepted push, or mark the order unpaid if Daraja
+    rejected it; returns the id or None.'''
+    if str(response.get('ResponseCode')) != '0':
+        logger.warning(f"STK push for order {order.order_id} was rejected: {response}")
+        set_order_status(order.pk, 'updaid', keep=FINAL_STATUSES)
+        return None
+
+    checkout_request_id = response['CheckoutRequestID']
+    Order.objects.filter(pk=order.pk).update(
+        checkout_request_id=checkout_request_id, mpesa_amount=stk_amount(order.order_total), updated_at=timezone.now(),
+    )
+    return checkout_request_id
+
+
+def valid_callback_token(token):
+    '''Whether a callback came to the secret URL given to Daraja (MPESA_CALLBACK_TOKEN).'''
+    expected = settings.MPESA_CALLBACK_TOKEN
+    return bool(expected) and hmac.compare_digest(str(token).encode(), expected.encode())
+
+
+def paid_in_full(amount, order_total):
+    try:
+        return Decimal(str(amount)) >= stk_amount(order_total)
+    except InvalidOperation:
+        return False
+
+
+def handle_stk_callback(payload):
+    '''Apply a Daraja STK callback to its order; returns the order or None if unknown.
+
+    A successful payment only marks the order paid if the Amount covers the
+    order total; a short one is kept with its receipt on an unpaid order.
+    '''
+    callback = (payload.get('Body') or {}).get('stkCallback') or {}
+    checkout_request_id = callback.get('CheckoutRequestID')
+    order = (
+        Order.objects.filter(checkout_request_id=checkout_request_id).values('pk', 'order_total').first()
+        if checkout_request_id else None
+    )
+    if order is None:
+        logger.warning(f"STK callback for unknown CheckoutRequestID {checkout_request_id!r}")
+        return None
+    order_pk = order['pk']
+
+    if str(callback.get('ResultCode')) == '0':
+        items = (callback.get('CallbackMetadata') or {}).get('Item') or []
+        metadata = {item.get('Name'): item.get('Value') for item in items}
+        receipt = str(metadata.get('MpesaReceiptNumber', ''))
+        if not paid_in_full(metadata.get('Amount'), order['order_total']):
+            logger.warning(
+                f"STK payment {receipt} for {checkout_request_id} was {metadata.get('Amount')!r}, "
+                f"expected {stk_amount(order['order_total'])}"
+            )
+            return set_order_status(order_pk, 'updaid', keep=FINAL_STATUSES, mpesa_receipt=receipt)
+        return set_order_status(order_pk, 'paid', keep=FINAL_STATUSES, mpesa_receipt=receipt)
+
+    logger.info(f"STK payment for {checkout_request_id} failed: {callback.get('ResultDesc')}")
+    return set_order_status(order_pk, 'updaid', keep=FINAL_STATUSES)
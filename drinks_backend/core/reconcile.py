@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import requests
+from django.db import transaction
+from django.utils import timezone
+from .models import Order
+from .payments import paid_in_full
+from .rollups import order_contribution, record_order_changes
+from .stk_push import get_client
+
+logger = logging.getLogger(__name__)
+
+# Daraja answers a query for a push the customer has not finished with this code
+STILL_PROCESSING = '500.001.1001'
+
+
+class RateLimiter:
+    '''Spaces calls at least 1/rate seconds apart across threads.'''
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(max(0, slot - now))
+
+
+def query_status(client, limiter, checkout_request_id):
+    '''Map one STK query to 'paid', 'updaid', None (still pending) or 'error'.'''
+    limiter.wait()
+    try:
+        response = client.query_stk_status(checkout_request_id)
+    except (requests.RequestException, ValueError):
+        logger.exception(f"STK query for {checkout_request_id} failed")
+        return 'error'
+    if response.get('errorCode') == STILL_PROCESSING:
+        return None
+    if 'ResultCode' not in response:
+        logger.warning(f"Unexpected STK query response for {checkout_request_id}: {response}")
+        return 'error'
+    return 'paid' if str(response['ResultCode']) == '0' else 'updaid'
+
+
+def settled_status(order, result):
+    '''The status a query result gives this order, or None to wait for its callback.
+
+    As with callbacks, a payment only counts if it covers the order total:
+    here, if the push asked for all of it. Orders pushed before the amount
+    was recorded are left for the callback, which carries the Amount paid.
+    '''
+    if result != 'paid':
+        return result
+    if order.mpesa_amount is None:
+        return None
+    if not paid_in_full(order.mpesa_amount, order.order_total):
+        logger.warning(
+            f"STK payment for {order.checkout_request_id} was {order.mpesa_amount}, order total {order.order_total}"
+        )
+        return 'updaid'
+    return 'paid'
+
+
+def apply_results(results):
+    '''Write one batch of {order pk: query result} in a short transaction.
+
+    Returns {order pk: status written, or None if left initiated}.
+    '''
+    if not results:
+        return {}
+    now = timezone.now()
+    written = {}
+    with transaction.atomic():
+        # Re-read under lock: a callback may have settled some orders while we were querying
+        orders = list(Order.objects.select_for_update().filter(pk__in=results, status='initiated'))
+        settled = []
+        changes = []
+        for order in orders:
+            written[order.pk] = settled_status(order, results[order.pk])
+            if written[order.pk] is None:
+                continue
+            before = order_contribution(order)
+            order.status = written[order.pk]
+            order.updated_at = now
+            settled.append(order)
+            changes.append((before, order_contribution(order)))
+        Order.objects.bulk_update(settled, ['status', 'updated_at'])
+        record_order_changes(changes)
+    return written
+
+
+def reconcile_payments(stale_after=timedelta(minutes=5), batch_size=200, concurrency=8, rate=10, limit=None, client=None):
+    '''Re-check initiated M-Pesa orders with Daraja and settle the ones that finished.
+
+    Orders are read in primary-key batches without a transaction; only the
+    writes for each batch run in one, so a long run never holds locks.
+    Returns a summary of what was found.
+    '''
+    client = client or get_client()
+    limiter = RateLimiter(rate)
+    stale = Order.objects.filter(
+        status='initiated', checkout_request_id__isnull=False, updated_at__lt=timezone.now() - stale_after,
+    )
+    summary = {'checked': 0, 'paid': 0, 'updaid': 0, 'pending': 0, 'errors': 0, 'batches': 0}
+    started = time.perf_counter()
+    last_pk = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reconcile') as pool:
+        while limit is None or summary['checked'] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - summary['checked'])
+            batch = list(stale.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'checkout_request_id')[:size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            statuses = pool.map(lambda row: query_status(client, limiter, row[1]), batch)
+            results = {}
+            for (pk, _), new_status in zip(batch, statuses):
+                if new_status in ('paid', 'updaid'):
+                    results[pk] = new_status
+                elif new_status is None:
+                    summary['pending'] += 1
+                else:
+                    summary['errors'] += 1
+            for new_status in apply_results(results).values():
+                summary[new_status or 'pending'] += 1
+            summary['checked'] += len(batch)
+            summary['batches'] += 1
+
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+    return summary
@@ -0,0 +1,95 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import DailySalesSummary, Order, OrderItem
+
+DEFAULT_REPORT_DAYS = 30
+DEFAULT_TOP_PRODUCTS = 10
+
+
+def report_range(params):
+    '''Inclusive (start, end) dates from ?start=YYYY-MM-DD&end=YYYY-MM-DD, last 30 days by default.'''
+    end = parse_date(params.get('end') or '') or timezone.localdate()
+    start = parse_date(params.get('start') or '') or end - timedelta(days=DEFAULT_REPORT_DAYS - 1)
+    if start > end:
+        raise ValueError('start must not be after end')
+    return start, end
+
+
+def day_bounds(start, end):
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(start, time.min), tz),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz),
+    )
+
+
+def _rollup(rows, key):
+    totals = defaultdict(lambda: {'orders': 0, 'revenue': Decimal('0')})
+    for row in rows:
+        totals[row[key]]['orders'] += row['orders']
+        totals[row[key]]['revenue'] += row['revenue'] or 0
+    return [{key: value, **totals[value]} for value in sorted(totals, key=str)]
+
+
+def revenue_report(start, end):
+    '''Revenue per day, payment method and status from one GROUP BY query.
+
+    The database groups by all three columns at once; the result has at most
+    days x methods x statuses rows, which are folded into the three views here.
+    '''
+    lower, upper = day_bounds(start, end)
+    rows = list(
+        Order.objects.filter(created_at__gte=lower, created_at__lt=upper)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'payment_method', 'status')
+        .annotate(orders=Count('id'), revenue=Sum('order_total'))
+        .order_by()
+    )
+    return {
+        'start': start,
+        'end': end,
+        'orders': sum(row['orders'] for row in rows),
+        'revenue': sum((row['revenue'] or 0 for row in rows), Decimal('0')),
+        'by_day': _rollup(rows, 'day'),
+        'by_payment_method': _rollup(rows, 'payment_method'),
+        'by_status': _rollup(rows, 'status'),
+    }
+
+
+def top_products(start, end, limit=DEFAULT_TOP_PRODUCTS):
+    '''Best-selling products by units, aggregated over the order_items table.'''
+    lower, upper = day_bounds(start, end)
+    rows = (
+        OrderItem.objects.filter(order__created_at__gte=lower, order__created_at__lt=upper)
+        .values('name', 'drink', 'cocktail')
+        .annotate(
+            units=Sum('quantity'),
+            orders=Count('order', distinct=True),
+            revenue=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+        .order_by('-units', 'name')[:limit]
+    )
+    return {'start': start, 'end': end, 'products': list(rows)}
+
+
+def sales_summary(start, end):
+    '''Dashboard totals read from the daily rollup table instead of orders.'''
+    rows = list(
+        DailySalesSummary.objects.filter(day__gte=start, day__lte=end)
+        .values('day', 'status', 'payment_method', 'delivery_area', 'orders', 'revenue')
+    )
+    return {
+        'start': start,
+        'end': end,
+        'orders': sum(row['orders'] for row in rows),
+        'revenue': sum((row['revenue'] for row in rows), Decimal('0')),
+        'by_day': _rollup(rows, 'day'),
+        'by_status': _rollup(rows, 'status'),
+        'by_payment_method': _rollup(rows, 'payment_method'),
+        'by_delivery_area': _rollup(rows, 'delivery_area'),
+    }
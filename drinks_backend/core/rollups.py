@@ -0,0 +1,88 @@
+from collections import Counter
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import DailySalesSummary, Order
+from .reports import day_bounds
+
+
+def order_contribution(order):
+    '''The summary row an order counts towards and the revenue it adds, or None if unsaved.'''
+    if order is None or order.pk is None or order.created_at is None:
+        return None
+    key = (
+        timezone.localdate(order.created_at),
+        order.status,
+        order.payment_method,
+        order.delivery_area,
+    )
+    return key, Decimal(order.order_total or 0)
+
+
+def _apply(key, orders, revenue):
+    day, status, payment_method, delivery_area = key
+    lookup = dict(day=day, status=status, payment_method=payment_method, delivery_area=delivery_area)
+    changes = dict(orders=F('orders') + orders, revenue=F('revenue') + revenue)
+    if DailySalesSummary.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailySalesSummary.objects.create(**lookup, orders=orders, revenue=revenue)
+    except IntegrityError:
+        # Another request created the row first; add to it instead
+        DailySalesSummary.objects.filter(**lookup).update(**changes)
+
+
+def record_order_change(before, after):
+    '''Move an order's contribution from `before` to `after` (either may be None).
+
+    Both arguments come from order_contribution(). Call inside the transaction
+    that changes the order so the summary commits or rolls back with it.
+    '''
+    record_order_changes([(before, after)])
+
+
+def record_order_changes(changes):
+    '''Apply many (before, after) pairs, touching each summary row once.'''
+    orders = Counter()
+    revenue = Counter()
+    for before, after in changes:
+        if before == after:
+            continue
+        if before:
+            orders[before[0]] -= 1
+            revenue[before[0]] -= before[1]
+        if after:
+            orders[after[0]] += 1
+            revenue[after[0]] += after[1]
+    for key in orders:
+        if orders[key] or revenue[key]:
+            _apply(key, orders[key], revenue[key])
+
+
+def summary_rows(lower, upper):
+    '''Aggregate orders created in [lower, upper) into summary rows with one GROUP BY.'''
+    return (
+        Order.objects.filter(created_at__gte=lower, created_at__lt=upper)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'status', 'payment_method', 'delivery_area')
+        .annotate(count=Count('id'), total=Sum('order_total'))
+        .order_by()
+    )
+
+
+@transaction.atomic
+def rebuild_daily_sales(start, end):
+    '''Recompute the summary for the inclusive date range; returns the row count.'''
+    DailySalesSummary.objects.filter(day__gte=start, day__lte=end).delete()
+    rows = [
+        DailySalesSummary(
+            day=row['day'], status=row['status'], payment_method=row['payment_method'],
+            delivery_area=row['delivery_area'], orders=row['count'], revenue=row['total'] or 0,
+        )
+        for row in summary_rows(*day_bounds(start, end))
+    ]
+    DailySalesSummary.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
@@ -0,0 +1,199 @@
+import bisect
+import difflib
+import re
+import threading
+from django.db import connection
+from django.db.models import Q
+from .cache import current_version
+from .models import Cocktails, Drinks, SearchDocument
+
+MAX_RESULTS = 500
+MAX_TERMS = 8
+FUZZY_MIN_LENGTH = 4  # shorter words have too many near neighbours
+FUZZY_MATCHES = 3
+FUZZY_CUTOFF = 0.75
+
+TOKEN_RE = re.compile(r'\w+')
+KINDS = {'drink': Drinks, 'cocktail': Cocktails}
+FIELDS = {Drinks: ('drink', 'name'), Cocktails: ('cocktail', 'title')}
+
+
+def text(value):
+    '''Flatten JSON ingredient lists like ["gin", {"name": "tonic"}] into words.'''
+    if isinstance(value, dict):
+        return ' '.join(text(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return ' '.join(text(v) for v in value)
+    return '' if value is None else str(value)
+
+
+def document_for(product):
+    field, title = FIELDS[type(product)]
+    return SearchDocument(**{
+        field: product,
+        'title': getattr(product, title)[:100],
+        'category': product.category.name if product.category_id else '',
+        'body': f"{product.description} {text(getattr(product, 'ingredients', ''))}".strip(),
+    })
+
+
+def index_products(model, products, batch_size=1000):
+    '''Insert or refresh the search documents of these drinks or cocktails.
+
+    `products` may be instances or a queryset; querysets are walked in
+    batches with their categories. Bulk writes skip signals, so importers
+    call this for the rows they wrote.
+    '''
+    field, _ = FIELDS[model]
+    if hasattr(products, 'select_related'):
+        products = products.select_related('category').order_by('pk').iterator(chunk_size=batch_size)
+    batch = []
+    for product in products:
+        batch.append(document_for(product))
+        if len(batch) == batch_size:
+            _upsert(batch, field)
+            batch = []
+    if batch:
+        _upsert(batch, field)
+
+
+def _upsert(documents, field):
+    SearchDocument.objects.bulk_create(
+        documents, update_conflicts=True, unique_fields=[field], update_fields=['title', 'category', 'body'],
+    )
+
+
+def rebuild_index(batch_size=1000):
+    '''Recreate every search document from the catalogue; returns the number indexed.'''
+    SearchDocument.objects.all().delete()
+    for model in FIELDS:
+        index_products(model, model.objects.all(), batch_size)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            # Rebuild from the content table in case the index drifted, then merge its segments
+            cursor.execute("INSERT INTO core_searchdocument_fts(core_searchdocument_fts) VALUES ('rebuild')")
+            cursor.execute("INSERT INTO core_searchdocument_fts(core_searchdocument_fts) VALUES ('optimize')")
+    return SearchDocument.objects.count()
+
+
+def terms(query):
+    return [term.lower() for term in TOKEN_RE.findall(query)][:MAX_TERMS]
+
+
+def search(query, kind=None, limit=MAX_RESULTS):
+    '''[(document id, score)] for a free-text query, best match first.
+
+    Every word must match, as a prefix or, for words with no prefix match
+    in the index, as a close spelling. `kind` is "drink" or "cocktail".
+    '''
+    words = terms(query)
+    if not words:
+        return []
+    if connection.vendor == 'postgresql':
+        return _search_postgres(words, kind, limit)
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(words, kind, limit)
+    return _search_fallback(words, kind, limit)
+
+
+def _kind_filter(kind):
+    if kind is None:
+        return ''
+    return f" AND d.{FIELDS[KINDS[kind]][0]}_id IS NOT NULL"
+
+
+# ============================
+# SQLite: FTS5 with bm25 ranking
+# ============================
+class Vocabulary:
+    '''Sorted FTS5 terms, reloaded when the catalogue version changes.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._terms = []
+        self._by_length = {}
+
+    def load(self):
+        version = current_version()
+        with self._lock:
+            if version != self._version:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT term FROM core_searchdocument_vocab ORDER BY term')
+                    self._terms = [row[0] for row in cursor.fetchall()]
+                self._by_length = {}
+                for term in self._terms:
+                    self._by_length.setdefault(len(term), []).append(term)
+                self._version = version
+            return self._terms, self._by_length
+
+    def has_prefix(self, word):
+        terms, _ = self.load()
+        index = bisect.bisect_left(terms, word)
+        return index < len(terms) and terms[index].startswith(word)
+
+    def close_matches(self, word):
+        _, by_length = self.load()
+        candidates = [term for length in range(len(word) - 2, len(word) + 3) for term in by_length.get(length, ())]
+        return difflib.get_close_matches(word, candidates, n=FUZZY_MATCHES, cutoff=FUZZY_CUTOFF)
+
+
+vocabulary = Vocabulary()
+
+
+def fts_query(words):
+    groups = []
+    for word in words:
+        options = [f'"{word}"*']
+        if len(word) >= FUZZY_MIN_LENGTH and not vocabulary.has_prefix(word):
+            options += [f'"{match}"' for match in vocabulary.close_matches(word)]
+        groups.append(f"({' OR '.join(options)})")
+    return ' AND '.join(groups)
+
+
+def _search_sqlite(words, kind, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            # Title matches count most, then category, then description and ingredients
+            'SELECT d.id, -bm25(core_searchdocument_fts, 10.0, 3.0, 1.0) AS score '
+            'FROM core_searchdocument_fts JOIN core_searchdocument d ON d.id = core_searchdocument_fts.rowid '
+            f'WHERE core_searchdocument_fts MATCH %s{_kind_filter(kind)} '
+            'ORDER BY score DESC, d.id LIMIT %s',
+            [fts_query(words), limit],
+        )
+        return cursor.fetchall()
+
+
+# ============================
+# PostgreSQL: tsvector prefix match plus trigram similarity
+# ============================
+def _search_postgres(words, kind, limit):
+    # As on SQLite, each word matches as a prefix or as a close spelling of a
+    # word anywhere in the document (search_text is title, category and body)
+    conditions = ' AND '.join(
+        f"(d.search_vector @@ to_tsquery('simple', %(prefix{i})s)"
+        + (f" OR %(word{i})s <%% d.search_text)" if len(word) >= FUZZY_MIN_LENGTH else ')')
+        for i, word in enumerate(words)
+    )
+    params = {'text': ' '.join(words), 'tsquery': ' | '.join(f'{word}:*' for word in words), 'limit': limit}
+    for i, word in enumerate(words):
+        params[f'prefix{i}'], params[f'word{i}'] = f'{word}:*', word
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT d.id, ts_rank(d.search_vector, to_tsquery('simple', %(tsquery)s)) "
+            "+ word_similarity(%(text)s, d.search_text) AS score "
+            f"FROM core_searchdocument d WHERE {conditions}{_kind_filter(kind)} "
+            "ORDER BY score DESC, d.id LIMIT %(limit)s",
+            params,
+        )
+        return cursor.fetchall()
+
+
+def _search_fallback(words, kind, limit):
+    '''Unranked substring match for other databases.'''
+    documents = SearchDocument.objects.all()
+    if kind:
+        documents = documents.filter(**{f'{FIELDS[KINDS[kind]][0]}__isnull': False})
+    for word in words:
+        documents = documents.filter(Q(title__icontains=word) | Q(category__icontains=word) | Q(body__icontains=word))
+    return [(pk, 0.0) for pk in documents.order_by('pk').values_list('pk', flat=True)[:limit]]
@@ -2,6 +2,12 @@ from rest_framework import serializers
 from .models import *
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib import admin
+from django.db import transaction
+from .cache import invalidate_catalogue_on_commit
+from .images import queue_image_variants, variant_urls
+from .orders import build_order_items
+from .rollups import order_contribution, record_order_change
+from .search import index_products
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
@@ -34,7 +40,7 @@ class DrinksCategorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = DrinksCategory
-        fields = '__all__'
+        exclude = ['drinks_count']
 
 
 class CocktailsCategorySerializer(serializers.ModelSerializer):
@@ -42,28 +48,48 @@ class CocktailsCategorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CocktailsCategory
-        fields = '__all__'
+        exclude = ['cocktails_count']
 
 # ============================
 # Bulk List Serializers
 # ============================
 class BulkDrinksSerializer(serializers.ListSerializer):
     def create(self, validated_data):
-        return Drinks.objects.bulk_create([Drinks(**item) for item in validated_data])
+        drinks = Drinks.objects.bulk_create([Drinks(**item) for item in validated_data])
+        DrinksCategory.objects.filter(pk__in={d.category_id for d in drinks}).refresh_product_counts()
+        queue_image_variants(drinks)
+        # bulk_create sends no post_save, so the search index is written here
+        index_products(Drinks, drinks)
+        invalidate_catalogue_on_commit()
+        return drinks
 
 
 class BulkCocktailsSerializer(serializers.ListSerializer):
     def create(self, validated_data):
-        return Cocktails.objects.bulk_create([Cocktails(**item) for item in validated_data])
+        cocktails = Cocktails.objects.bulk_create([Cocktails(**item) for item in validated_data])
+        CocktailsCategory.objects.filter(pk__in={c.category_id for c in cocktails}).refresh_product_counts()
+        queue_image_variants(cocktails)
+        index_products(Cocktails, cocktails)
+        invalidate_catalogue_on_commit()
+        return cocktails
 
 # ============================
 # Product Serializers
 # ============================
+class ImageVariantsField(serializers.ReadOnlyField):
+    '''Stored variant names as absolute URLs: {"webp": {"320": url, ...}, "jpg": {...}}.'''
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return variant_urls(value, build_url=request.build_absolute_uri if request else None)
+
+
 class DrinksSerializer(serializers.ModelSerializer):
     category = serializers.SlugRelatedField(
         slug_field='name',
         queryset=DrinksCategory.objects.all()
     )
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Drinks
@@ -76,6 +102,7 @@ class CocktailsSerializer(serializers.ModelSerializer):
         slug_field='name',
         queryset=CocktailsCategory.objects.all()
     )
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Cocktails
@@ -91,11 +118,16 @@ class CustomerInfoSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'email', 'phone', 'county', 'delivery_area', 'latitude', 'longitude']
 
 
+class OrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'name', 'quantity', 'unit_price', 'drink', 'cocktail']
+
+
 class OrderSerializer(serializers.ModelSerializer):
     customer = CustomerInfoSerializer()
-    items = serializers.SerializerMethodField()
+    items = OrderItemSerializer(many=True, read_only=True)
     # date = serializers.DateTimeField(source='created_at', format="%Y-%m-%d %H:%M")
-    delivery_area = serializers.CharField(source='customer.delivery_area', read_only=True)
 
     class Meta:
         model = Order
@@ -112,25 +144,33 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'customer', 'date', 'delivery_area', 'county', 'total']
 
-    def get_items(self, obj):
-        return obj.products
-
+    @transaction.atomic
     def create(self, validated_data):
         customer_data = validated_data.pop('customer')
-        customer = CustomerInfo.objects.create(**customer_data)
-        return Order.objects.create(customer=customer, **validated_data)
+        customer = CustomerInfo.objects.reuse_or_create(**customer_data)
+        order = Order.objects.create(customer=customer, delivery_area=customer.delivery_area, **validated_data)
+        OrderItem.objects.bulk_create(build_order_items([order]))
+        record_order_change(None, order_contribution(order))
+        return order
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         # Allow PATCHing order status or payment
+        before = order_contribution(instance)
         customer_data = validated_data.pop('customer', None)
         if customer_data:
             for attr, value in customer_data.items():
                 setattr(instance.customer, attr, value)
             instance.customer.save()
+            instance.delivery_area = instance.customer.delivery_area
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         instance.save()
+        if 'products' in validated_data:
+            instance.items.all().delete()
+            OrderItem.objects.bulk_create(build_order_items([instance]))
+        record_order_change(before, order_contribution(instance))
         return instance
 
 # ============================
@@ -146,3 +186,25 @@ class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
         fields = '__all__'
+
+
+# ============================
+# Import Job Serializers
+# ============================
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id',
+            'file_name',
+            'status',
+            'rows_processed',
+            'created',
+            'updated',
+            'error_count',
+            'errors',
+            'created_at',
+            'updated_at',
+            'finished_at',
+        ]
+        read_only_fields = fields
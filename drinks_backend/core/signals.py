@@ -0,0 +1,111 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .cache import invalidate_catalogue_on_commit
+from .images import delete_variants_on_commit, queue_image_variants
+from .metrics import time_queries
+from .search import index_products
+from .models import Cocktails, CocktailsCategory, Drinks, DrinksCategory, Offer, Order
+from .rollups import order_contribution, record_order_change
+
+CATALOGUE_MODELS = (Drinks, DrinksCategory, Cocktails, CocktailsCategory, Offer)
+SEARCH_FIELDS = {'name', 'title', 'description', 'ingredients', 'category'}
+
+
+# ============================
+# Category product counts
+# ============================
+@receiver(pre_save, sender=Drinks)
+@receiver(pre_save, sender=Cocktails)
+def remember_previous_state(sender, instance, **kwargs):
+    instance._previous_category_id = None
+    instance._previous_image = None
+    instance._stale_variants = {}
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk).values_list('category_id', 'image', 'image_variants').first()
+        if previous:
+            instance._previous_category_id, instance._previous_image, instance._stale_variants = previous
+    if (instance.image.name or '') != (instance._previous_image or ''):
+        # Old variants belong to the old file; new ones are built after commit
+        instance.image_variants = {}
+    else:
+        instance._stale_variants = {}
+
+
+@receiver(post_save, sender=Drinks)
+@receiver(post_delete, sender=Drinks)
+@receiver(post_save, sender=Cocktails)
+@receiver(post_delete, sender=Cocktails)
+def refresh_category_count(sender, instance, **kwargs):
+    category_model = DrinksCategory if sender is Drinks else CocktailsCategory
+    ids = {instance.category_id, getattr(instance, '_previous_category_id', None)} - {None}
+    # Runs inside the caller's transaction, so the count commits with the product
+    category_model.objects.filter(pk__in=ids).refresh_product_counts()
+
+
+# ============================
+# Product image variants
+# ============================
+@receiver(post_save, sender=Drinks)
+@receiver(post_save, sender=Cocktails)
+def queue_product_image_variants(sender, instance, **kwargs):
+    delete_variants_on_commit(getattr(instance, '_stale_variants', None))
+    if instance.image and instance.image.name != getattr(instance, '_previous_image', None):
+        queue_image_variants([instance])
+
+
+@receiver(post_delete, sender=Drinks)
+@receiver(post_delete, sender=Cocktails)
+def delete_product_image_variants(sender, instance, **kwargs):
+    delete_variants_on_commit(instance.image_variants)
+
+
+# ============================
+# Search index
+# ============================
+@receiver(post_save, sender=Drinks)
+@receiver(post_save, sender=Cocktails)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    # Deletes cascade to the search document; saves of e.g. image_variants alone change no text
+    if update_fields is None or set(update_fields) & SEARCH_FIELDS:
+        index_products(sender, [instance])
+
+
+@receiver(post_save, sender=DrinksCategory)
+@receiver(post_save, sender=CocktailsCategory)
+def reindex_category_products(sender, instance, created, **kwargs):
+    # Documents carry the category name
+    if not created:
+        model = Drinks if sender is DrinksCategory else Cocktails
+        index_products(model, model.objects.filter(category=instance))
+
+
+# ============================
+# Daily sales summary
+# ============================
+@receiver(pre_delete, sender=Order)
+def remove_order_from_summary(sender, instance, **kwargs):
+    # Creates and edits are recorded by OrderSerializer; deletes can also cascade from customers
+    record_order_change(order_contribution(instance), None)
+
+
+# ============================
+# Catalogue cache
+# ============================
+def invalidate_catalogue_cache(sender, **kwargs):
+    invalidate_catalogue_on_commit()
+
+
+for model in CATALOGUE_MODELS:
+    post_save.connect(invalidate_catalogue_cache, sender=model, dispatch_uid=f'catalogue-save-{model.__name__}')
+    post_delete.connect(invalidate_catalogue_cache, sender=model, dispatch_uid=f'catalogue-delete-{model.__name__}')
+
+
+# ============================
+# Request metrics
+# ============================
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # Fires again on every reconnect of the same wrapper object
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_queries)
@@ -0,0 +1,102 @@
+'''Cold-start probe, run as `python -m core.startup` in a fresh interpreter.
+
+Loads the WSGI application and its URLconf the way a new gunicorn worker
+does before its first response, recording for every module imported on
+the way the wall time and resident memory its import added, both with
+(ms, rss_mb) and without (self_ms, self_rss_mb) the modules it imported
+in turn. Prints one JSON document on stdout.
+
+Nothing from Django is imported at module level, so the probe itself does
+not pollute the measurement.
+'''
+import importlib.abc
+import json
+import os
+import resource
+import sys
+import time
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        # No procfs (macOS): fall back to the peak, which only grows during startup anyway
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class _TimedLoader(importlib.abc.Loader):
+    # Imports nest: each frame collects the time and memory of the imports it triggered
+    stack = []
+
+    def __init__(self, loader, records):
+        self.loader = loader
+        self.records = records
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        frame = [0.0, 0.0]
+        self.stack.append(frame)
+        started, rss = time.perf_counter(), current_rss_mb()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.stack.pop()
+            ms = (time.perf_counter() - started) * 1000
+            rss_mb = current_rss_mb() - rss
+            if self.stack:
+                self.stack[-1][0] += ms
+                self.stack[-1][1] += rss_mb
+            self.records[module.__name__] = {
+                'ms': ms, 'rss_mb': rss_mb, 'self_ms': ms - frame[0], 'self_rss_mb': rss_mb - frame[1],
+            }
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class _TimedFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, records):
+        self.records = records
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self.records)
+                return spec
+        return None
+
+
+def main():
+    records = {}
+    sys.meta_path.insert(0, _TimedFinder(records))
+    baseline = current_rss_mb()
+    started = time.perf_counter()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drinks_backend.settings')
+    import drinks_backend.wsgi  # noqa: F401
+    wsgi_ms = (time.perf_counter() - started) * 1000
+
+    from django.urls import get_resolver
+    get_resolver().url_patterns  # URLconf and views load on a worker's first request
+    total_ms = (time.perf_counter() - started) * 1000
+
+    json.dump({
+        'wsgi_ms': wsgi_ms,
+        'total_ms': total_ms,
+        'baseline_rss_mb': baseline,
+        'rss_mb': current_rss_mb(),
+        'modules': records,
+    }, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
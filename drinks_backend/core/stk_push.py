@@ -1,7 +1,15 @@
+import asyncio
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 import base64
 import os
+import threading
+import time
+import weakref
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,40 +18,266 @@ CONSUMER_KEY = os.getenv('DARJA_CONSUMER_KEY')
 CONSUMER_SECRET = os.getenv('DARJA_CONSUMER_SECRET')
 PASSKEY = os.getenv('DARJA_PASSKEY')
 SHORTCODE = os.getenv('DARJA_SHORTCODE')
-CALLBACK_URL = 'https://webhook.site/your-id'
+# Public URL of the callback view, e.g. https://barrush-backend.onrender.com/api/payments/mpesa/callback/;
+# pushes append CALLBACK_TOKEN to it, and callbacks without the token are refused
+CALLBACK_URL = os.getenv('MPESA_CALLBACK_URL')
+CALLBACK_TOKEN = os.getenv('MPESA_CALLBACK_TOKEN')
+BASE_URL = os.getenv('DARJA_BASE_URL', 'https://sandbox.safaricom.co.ke')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Connections kept open to Daraja; also caps concurrent pushes from async views
+POOL_SIZE = int(os.getenv('DARJA_POOL_SIZE', 10))
+
+
+def stk_amount(amount):
+    '''The whole-shilling Amount an STK push asks for.'''
+    return int(float(amount))
+
+
+class DarajaAPI:
+    '''Credentials and request bodies shared by the sync and async clients.'''
+    token_refresh_margin = 60  # seconds before expires_in to fetch a new token
+
+    def __init__(self, base_url=BASE_URL, consumer_key=CONSUMER_KEY, consumer_secret=CONSUMER_SECRET,
+                 shortcode=SHORTCODE, passkey=PASSKEY, callback_url=CALLBACK_URL, callback_token=CALLBACK_TOKEN,
+                 timeout=(3.05, 30), retries=3, backoff_factor=0.5, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.shortcode = shortcode
+        self.passkey = passkey
+        self.callback_url = callback_url
+        self.callback_token = callback_token
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+
+        self._token = None
+        self._token_expires_at = 0
+
+    def settings(self):
+        return {
+            'base_url': self.base_url, 'consumer_key': self.consumer_key, 'consumer_secret': self.consumer_secret,
+            'shortcode': self.shortcode, 'passkey': self.passkey,
+            'callback_url': self.callback_url, 'callback_token': self.callback_token,
+            'timeout': self.timeout, 'retries': self.retries, 'backoff_factor': self.backoff_factor,
+            'pool_size': self.pool_size,
+        }
+
+    def cached_token(self):
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        return None
+
+    def store_token(self, data):
+        expires_in = int(data.get('expires_in', 3599))
+        self._token = data['access_token']
+        self._token_expires_at = time.monotonic() + max(0, expires_in - self.token_refresh_margin)
+        return self._token
+
+    def password(self, timestamp):
+        return base64.b64encode(f"{self.shortcode}{self.passkey}{timestamp}".encode()).decode()
+
+    def stk_push_payload(self, phone, amount, account_reference='SipNDash', description='Order payment'):
+        if not self.callback_url or not self.callback_token:
+            # Daraja would post the payment result, and with it the order's fate, elsewhere
+            raise ImproperlyConfigured(
+                'Set MPESA_CALLBACK_URL to the public URL of the M-Pesa callback view and MPESA_CALLBACK_TOKEN to a random secret'
+            )
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return {
+            "BusinessShortCode": self.shortcode,
+            "Password": self.password(timestamp),
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": str(stk_amount(amount)),
+            "PartyA": phone,
+            "PartyB": self.shortcode,
+            "PhoneNumber": phone,
+            "CallBackURL": f"{self.callback_url.rstrip('/')}/{self.callback_token}/",
+            "AccountReference": account_reference,
+            "TransactionDesc": description
+        }
+
+    def stk_query_payload(self, checkout_request_id):
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return {
+            "BusinessShortCode": self.shortcode,
+            "Password": self.password(timestamp),
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+
+
+class DarajaClient(DarajaAPI):
+    '''M-Pesa Daraja API client with a pooled session and a cached access token.
+
+    One instance is meant to be shared: the OAuth token is reused until
+    shortly before it expires and only one thread refreshes it at a time.
+    GETs are retried with backoff on connection errors and 429/5xx; the STK
+    push POST is only retried when the connection failed before sending,
+    because a repeated push would prompt the customer twice.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({'GET'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._token_lock = threading.Lock()
+
+    def get_access_token(self):
+        if token := self.cached_token():
+            return token
+
+        # Single flight: other threads wait here and reuse the refreshed token
+        with self._token_lock:
+            if token := self.cached_token():
+                return token
+
+            response = self.session.get(
+                f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials',
+                auth=(self.consumer_key, self.consumer_secret),
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return self.store_token(response.json())
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+
+    def post(self, path, payload):
+        '''POST to the API, refreshing the token once if it was rejected.'''
+        for attempt in range(2):
+            response = self.session.post(
+                f'{self.base_url}{path}',
+                json=payload,
+                headers={'Authorization': f'Bearer {self.get_access_token()}'},
+                timeout=self.timeout,
+            )
+            if response.status_code != 401 or attempt:
+                return response.json()
+            self.invalidate_token()
+
+    def initiate_stk_push(self, phone, amount, account_reference='SipNDash', description='Order payment'):
+        return self.post('/mpesa/stkpush/v1/processrequest', self.stk_push_payload(phone, amount, account_reference, description))
+
+    def query_stk_status(self, checkout_request_id):
+        '''Ask Daraja for the result of an earlier push (STK Push Query API).'''
+        return self.post('/mpesa/stkpushquery/v1/query', self.stk_query_payload(checkout_request_id))
+
+
+class AsyncDarajaClient(DarajaAPI):
+    '''The DarajaClient API on httpx, for async views.
+
+    Waiting on Safaricom then costs a suspended coroutine instead of a worker
+    thread. Retries follow DarajaClient: the token GET on connection errors
+    and 429/5xx with backoff, POSTs only when the connection failed.
+    An httpx.AsyncClient belongs to one event loop; use get_async_client().
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            # Transport retries only cover failed connects, which is safe for POST
+            transport=httpx.AsyncHTTPTransport(retries=self.retries),
+        )
+        self._token_lock = asyncio.Lock()
+
+    async def get_access_token(self):
+        if token := self.cached_token():
+            return token
+
+        async with self._token_lock:
+            if token := self.cached_token():
+                return token
+
+            for attempt in range(self.retries + 1):
+                response = await self.http.get(
+                    f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials',
+                    auth=(self.consumer_key, self.consumer_secret),
+                )
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    break
+                await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+            response.raise_for_status()
+            return self.store_token(response.json())
+
+    async def invalidate_token(self):
+        async with self._token_lock:
+            self._token = None
+
+    async def post(self, path, payload):
+        '''POST to the API, refreshing the token once if it was rejected.'''
+        for attempt in range(2):
+            response = await self.http.post(
+                f'{self.base_url}{path}',
+                json=payload,
+                headers={'Authorization': f'Bearer {await self.get_access_token()}'},
+            )
+            if response.status_code != 401 or attempt:
+                return response.json()
+            await self.invalidate_token()
+
+    async def initiate_stk_push(self, phone, amount, account_reference='SipNDash', description='Order payment'):
+        return await self.post('/mpesa/stkpush/v1/processrequest', self.stk_push_payload(phone, amount, account_reference, description))
+
+    async def query_stk_status(self, checkout_request_id):
+        return await self.post('/mpesa/stkpushquery/v1/query', self.stk_query_payload(checkout_request_id))
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    '''Shared client for this process.'''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DarajaClient()
+    return _client
+
+
+def set_client(client):
+    '''Replace the shared client, e.g. with one pointed at DarajaStub; returns the previous one.'''
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    return previous
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    '''Shared async client for the running event loop, configured like get_client().'''
+    loop = asyncio.get_running_loop()
+    client = get_client()
+    entry = _async_clients.get(loop)
+    if entry is None or entry[0] is not client:
+        entry = _async_clients[loop] = (client, AsyncDarajaClient(**client.settings()))
+    return entry[1]
 
 
 def get_access_token():
-    response = requests.get(
-        'https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials',
-        auth=(CONSUMER_KEY, CONSUMER_SECRET)
-    )
-    return response.json()['access_token']
+    return get_client().get_access_token()
+
 
 def initiate_stk_push(phone, amount):
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    password = base64.b64encode(f"{SHORTCODE}{PASSKEY}{timestamp}".encode()).decode()
-
-    payload = {
-        "BusinessShortCode": SHORTCODE,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": str(int(float(amount))),
-        "PartyA": phone,
-        "PartyB": SHORTCODE,
-        "PhoneNumber": phone,
-        "CallBackURL": CALLBACK_URL,
-        "AccountReference": "SipNDash",
-        "TransactionDesc": "Order payment"
-    }
-
-    headers = {
-        "Authorization": f"Bearer {get_access_token()}",
-        "Content-Type": "application/json"
-    }
-
-    res = requests.post("https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest",
-                        headers=headers, json=payload)
-
-    return res.json()
\ No newline at end of file
+    return get_client().initiate_stk_push(phone, amount)
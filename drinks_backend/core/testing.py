@@ -0,0 +1,108 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .cache import get_cache, invalidate_catalogue
+from .models import *
+from .orders import build_order_items
+from .search import index_products
+
+
+def seed_data(size, prefix='Seed'):
+    '''Create `size` rows of each catalogue and order model using bulk inserts.'''
+    drink_categories = DrinksCategory.objects.bulk_create(
+        DrinksCategory(name=f'{prefix} Drinks {i}', description='') for i in range(max(1, size // 10))
+    )
+    cocktail_categories = CocktailsCategory.objects.bulk_create(
+        CocktailsCategory(name=f'{prefix} Cocktails {i}', description='') for i in range(max(1, size // 10))
+    )
+    # Refetch so primary keys are set on every backend
+    drink_categories = list(DrinksCategory.objects.filter(name__startswith=f'{prefix} Drinks'))
+    cocktail_categories = list(CocktailsCategory.objects.filter(name__startswith=f'{prefix} Cocktails'))
+
+    Drinks.objects.bulk_create(
+        Drinks(
+            name=f'{prefix} Drink {i}', price=100 + i, description=f'Drink number {i}',
+            category=drink_categories[i % len(drink_categories)],
+        ) for i in range(size)
+    )
+    Cocktails.objects.bulk_create(
+        Cocktails(
+            title=f'{prefix} Cocktail {i}', description=f'Cocktail number {i}',
+            ingredients=['gin', 'tonic'], instructions=['mix'],
+            category=cocktail_categories[i % len(cocktail_categories)],
+        ) for i in range(size)
+    )
+    DrinksCategory.objects.filter(name__startswith=prefix).refresh_product_counts()
+    CocktailsCategory.objects.filter(name__startswith=prefix).refresh_product_counts()
+    index_products(Drinks, Drinks.objects.filter(name__startswith=f'{prefix} Drink '))
+    index_products(Cocktails, Cocktails.objects.filter(title__startswith=f'{prefix} Cocktail '))
+
+    Offer.objects.bulk_create(
+        Offer(title=f'{prefix} Offer {i}', discount='10', end_date=timezone.now()) for i in range(size)
+    )
+    Contact.objects.bulk_create(
+        Contact(name=f'{prefix} {i}', email=f'contact{i}@example.com', message='Hello') for i in range(size)
+    )
+    # Phones are unique, so numbering carries on from earlier seeds
+    first_phone = CustomerInfo.objects.count()
+    CustomerInfo.objects.bulk_create(
+        CustomerInfo(
+            name=f'{prefix} Customer {i}', email=f'{prefix.lower()}{i}@example.com',
+            phone=f'07{first_phone + i:08d}', county='Nairobi', delivery_area='Westlands',
+            # bulk_create skips CustomerInfo.save(), which fills these
+            phone_normalized=normalize_phone(f'07{first_phone + i:08d}'), email_normalized=f'{prefix.lower()}{i}@example.com',
+        ) for i in range(size)
+    )
+    customers = list(CustomerInfo.objects.filter(name__startswith=f'{prefix} Customer'))
+    # bulk_create skips Order.save(), so order ids are assigned here
+    Order.objects.bulk_create(
+        Order(
+            order_id=f'{prefix.upper()}-{i}', customer=customers[i % len(customers)],
+            products={f'{prefix} Drink {i}': {'quantity': 1}}, order_total=str(100 + i),
+            payment_method='mpesa', delivery_area='Westlands',
+        ) for i in range(size)
+    )
+    orders = Order.objects.filter(order_id__startswith=f'{prefix.upper()}-')
+    OrderItem.objects.bulk_create(build_order_items(orders))
+    invalidate_catalogue()
+
+
+class APITestCase(TestCase):
+    '''TestCase with an API client and an empty catalogue cache.
+
+    The test database is rolled back between tests but the cache is not, so
+    cached responses must not leak from one test into the next.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        get_cache().clear()
+
+
+class QueryBudgetMixin:
+    '''Assertions that keep an endpoint's query count fixed as data grows.
+
+    Use on a TestCase that has a `client`.
+    '''
+
+    def assertQueryBudget(self, url, budget):
+        '''Fail if GET url runs more than `budget` queries; returns the query count.'''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{url} ran {len(queries)} queries (budget {budget}):\n"
+            + '\n'.join(query['sql'] for query in queries)
+        )
+        return len(queries)
+
+    def assertQueryCountFlat(self, url, grow, budget):
+        '''Query url before and after grow() adds data; the count must not change.'''
+        before = self.assertQueryBudget(url, budget)
+        grow()
+        after = self.assertQueryBudget(url, budget)
+        self.assertEqual(before, after, f"{url} query count grew from {before} to {after}")
@@ -1,3 +1,1088 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+from . import async_views
+from .benchmarks import measure
+from .cache import invalidate_catalogue
+from .importer import CSVFileError, DrinksImporter, run_import_job, store_upload
+from .metrics import metrics
+from .reconcile import RateLimiter, reconcile_payments
+from .serializers import CocktailsSerializer, DrinksSerializer
+from .daraja_stub import DarajaStub
+from .models import *
+from .stk_push import DarajaClient, get_client, set_client
+from .testing import APITestCase, QueryBudgetMixin, seed_data
+from .urls import router
 
-# Create your tests here.
+
+def csv_upload(content, name='drinks.csv'):
+    return SimpleUploadedFile(name, content.encode(), content_type='text/csv')
+
+
+class DrinksImporterTests(TestCase):
+    def setUp(self):
+        self.spirits = DrinksCategory.objects.create(name='Spirits', description='')
+        Drinks.objects.create(name='Gilbeys', price=900, description='Gin', category=self.spirits)
+
+    def import_csv(self, content, **kwargs):
+        importer = DrinksImporter(**kwargs)
+        importer.import_csv(io.StringIO(content))
+        return importer
+
+    def test_creates_and_updates_in_bulk(self):
+        content = (
+            "name,description,category,price\n"
+            "Gilbeys,London dry gin,Spirits,\"1,100\"\n"
+            "Tusker,Lager,Beer,250\n"
+            "Guinness,Stout,Beer,300\n"
+        )
+        # category lookup + insert + refetch, then drinks lookup + insert + update + category lock + counts + search index
+        with self.assertNumQueries(11):
+            importer = self.import_csv(content)
+
+        self.assertEqual((importer.created, importer.updated), (2, 1))
+        gilbeys = Drinks.objects.get(name='Gilbeys')
+        self.assertEqual((gilbeys.price, gilbeys.description), (1100, 'London dry gin'))
+        self.assertEqual(DrinksCategory.objects.filter(name='Beer').count(), 1)
+        self.assertEqual(Drinks.objects.filter(category__name='Beer').count(), 2)
+
+    def test_dedupes_names_across_chunks(self):
+        content = "name,description,category,price\n" + "Tusker,Lager,Beer,250\n" * 5
+        importer = DrinksImporter()
+        importer.import_csv(io.StringIO(content), chunksize=2)
+
+        self.assertEqual((importer.rows, importer.created, importer.updated), (1, 1, 0))
+
+    def test_reports_row_errors(self):
+        content = (
+            "name,description,category,price\n"
+            "Tusker,Lager,Beer,250\n"
+            "Pilsner,Lager,Beer,cheap\n"
+        )
+        importer = self.import_csv(content)
+
+        self.assertEqual(importer.created, 1)
+        self.assertEqual(importer.errors, ['Row 3: Invalid price: cheap'])
+
+    def test_rejects_missing_headers(self):
+        with self.assertRaisesMessage(CSVFileError, 'Missing headers'):
+            self.import_csv("name,price\nTusker,250\n")
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class DrinksUploadCSVTests(APITestCase):
+    url = '/api/drinks/upload-csv/'
+
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir)
+        upload_settings = self.settings(IMPORT_UPLOAD_DIR=self.upload_dir)
+        upload_settings.enable()
+        self.addCleanup(upload_settings.disable)
+
+    def upload(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'file': csv_upload(content)}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+        return self.client.get(f"/api/import-jobs/{response.data['id']}/").data
+
+    def age(self, path, seconds=2 * 60 * 60):
+        past = time.time() - seconds
+        os.utime(path, (past, past))
+
+    def test_upload_runs_import_job(self):
+        job = self.upload("name,description,category,price\nTusker,Lager,Beer,250\nPilsner,Lager,Beer,cheap\n")
+
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual((job['rows_processed'], job['created'], job['updated']), (2, 1, 0))
+        self.assertEqual(job['errors'], ['Row 3: Invalid price: cheap'])
+
+    def test_unreadable_file_fails_job(self):
+        job = self.upload("name,price\nTusker,250\n")
+
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error_count'], 1)
+
+    def test_rejects_non_csv(self):
+        response = self.client.post(self.url, {'file': csv_upload('x', name='drinks.xlsx')}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_sweep_fails_stale_jobs_and_deletes_their_uploads(self):
+        stale = ImportJob.objects.create(file_name='stale.csv', status='running', errors=['Row 2: Missing name'], error_count=1)
+        ImportJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=2))
+        stale_path = store_upload(stale.pk, csv_upload('name\n'))
+        self.age(stale_path)
+        # Queued behind a long import: older than the running limit, not the queued one
+        waiting = ImportJob.objects.create(file_name='waiting.csv')
+        ImportJob.objects.filter(pk=waiting.pk).update(updated_at=timezone.now() - timedelta(hours=2))
+        waiting_path = store_upload(waiting.pk, csv_upload('name\n'))
+        self.age(waiting_path)
+        lost = ImportJob.objects.create(file_name='lost.csv')
+        ImportJob.objects.filter(pk=lost.pk).update(updated_at=timezone.now() - timedelta(days=2))
+
+        call_command('sweep_import_jobs', stdout=io.StringIO())
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+        self.assertEqual(stale.errors, ['Row 2: Missing name', 'Import interrupted; upload the file again'])
+        self.assertIsNotNone(stale.finished_at)
+        self.assertEqual(ImportJob.objects.get(pk=waiting.pk).status, 'queued')
+        self.assertEqual(ImportJob.objects.get(pk=lost.pk).status, 'failed')
+        self.assertEqual(os.listdir(self.upload_dir), [os.path.basename(waiting_path)])
+
+    def test_rolled_back_upload_is_deleted_once_old(self):
+        # on_commit callbacks are dropped, as after a rollback
+        self.client.post(self.url, {'file': csv_upload('name,description,category,price\n')}, format='multipart')
+        ImportJob.objects.all().delete()
+        [orphan] = os.listdir(self.upload_dir)
+
+        call_command('sweep_import_jobs', stdout=io.StringIO())
+        self.assertEqual(os.listdir(self.upload_dir), [orphan])
+
+        self.age(os.path.join(self.upload_dir, orphan))
+        call_command('sweep_import_jobs', stdout=io.StringIO())
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_failed_job_is_not_run_and_its_upload_is_deleted(self):
+        job = ImportJob.objects.create(file_name='drinks.csv', status='failed')
+        path = store_upload(job.pk, csv_upload('name,description,category,price\nTusker,Lager,Beer,250\n'))
+
+        self.assertIsNone(run_import_job(job.pk, path))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Drinks.objects.exists())
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        customer = CustomerInfo.objects.create(name='Wanjiru', email='w@example.com', phone='0712345678')
+        for _ in range(5):
+            Order.objects.create(customer=customer, products={'Tusker': {'quantity': 1}}, order_total='250')
+
+    def test_cursor_pages_walk_newest_first(self):
+        seen = []
+        url = '/api/orders/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_page_number_mode_is_opt_in(self):
+        response = self.client.get('/api/orders/?page=2&page_size=2')
+
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class CategoryProductCountTests(APITestCase):
+    def add_categories(self, count):
+        start = DrinksCategory.objects.count()
+        for i in range(start, start + count):
+            category = DrinksCategory.objects.create(name=f'Category {i}', description='')
+            for j in range(i % 3):
+                Drinks.objects.create(name=f'Drink {i}-{j}', description='', category=category)
+
+    def assert_counts_in_one_query(self):
+        for categories in (3, 12):
+            self.add_categories(categories)
+            # One query for the ETag validators, one for the counted page
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/drinks-categories/?page_size=100')
+            expected = {c.pk: c.drinks.count() for c in DrinksCategory.objects.all()}
+            self.assertEqual({c['id']: c['product_count'] for c in response.data['results']}, expected)
+
+    def test_counts_are_aggregated(self):
+        self.assert_counts_in_one_query()
+
+    @override_settings(CATEGORY_COUNTS_DENORMALIZED=True)
+    def test_denormalized_counts_follow_product_changes(self):
+        self.assert_counts_in_one_query()
+
+        drink = Drinks.objects.filter(category__name='Category 2').first()
+        drink.category = DrinksCategory.objects.get(name='Category 0')
+        drink.save()
+        Drinks.objects.filter(category__name='Category 1').first().delete()
+
+        counts = dict(DrinksCategory.objects.order_by('id').values_list('name', 'drinks_count')[:3])
+        self.assertEqual(counts, {'Category 0': 1, 'Category 1': 0, 'Category 2': 1})
+
+
+class ListQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    # Every list endpoint must answer in a fixed number of queries
+    default_budget = 2
+    # Orders prefetch their line items in one extra query
+    budgets = {'orders': 3}
+
+    def setUp(self):
+        super().setUp()
+        seed_data(3, prefix='Small')
+
+    def test_list_endpoints_stay_within_budget(self):
+        sizes = iter(['Medium', 'Large'])
+        for prefix, viewset, _ in router.registry:
+            if 'list' not in dir(viewset):
+                continue
+            with self.subTest(endpoint=prefix):
+                self.assertQueryCountFlat(
+                    f'/api/{prefix}/?page_size=100',
+                    lambda: seed_data(20, prefix=next(sizes, 'Extra') + prefix),
+                    self.budgets.get(prefix, self.default_budget),
+                )
+
+
+class CatalogueCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        seed_data(3)
+        self.admin = CustomUser.objects.create_user(
+            email='admin@example.com', username='admin', password='secret', role='admin', is_staff=True
+        )
+
+    def test_list_and_detail_are_served_from_cache(self):
+        drink = Drinks.objects.first()
+        for url in ('/api/drinks/', f'/api/drinks/{drink.pk}/'):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+            self.assertEqual(first.data, second.data)
+
+    def test_model_changes_invalidate_dependent_keys(self):
+        self.client.get('/api/drinks-categories/')
+        drink = Drinks.objects.first()
+        drink.name = 'Renamed'
+        drink.save()
+
+        self.assertEqual(self.client.get('/api/drinks-categories/')['X-Cache'], 'MISS')
+        self.assertIn('Renamed', [d['name'] for d in self.client.get('/api/drinks/?page_size=100').data['results']])
+
+    def test_stats_are_admin_only(self):
+        self.client.get('/api/offers/')
+        self.client.get('/api/offers/')
+        self.assertEqual(self.client.get('/api/catalogue-cache/stats/').status_code, 401)
+
+        self.client.force_authenticate(self.admin)
+        stats = self.client.get('/api/catalogue-cache/stats/').data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        seed_data(3)
+
+    def test_matching_etag_returns_not_modified(self):
+        for url in ('/api/drinks/', f'/api/orders/{Order.objects.first().pk}/'):
+            response = self.client.get(url)
+            self.assertTrue(response['ETag'].startswith('"'))
+            self.assertIn('Last-Modified', response)
+
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_changes_produce_a_new_etag(self):
+        etag = self.client.get('/api/orders/')['ETag']
+        Order.objects.first().delete()
+
+        response = self.client.get('/api/orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_customer_changes_produce_a_new_order_etag(self):
+        order = Order.objects.select_related('customer').first()
+        urls = ('/api/orders/', f'/api/orders/{order.pk}/')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        order.customer.delivery_area = 'Kilimani'
+        order.customer.save(update_fields=['delivery_area'])
+
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_category_renames_produce_a_new_product_etag(self):
+        drink = Drinks.objects.select_related('category').first()
+        cocktail = Cocktails.objects.select_related('category').first()
+        urls = ('/api/drinks/', f'/api/drinks/{drink.pk}/', '/api/cocktails/', f'/api/cocktails/{cocktail.pk}/')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            for category in (drink.category, cocktail.category):
+                category.name = 'Renamed'
+                category.save()
+
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Renamed', json.dumps(response.data))
+
+
+class OrderIdTests(TestCase):
+    def test_ids_are_unique_and_ordered_across_threads(self):
+        generator = OrderIdGenerator()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            ids = list(pool.map(lambda _: generator(), range(5000)))
+
+        self.assertEqual(len(set(ids)), len(ids))
+        sequential = [generator() for _ in range(1000)]
+        self.assertEqual(sequential, sorted(sequential))
+
+    def test_save_assigns_id_without_lookup(self):
+        with self.assertNumQueries(1):
+            order = Order.objects.create(order_total='250')
+        self.assertTrue(order.order_id.startswith('ORD-'))
+
+
+def stub_client(stub, **kwargs):
+    kwargs.setdefault('callback_url', 'http://testserver/api/payments/mpesa/callback/')
+    kwargs.setdefault('callback_token', 'callback-token')
+    return DarajaClient(
+        base_url=stub.base_url, consumer_key='key', consumer_secret='secret',
+        shortcode='174379', passkey='passkey', backoff_factor=0, **kwargs
+    )
+
+
+class DarajaClientTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = DarajaStub().start()
+        self.addCleanup(self.stub.stop)
+
+    def test_token_is_reused_across_pushes(self):
+        client = stub_client(self.stub)
+        for _ in range(5):
+            self.assertEqual(client.initiate_stk_push('254712345678', 100)['ResponseCode'], '0')
+
+        self.assertEqual((self.stub.oauth_calls, self.stub.stk_pushes), (1, 5))
+
+    def test_concurrent_refresh_is_single_flight(self):
+        client = stub_client(self.stub)
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            tokens = set(pool.map(lambda _: client.get_access_token(), range(50)))
+
+        self.assertEqual(len(tokens), 1)
+        self.assertEqual(self.stub.oauth_calls, 1)
+
+    def test_token_is_refreshed_before_expiry(self):
+        self.stub.expires_in = DarajaClient.token_refresh_margin
+        client = stub_client(self.stub)
+        client.get_access_token()
+        client.get_access_token()
+
+        self.assertEqual(self.stub.oauth_calls, 2)
+
+    def test_rejected_token_is_refreshed_once(self):
+        client = stub_client(self.stub)
+        client.get_access_token()
+        self.stub.tokens.clear()
+
+        self.assertEqual(client.initiate_stk_push('254712345678', 100)['ResponseCode'], '0')
+        self.assertEqual(self.stub.oauth_calls, 2)
+
+    def test_oauth_is_retried_on_server_errors(self):
+        self.stub.oauth_failures = [503, 503]
+        client = stub_client(self.stub)
+
+        self.assertTrue(client.get_access_token())
+        self.assertEqual(self.stub.oauth_calls, 3)
+
+    def test_push_needs_a_callback_url(self):
+        with self.assertRaises(ImproperlyConfigured):
+            stub_client(self.stub, callback_url=None).initiate_stk_push('254712345678', 100)
+        self.assertEqual(self.stub.stk_pushes, 0)
+
+
+class MoneyMigrationTests(SimpleTestCase):
+    def test_parse_amount(self):
+        parse_amount = importlib.import_module('core.migrations.0006_numeric_money_columns').parse_amount
+        for value, amount in [('KES 1,250', '1250'), ('1,200.50 KES', '1200.50'), ('10%', '10'), ('', '0'), ('Ksh. 500', '500')]:
+            self.assertEqual(parse_amount(value), Decimal(amount))
+        for value in ['12.5.0', '1,2,3', 'free', '100000000000']:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_amount(value)
+        self.assertRaises(ValueError, parse_amount, '100000000', max_digits=10)
+
+
+class RevenueReportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        admin = CustomUser.objects.create_user(
+            email='admin@example.com', username='admin', password='secret', role='admin', is_staff=True
+        )
+        self.client.force_authenticate(admin)
+        Order.objects.create(order_total='1250', payment_method='mpesa', status='paid')
+        Order.objects.create(order_total='749.50', payment_method='mpesa', status='initiated')
+        Order.objects.create(order_total='300', payment_method='cash', status='paid')
+
+    def test_revenue_is_grouped_in_one_query(self):
+        with self.assertNumQueries(1):
+            report = self.client.get('/api/reports/revenue/').data
+
+        self.assertEqual(report['revenue'], Decimal('2299.50'))
+        self.assertEqual(report['by_day'][0]['orders'], 3)
+        self.assertEqual(
+            {row['payment_method']: row['revenue'] for row in report['by_payment_method']},
+            {'cash': Decimal('300'), 'mpesa': Decimal('1999.50')},
+        )
+        self.assertEqual({row['status']: row['orders'] for row in report['by_status']}, {'initiated': 1, 'paid': 2})
+
+
+class OrderItemTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        category = DrinksCategory.objects.create(name='Beer')
+        self.tusker = Drinks.objects.create(name='Tusker', price=250, category=category)
+        self.admin = CustomUser.objects.create_user(
+            email='admin@example.com', username='admin', password='secret', role='admin', is_staff=True
+        )
+
+    def checkout(self, products):
+        return self.client.post('/api/orders/', {
+            'customer': {
+                'name': 'Jane', 'email': 'jane@example.com', 'phone': '0712345678', 'county': 'Nairobi',
+                'delivery_area': 'Westlands', 'latitude': '0', 'longitude': '0',
+            },
+            'products': products,
+            'order_total': '750',
+        }, format='json')
+
+    def test_checkout_creates_line_items(self):
+        response = self.checkout({'Tusker': {'quantity': 2}, 'Mystery Gin': {'quantity': 1, 'price': 250}})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        items = {item['name']: item for item in response.data['items']}
+        self.assertEqual(items['Tusker']['drink'], self.tusker.pk)
+        self.assertEqual((items['Tusker']['quantity'], Decimal(items['Tusker']['unit_price'])), (2, Decimal('250')))
+        self.assertIsNone(items['Mystery Gin']['drink'])
+
+    def test_backfill_and_top_products(self):
+        Order.objects.bulk_create([
+            Order(order_id='LEGACY-1', products={'Tusker': {'quantity': 3}}),
+            Order(order_id='LEGACY-2', products=[{'name': 'Tusker', 'quantity': 1, 'price': 200}]),
+        ])
+        call_command('backfill_order_items', stdout=io.StringIO())
+        call_command('backfill_order_items', stdout=io.StringIO())
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(1):
+            products = self.client.get('/api/reports/top-products/').data['products']
+        self.assertEqual(products[0]['name'], 'Tusker')
+        self.assertEqual((products[0]['units'], products[0]['revenue']), (4, Decimal('950')))
+
+
+class SalesSummaryTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        admin = CustomUser.objects.create_user(
+            email='admin@example.com', username='admin', password='secret', role='admin', is_staff=True
+        )
+        self.client.force_authenticate(admin)
+
+    def checkout(self, area, total):
+        response = self.client.post('/api/orders/', {
+            'customer': {
+                'name': 'Jane', 'email': 'jane@example.com', 'phone': '0712345678', 'county': 'Nairobi',
+                'delivery_area': area, 'latitude': '0', 'longitude': '0',
+            },
+            'products': {}, 'order_total': total, 'payment_method': 'mpesa',
+        }, format='json')
+        return Order.objects.get(pk=response.data['id'])
+
+    def summary(self):
+        return {
+            (row.status, row.delivery_area): (row.orders, row.revenue)
+            for row in DailySalesSummary.objects.all() if row.orders or row.revenue
+        }
+
+    def test_changes_are_applied_incrementally_and_match_a_rebuild(self):
+        paid = self.checkout('Westlands', '500')
+        self.checkout('Westlands', '250')
+        removed = self.checkout('Kilimani', '100')
+        self.client.patch(f'/api/orders/{paid.pk}/', {'status': 'paid'}, format='json')
+        removed.delete()
+
+        expected = {('paid', 'Westlands'): (1, Decimal('500')), ('initiated', 'Westlands'): (1, Decimal('250'))}
+        self.assertEqual(self.summary(), expected)
+
+        call_command('rebuild_sales_summary', stdout=io.StringIO())
+        self.assertEqual(self.summary(), expected)
+
+        with self.assertNumQueries(1):
+            report = self.client.get('/api/reports/sales-summary/').data
+        self.assertEqual((report['orders'], report['revenue']), (2, Decimal('750')))
+        self.assertEqual(report['by_delivery_area'], [{'delivery_area': 'Westlands', 'orders': 2, 'revenue': Decimal('750')}])
+
+
+class CustomerReuseTests(APITestCase):
+    def checkout(self, phone, email, area, name='Jane'):
+        return self.client.post('/api/orders/', {
+            'customer': {
+                'name': name, 'email': email, 'phone': phone, 'county': 'Nairobi',
+                'delivery_area': area, 'latitude': '0', 'longitude': '0',
+            },
+            'products': {}, 'order_total': '100',
+        }, format='json')
+
+    def test_repeat_checkout_reuses_customer_by_normalized_phone(self):
+        first = self.checkout('0712 345 678', 'jane@example.com', 'Westlands')
+        second = self.checkout('+254712345678', 'someone@example.com', 'Kilimani', name='Someone')
+
+        self.assertEqual(first.data['customer']['id'], second.data['customer']['id'])
+        # Only delivery details follow the latest checkout, never the identity
+        customer = CustomerInfo.objects.get()
+        self.assertEqual((customer.name, customer.email, customer.delivery_area), ('Jane', 'jane@example.com', 'Kilimani'))
+        # Each order keeps the area it was delivered to
+        self.assertEqual(list(Order.objects.order_by('id').values_list('delivery_area', flat=True)), ['Westlands', 'Kilimani'])
+
+    def test_phone_is_unique(self):
+        CustomerInfo.objects.create(name='Jane', phone='0712345678')
+        CustomerInfo.objects.create(name='No phone', email='a@example.com')
+        CustomerInfo.objects.create(name='No phone', email='b@example.com')
+        with self.assertRaises(IntegrityError):
+            CustomerInfo.objects.create(name='Jane', phone='+254 712 345 678')
+
+    def test_merge_duplicate_customers_repoints_orders(self):
+        details = dict(name='Jane', county='Nairobi', latitude='0', longitude='0')
+        customers = [
+            CustomerInfo.objects.create(phone='', email='c@example.com', delivery_area='Westlands', **details),
+            CustomerInfo.objects.create(
+                phone='', email=' C@example.com', delivery_area='Kilimani', **{**details, 'name': 'J. Doe'},
+            ),
+            CustomerInfo.objects.create(phone='0712345678', email='c@example.com', delivery_area='Karen', **details),
+        ]
+        for customer in customers:
+            Order.objects.create(customer=customer)
+
+        call_command('merge_duplicate_customers', stdout=io.StringIO())
+
+        self.assertEqual(CustomerInfo.objects.count(), 2)
+        keeper = CustomerInfo.objects.get(pk=customers[0].pk)
+        self.assertEqual((keeper.name, keeper.email, keeper.delivery_area), ('Jane', 'c@example.com', 'Kilimani'))
+        self.assertEqual(keeper.orders.count(), 2)
+        self.assertEqual(CustomerInfo.objects.get(pk=customers[2].pk).orders.count(), 1)
+
+
+ORDER_PAYLOAD = {
+    'customer': {
+        'name': 'Jane', 'email': 'jane@example.com', 'phone': '0712345678', 'county': 'Nairobi',
+        'delivery_area': 'Westlands', 'latitude': '0', 'longitude': '0',
+    },
+    'products': {'Tusker': {'quantity': 1}},
+    'order_total': '250',
+}
+
+
+class IdempotencyKeyTests(APITestCase):
+    def post(self, key, payload=ORDER_PAYLOAD):
+        return self.client.post('/api/orders/', payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response_without_writing(self):
+        first = self.post('checkout-1')
+        with self.assertNumQueries(1):
+            retry = self.post('checkout-1')
+
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['order_id'], first.data['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def login(self, username):
+        self.client.force_authenticate(CustomUser.objects.create_user(
+            email=f'{username}@example.com', username=username, password='pw',
+        ))
+
+    def test_reusing_a_key_for_another_request_is_rejected(self):
+        self.login('jane')
+        self.post('checkout-1')
+        response = self.post('checkout-1', {**ORDER_PAYLOAD, 'order_total': '999'})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_keys_are_not_shared_between_callers(self):
+        self.login('jane')
+        first = self.post('checkout-1')
+        self.login('mallory')
+        other = self.post('checkout-1')
+        self.client.force_authenticate(None)
+        anonymous = self.post('checkout-1')
+        changed = self.post('checkout-1', {**ORDER_PAYLOAD, 'order_total': '999'})
+
+        for response in (other, anonymous, changed):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertNotIn('Idempotent-Replayed', response)
+            self.assertNotEqual(response.data['order_id'], first.data['order_id'])
+        self.assertEqual(Order.objects.count(), 4)
+
+    def test_expired_keys_are_swept_and_can_be_reused(self):
+        self.post('checkout-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        call_command('sweep_idempotency_keys', stdout=io.StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.post('checkout-1')
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class ConcurrentIdempotencyTests(TransactionTestCase):
+    def test_parallel_duplicates_create_one_order(self):
+        def submit(_):
+            try:
+                return APIClient().post('/api/orders/', ORDER_PAYLOAD, format='json', HTTP_IDEMPOTENCY_KEY='race').status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(submit, range(8)))
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(CustomerInfo.objects.count(), 1)
+        self.assertLessEqual(set(codes), {status.HTTP_201_CREATED, status.HTTP_409_CONFLICT})
+        self.assertIn(status.HTTP_201_CREATED, codes)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True, MPESA_CALLBACK_TOKEN='callback-token')
+class StkPushFlowTests(APITestCase):
+    callback_url = '/api/payments/mpesa/callback/callback-token/'
+
+    def setUp(self):
+        super().setUp()
+        self.stub = DarajaStub().start()
+        self.addCleanup(self.stub.stop)
+        previous = set_client(stub_client(self.stub))
+        self.addCleanup(set_client, previous)
+        customer = CustomerInfo.objects.create(name='Jane', phone='0712 345 678')
+        self.order = Order.objects.create(customer=customer, order_total='250', payment_method='mpesa')
+
+    def push(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/orders/{self.order.order_id}/stk-push/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.order.refresh_from_db()
+        return self.stub.pushes[self.order.checkout_request_id]
+
+    def test_push_and_successful_callback_mark_order_paid(self):
+        payload = self.push()
+        self.assertEqual((payload['PhoneNumber'], payload['Amount']), ('254712345678', '250'))
+        self.assertEqual(payload['CallBackURL'], f'http://testserver{self.callback_url}')
+        self.assertEqual(self.order.mpesa_amount, 250)
+
+        callback = DarajaStub.callback(self.order.checkout_request_id, amount=250, receipt='QAB123')
+        response = self.client.post(self.callback_url, callback, format='json')
+        self.assertEqual(response.data['ResultCode'], 0)
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.mpesa_receipt), ('paid', 'QAB123'))
+        self.assertEqual(DailySalesSummary.objects.get(status='paid').orders, 1)
+
+    def test_failed_callback_does_not_undo_a_payment(self):
+        self.push()
+        checkout_request_id = self.order.checkout_request_id
+        self.client.post(self.callback_url, DarajaStub.callback(checkout_request_id, amount=250), format='json')
+        self.client.post(self.callback_url, DarajaStub.callback(checkout_request_id, paid=False), format='json')
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+    def test_only_staff_can_prompt_another_phone(self):
+        response = self.client.post(f'/api/orders/{self.order.order_id}/stk-push/', {'phone': '0799 000 111'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.stub.stk_pushes, 0)
+
+    def test_callback_without_the_token_is_refused(self):
+        self.push()
+        callback = DarajaStub.callback(self.order.checkout_request_id, amount=250)
+        for url in ('/api/payments/mpesa/callback/guess/', '/api/payments/mpesa/callback/'):
+            self.assertEqual(self.client.post(url, callback, format='json').status_code, status.HTTP_404_NOT_FOUND)
+        with self.settings(MPESA_CALLBACK_TOKEN=None):
+            self.assertEqual(self.client.post(self.callback_url, callback, format='json').status_code, status.HTTP_404_NOT_FOUND)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'initiated')
+
+    def test_short_payment_is_not_marked_paid(self):
+        self.push()
+        callback = DarajaStub.callback(self.order.checkout_request_id, amount=1, receipt='QAB124')
+        with self.assertLogs('core.payments', 'WARNING'):
+            self.client.post(self.callback_url, callback, format='json')
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.mpesa_receipt), ('updaid', 'QAB124'))
+
+    def test_orders_are_addressed_by_order_id(self):
+        response = self.client.post(f'/api/orders/{self.order.pk}/stk-push/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.stub.stk_pushes, 0)
+
+    def test_repeated_pushes_are_limited_per_order(self):
+        self.push()
+        response = self.client.post(f'/api/orders/{self.order.order_id}/stk-push/')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(self.stub.stk_pushes, 1)
+
+        Order.objects.filter(pk=self.order.pk).update(stk_pushed_at=timezone.now() - timedelta(seconds=61))
+        self.push()
+        self.assertEqual(self.stub.stk_pushes, 2)
+
+    def test_push_that_times_out_can_be_sent_again(self):
+        previous = set_client(DarajaClient(**{**get_client().settings(), 'timeout': 0.1, 'retries': 0}))
+        self.stub.delay = 0.5
+        with self.assertLogs('core.payments'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/orders/{self.order.order_id}/stk-push/')
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.checkout_request_id), ('initiated', None))
+
+        set_client(previous)
+        self.stub.delay = 0
+        self.push()
+        self.assertEqual(self.order.status, 'initiated')
+
+
+@override_settings(MPESA_CALLBACK_TOKEN='callback-token')
+class AsyncStkPushTests(TestCase):
+    def setUp(self):
+        self.stub = DarajaStub().start()
+        self.addCleanup(self.stub.stop)
+        previous = set_client(stub_client(self.stub))
+        self.addCleanup(set_client, previous)
+        customer = CustomerInfo.objects.create(name='Jane', phone='0712 345 678')
+        self.order = Order.objects.create(customer=customer, order_total='250', payment_method='mpesa')
+        self.factory = AsyncRequestFactory()
+
+    def push(self, data=None, user=None):
+        request = self.factory.post('/', data or {}, content_type='application/json')
+        request.user = user or AnonymousUser()
+        return async_views.stk_push(request, order_id=self.order.order_id)
+
+    async def test_push_is_sent_inline_and_callback_marks_order_paid(self):
+        response = await self.push()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(json.loads(response.content), {'order_id': self.order.order_id, 'status': 'sent'})
+        checkout_request_id = (await Order.objects.aget(pk=self.order.pk)).checkout_request_id
+        self.assertEqual(self.stub.pushes[checkout_request_id]['PhoneNumber'], '254712345678')
+
+        callback = DarajaStub.callback(checkout_request_id, amount=250, receipt='QAB123')
+        response = await async_views.mpesa_callback(
+            self.factory.post('/', callback, content_type='application/json'), token='callback-token',
+        )
+        self.assertEqual(json.loads(response.content)['ResultCode'], 0)
+
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertEqual((order.status, order.mpesa_receipt), ('paid', 'QAB123'))
+
+    async def test_only_staff_can_prompt_another_phone(self):
+        response = await self.push({'phone': '0799 000 111'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        staff = await CustomUser.objects.acreate(email='staff@example.com', username='staff', role='admin', is_staff=True)
+        response = await self.push({'phone': '0799 000 111'}, user=staff)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.stub.stk_pushes, 1)
+
+    async def test_repeated_pushes_are_limited_per_order(self):
+        self.assertEqual((await self.push()).status_code, status.HTTP_202_ACCEPTED)
+        response = await self.push()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.stub.stk_pushes, 1)
+
+    async def test_rejected_push_marks_order_unpaid(self):
+        self.stub.push_failures = [(400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid PhoneNumber'})]
+        with self.assertLogs('core.payments'):
+            response = await self.push()
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual((await Order.objects.aget(pk=self.order.pk)).status, 'updaid')
+
+    async def test_unanswered_push_leaves_order_initiated(self):
+        self.stub.delay = 0.5
+        set_client(DarajaClient(**{**get_client().settings(), 'timeout': 0.1, 'retries': 0}))
+        with self.assertLogs('core.payments'):
+            response = await self.push()
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual((await Order.objects.aget(pk=self.order.pk)).status, 'initiated')
+
+
+class ReconcilePaymentsTests(TestCase):
+    def setUp(self):
+        self.stub = DarajaStub().start()
+        self.addCleanup(self.stub.stop)
+        self.client_ = stub_client(self.stub)
+        results = {'paid': 0, 'cancelled': 1032, 'pending': None, 'late-callback': 0, 'short': 0, 'amount-unknown': 0}
+        for name, result_code in results.items():
+            checkout_id = self.client_.initiate_stk_push('254712345678', 100)['CheckoutRequestID']
+            Order.objects.create(order_id=name, checkout_request_id=checkout_id, order_total='100', mpesa_amount=100)
+            if result_code is not None:
+                self.stub.results[checkout_id] = result_code
+        Order.objects.create(order_id='fresh', checkout_request_id='ws_CO_fresh')
+        Order.objects.exclude(order_id='fresh').update(updated_at=timezone.now() - timedelta(hours=1))
+        Order.objects.filter(order_id='late-callback').update(status='delivered')
+        # Pushed for less than the total, e.g. before the order was edited
+        Order.objects.filter(order_id='short').update(mpesa_amount=60)
+        # Pushed before the amount was recorded
+        Order.objects.filter(order_id='amount-unknown').update(mpesa_amount=None)
+
+    def test_stale_orders_are_settled_in_batches(self):
+        summary = reconcile_payments(batch_size=2, concurrency=4, rate=0, client=self.client_)
+
+        self.assertEqual(
+            {key: summary[key] for key in ('checked', 'paid', 'updaid', 'pending', 'errors', 'batches')},
+            {'checked': 5, 'paid': 1, 'updaid': 2, 'pending': 2, 'errors': 0, 'batches': 3},
+        )
+        self.assertEqual(dict(Order.objects.values_list('order_id', 'status')), {
+            'paid': 'paid', 'cancelled': 'updaid', 'pending': 'initiated', 'late-callback': 'delivered',
+            'short': 'updaid', 'amount-unknown': 'initiated', 'fresh': 'initiated',
+        })
+        self.assertEqual(self.stub.stk_queries, 5)
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = RateLimiter(rate=50)
+        started = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+def photo_bytes(size=(2000, 1500), image_format='JPEG'):
+    image = Image.new('RGB', size, 'orange')
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'  # Make
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, exif=exif)
+    return buffer.getvalue()
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class ImageVariantTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = DrinksCategory.objects.create(name='Beer')
+
+    def test_upload_builds_stripped_variants_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            drink = Drinks.objects.create(
+                name='Tusker', category=self.category, image=SimpleUploadedFile('tusker.jpg', photo_bytes()),
+            )
+
+        drink.refresh_from_db()
+        self.assertEqual(set(drink.image_variants), {'webp', 'jpg'})
+        self.assertEqual(set(drink.image_variants['webp']), {'320', '640', '1024'})
+        with default_storage.open(drink.image_variants['jpg']['320']) as f:
+            variant = Image.open(f)
+            self.assertEqual(variant.size, (320, 240))
+            self.assertFalse(variant.getexif())
+
+        data = self.client.get(f'/api/drinks/{drink.pk}/').data
+        self.assertTrue(data['image_variants']['webp']['640'].startswith('http://testserver/media/products/variants/'))
+
+    def test_changed_or_deleted_images_take_their_variants_along(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            drink = Drinks.objects.create(
+                name='Tusker', category=self.category, image=SimpleUploadedFile('tusker.jpg', photo_bytes()),
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Drinks.objects.create(
+                name='Tusker Lite', category=self.category, image=SimpleUploadedFile('tusker.png', photo_bytes(image_format='PNG')),
+            )
+        drink.refresh_from_db()
+        other.refresh_from_db()
+        old = drink.image_variants['webp']['320']
+        self.assertNotEqual(old, other.image_variants['webp']['320'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            drink.image = SimpleUploadedFile('tusker-new.jpg', photo_bytes())
+            drink.save()
+        drink.refresh_from_db()
+        self.assertFalse(default_storage.exists(old))
+        self.assertTrue(default_storage.exists(drink.image_variants['webp']['320']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(default_storage.exists(other.image_variants['webp']['320']))
+
+    def test_backfill_command_skips_unreadable_files(self):
+        good = default_storage.save('products/good.png', ContentFile(photo_bytes((300, 300), 'PNG')))
+        broken = default_storage.save('products/broken.jpg', ContentFile(b'version https://git-lfs.github.com/spec/v1'))
+        Drinks.objects.bulk_create([
+            Drinks(name='Good', category=self.category, image=good),
+            Drinks(name='Broken', category=self.category, image=broken),
+        ])
+
+        out = io.StringIO()
+        call_command('generate_image_variants', workers=0, stdout=out, stderr=io.StringIO())
+
+        self.assertIn('1 processed, 1 failed', out.getvalue())
+        # Smaller than every width: one variant at the original size
+        self.assertEqual(Drinks.objects.get(name='Good').image_variants['webp'], {'300': 'products/variants/good-png-300w.webp'})
+
+
+class MeasureTests(APITestCase):
+    def test_reports_latency_queries_and_statuses(self):
+        seed_data(5)
+        cold = measure(lambda i: self.client.get('/api/drinks/'), repeat=5, warmup=1, profile_calls=2,
+                       before_each=invalidate_catalogue)
+        warm = measure(lambda i: self.client.get('/api/drinks/'), repeat=5, warmup=1, profile_calls=2)
+
+        self.assertEqual(cold['statuses'], {'200': 5})
+        self.assertLessEqual(cold['p50_ms'], cold['p95_ms'])
+        self.assertLessEqual(cold['p95_ms'], cold['max_ms'])
+        self.assertGreater(cold['queries_max'], 0)
+        self.assertGreater(cold['peak_kb'], 0)
+        # Served from the catalogue cache
+        self.assertEqual(warm['queries_max'], 0)
+
+
+class PerformanceMetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.admin = CustomUser.objects.create_user(
+            email='admin@example.com', username='admin', password='secret', role='admin', is_staff=True
+        )
+
+    def scrape(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/metrics/')
+        self.client.force_authenticate(None)
+        return response
+
+    def test_requests_are_tagged_by_viewset_action(self):
+        seed_data(3)
+        self.client.get('/api/drinks/')
+        self.client.post('/api/drinks/upload-csv/', {'file': csv_upload('name\nx\n', name='drinks.txt')}, format='multipart')
+
+        response = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{view="DrinksViewSet.list",method="GET",status="200"} 1', body)
+        self.assertIn('http_requests_total{view="DrinksViewSet.upload_csv",method="POST",status="400"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{view="DrinksViewSet.list",method="GET"} 1', body)
+        queries = next(line for line in body.splitlines() if line.startswith('http_request_db_queries_total{view="DrinksViewSet.list"'))
+        self.assertGreater(int(queries.split()[-1]), 0)
+
+    def test_metrics_are_admin_only(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(SLOW_REQUEST_MS=0.001, SLOW_REQUEST_SAMPLE_RATE=1)
+    def test_slow_requests_are_sampled_with_their_queries(self):
+        with self.assertLogs('core.metrics', 'WARNING'):
+            self.client.get('/api/orders/')
+            self.client.force_authenticate(self.admin)
+            sample = self.client.get('/api/metrics/slow-requests/').data[0]
+        self.assertEqual(sample['view'], 'OrderViewSet.list')
+        self.assertEqual(len(sample['queries']), sample['query_count'])
+        self.assertIn('SELECT', sample['queries'][0]['sql'])
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.spirits = DrinksCategory.objects.create(name='Whisky', description='')
+        self.classics = CocktailsCategory.objects.create(name='Classics', description='')
+        self.jameson = Drinks.objects.create(name='Jameson Irish', price=2500, description='Triple distilled', category=self.spirits)
+        Drinks.objects.create(name='Gilbeys Gin', price=900, description='London dry gin', category=self.spirits)
+        self.mojito = Cocktails.objects.create(
+            title='Mojito', description='Cuban highball', ingredients=['white rum', 'mint', 'lime'],
+            instructions=['muddle'], category=self.classics,
+        )
+
+    def search(self, q, **params):
+        response = self.client.get('/api/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(result['type'], result['item']['id']) for result in response.data['results']]
+
+    def test_prefix_typo_ingredient_and_category_matches(self):
+        self.assertEqual(self.search('jam'), [('drink', self.jameson.pk)])
+        self.assertEqual(self.search('jamesin'), [('drink', self.jameson.pk)])
+        self.assertEqual(self.search('mint rum'), [('cocktail', self.mojito.pk)])
+        self.assertEqual(len(self.search('whisky')), 2)
+        self.assertEqual(self.search('gin', type='cocktail'), [])
+
+    def test_index_follows_saves_deletes_and_category_renames(self):
+        self.jameson.name = 'Jack Daniels'
+        self.jameson.save()
+        self.assertEqual(self.search('jameson'), [])
+        self.assertEqual(self.search('daniels'), [('drink', self.jameson.pk)])
+
+        self.classics.name = 'Tiki'
+        self.classics.save()
+        self.assertEqual(self.search('tiki'), [('cocktail', self.mojito.pk)])
+
+        self.mojito.delete()
+        self.assertEqual(self.search('mojito'), [])
+
+    def test_csv_upload_is_searchable(self):
+        with self.settings(BACKGROUND_TASKS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/drinks/upload-csv/', {
+                'file': csv_upload('name,description,category,price\nTusker Lager,Kenyan beer,Beer,250\n'),
+            }, format='multipart')
+
+        self.assertEqual(self.search('tusker')[0][0], 'drink')
+        self.assertEqual(self.search('beer', type='drink'), self.search('tusker'))
+
+    def test_bulk_created_products_are_searchable(self):
+        drinks = DrinksSerializer(data=[
+            {'name': 'Tusker Lager', 'price': 250, 'description': 'Kenyan beer', 'category': 'Whisky'},
+            {'name': 'White Cap', 'price': 260, 'description': 'Crisp lager', 'category': 'Whisky'},
+        ], many=True)
+        drinks.is_valid(raise_exception=True)
+        drinks.save()
+        cocktails = CocktailsSerializer(data=[{
+            'title': 'Dawa', 'description': 'Nairobi classic', 'ingredients': ['vodka', 'honey'],
+            'instructions': ['stir'], 'category': 'Classics',
+        }], many=True)
+        cocktails.is_valid(raise_exception=True)
+        cocktails.save()
+
+        self.assertEqual(len(self.search('lager')), 2)
+        self.assertEqual(self.search('honey'), [('cocktail', cocktails.instance[0].pk)])
+
+    def test_results_are_ranked_and_paginated(self):
+        seed_data(30)
+        response = self.client.get('/api/search/', {'q': 'seed drink', 'page_size': 10})
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual(len(response.data['results']), 10)
+        scores = [result['score'] for result in response.data['results']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_rebuild_command(self):
+        SearchDocument.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 products', out.getvalue())
+        self.assertEqual(self.search('mojito'), [('cocktail', self.mojito.pk)])
+
+
+class StartupProfileTests(SimpleTestCase):
+    def test_heavy_libraries_are_not_loaded_at_startup(self):
+        out = io.StringIO()
+        # Raises CommandError if pandas, numpy, openpyxl or PIL load with the WSGI app
+        call_command('profile_startup', '--json', stdout=out)
+        self.assertIn('core.views', json.loads(out.getvalue())['modules'])
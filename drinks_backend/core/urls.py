@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -5,6 +6,7 @@ from rest_framework_simplejwt.views import (
 )
 from rest_framework.routers import DefaultRouter
 from .views import *
+from . import async_views
 from .serializers import CustomTokenObtainPairSerializer
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
@@ -28,11 +30,25 @@ router.register(r'orders', OrderViewSet)
 router.register(r'offers', OfferViewSet)
 router.register(r'contacts', ContactViewSet)
 router.register(r'customers', CustomerInfoViewSet)
+router.register(r'import-jobs', ImportJobViewSet)
+router.register(r'reports', ReportViewSet, basename='reports')
 
 
 urlpatterns = [
     path('api/', include(router.urls)),
+    path('api/payments/mpesa/callback/<str:token>/', MpesaCallbackView.as_view(), name='mpesa_callback'),
+    path('api/catalogue-cache/stats/', CatalogueCacheStatsView.as_view(), name='catalogue_cache_stats'),
+    path('api/search/', SearchView.as_view(), name='search'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
+    path('api/metrics/slow-requests/', SlowRequestsView.as_view(), name='slow_requests'),
     # authentications
     path('api/auth/login/', TokenObtainPairView.as_view(serializer_class=CustomTokenObtainPairSerializer), name='token_obtain_pair'),
     path('api/auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
+
+if settings.ASYNC_VIEWS:
+    # Ahead of the router so they replace the DRF versions
+    urlpatterns = [
+        path('api/orders/<str:order_id>/stk-push/', async_views.stk_push, name='stk_push_async'),
+        path('api/payments/mpesa/callback/<str:token>/', async_views.mpesa_callback, name='mpesa_callback_async'),
+    ] + urlpatterns
@@ -7,26 +7,48 @@ from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from openpyxl import load_workbook
 from rest_framework.permissions import IsAdminUser, AllowAny
+from .importer import remove_orphaned_uploads, run_import_job, store_upload
+from .background import submit
+from .cache import CatalogueCacheMixin, cache_stats
+from .conditional import ConditionalGetMixin
+from .idempotency import IdempotentCreateMixin
+from .metrics import metrics
+from .pagination import NumberedPagination
+from .payments import (
+    claim_stk_push, dispatch_stk_push, handle_stk_callback, stk_push_error, stk_push_forbidden, valid_callback_token,
+)
+from .search import KINDS, search
+from .reports import report_range, revenue_report, sales_summary as sales_summary_report, top_products as top_products_report
+from rest_framework.views import APIView
+from django.conf import settings
 from django.db import transaction
-import pandas
+from django.db.models.functions import Coalesce, Greatest
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 import logging
 from django.views.decorators.csrf import csrf_exempt
 
 logger = logging.getLogger(__name__)
 
-class DrinksCategoryViewSet(viewsets.ModelViewSet):
-    queryset = DrinksCategory.objects.all()
+class DrinksCategoryViewSet(CatalogueCacheMixin, viewsets.ModelViewSet):
+    queryset = DrinksCategory.objects.with_product_count()
     serializer_class = DrinksCategorySerializer
+    cursor_ordering = ('id',)
 
-class CocktailsCategoryViewSet(viewsets.ModelViewSet):
-    queryset = CocktailsCategory.objects.all()
+class CocktailsCategoryViewSet(CatalogueCacheMixin, viewsets.ModelViewSet):
+    queryset = CocktailsCategory.objects.with_product_count()
     serializer_class = CocktailsCategorySerializer
+    cursor_ordering = ('id',)
 
-class DrinksViewSet(viewsets.ModelViewSet):
-    queryset = Drinks.objects.all()
+class DrinksViewSet(CatalogueCacheMixin, viewsets.ModelViewSet):
+    queryset = Drinks.objects.select_related('category')
     serializer_class = DrinksSerializer
+    cursor_ordering = ('id',)
+
+    def last_modified_expression(self):
+        # Drinks embed their category's name
+        return Greatest('updated_at', Coalesce('category__updated_at', 'updated_at'))
 
     parser_classes = [MultiPartParser]
 
@@ -42,9 +64,8 @@ class DrinksViewSet(viewsets.ModelViewSet):
             ),
         ],
         responses={
-            200: openapi.Response("Drinks uploaded successfully"),
-            206: openapi.Response("Partial success (some rows failed)"),
-            400: openapi.Response("Invalid file format or missing headers")
+            202: openapi.Response("Import job queued; poll /api/import-jobs/<id>/ for progress"),
+            400: openapi.Response("Missing file or not a CSV")
         },
     )
     @action(detail=False, methods=['post', 'options'], url_path='upload-csv')
@@ -64,122 +85,218 @@ class DrinksViewSet(viewsets.ModelViewSet):
         if not file.name.endswith('.csv'):
             return Response({"error": "Only CSV files are allowed"}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            # Read CSV in chunks to handle large files
-            chunks = pandas.read_csv(
-                file,
-                chunksize=200,  # Process 500 rows at a time
-                dtype={'price': str},  # Handle price as string initially
-                on_bad_lines='skip'  # Skip malformed rows
-            )
-            df = pandas.concat(chunks)
-            
-            # Basic validation
-            df = df.dropna(subset=['name', 'description', 'category', 'price'])
-            df = df.drop_duplicates(subset=['name'])
-            
-        except Exception as e:
-            logger.error(f"CSV read failed: {str(e)}")
-            return Response({"error": f"Invalid CSV file: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Validate required headers
-        required_headers = {'name', 'description', 'category', 'price'}
-        if missing := required_headers - set(df.columns):
-            return Response({"error": f"Missing headers: {missing}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        errors = []
-        created = updated = 0
-
-        # Process in smaller batches for reliability
-        batch_size = 100
-        for i in range(0, len(df), batch_size):
-            batch = df.iloc[i:i + batch_size]
-            try:
-                with transaction.atomic():
-                    for index, row in batch.iterrows():
-                        try:
-                            # Validate and process each row
-                            name = str(row['name']).strip()
-                            if not name:
-                                raise ValueError("Name cannot be empty")
-                            
-                            # Handle price conversion
-                            try:
-                                price_str = str(row['price']).replace(',', '').strip()
-                                price = max(0, float(price_str))
-                            except (ValueError, TypeError):
-                                raise ValueError(f"Invalid price: {row['price']}")
-                            
-                            category = str(row['category']).strip()
-                            if not category:
-                                raise ValueError("Category cannot be empty")
-
-                            # Get or create category
-                            category_obj, _ = DrinksCategory.objects.get_or_create(
-                                name=category[:50]  # Ensure max_length compliance
-                            )
-
-                            # Update or create drink
-                            _, created_flag = Drinks.objects.update_or_create(
-                                name=name[:100],  # Ensure max_length
-                                defaults={
-                                    'description': str(row.get('description', ''))[:255],
-                                    'price': price,
-                                    'category': category_obj,
-                                }
-                            )
-                            
-                            if created_flag:
-                                created += 1
-                            else:
-                                updated += 1
-                                
-                        except Exception as e:
-                            errors.append(f"Row {index+2}: {str(e)}")
-                            logger.warning(f"Row error: {e}")
-                            
-            except Exception as e:
-                errors.append(f"Batch {i//batch_size + 1} failed: {str(e)}")
-                logger.error(f"Batch failed: {e}")
-
-        if errors:
-            return Response({
-                "partial_success": True,
-                "created": created,
-                "updated": updated,
-                "error_count": len(errors),
-                "sample_errors": errors[:10]  # Return first 5 errors only
-            }, status=status.HTTP_206_PARTIAL_CONTENT)
-        
-        return Response({
-            "success": True,
-            "created": created,
-            "updated": updated
-        }, status=status.HTTP_200_OK)
-
-class CocktailsViewSet(viewsets.ModelViewSet):
-    queryset = Cocktails.objects.all()
+        # Uploads left by rolled back requests are only found by age
+        remove_orphaned_uploads()
+        with transaction.atomic():
+            job = ImportJob.objects.create(file_name=file.name[:255])
+            # Keep the upload on disk so the import can outlive this request
+            path = store_upload(job.id, file)
+            transaction.on_commit(lambda: submit(run_import_job, job.id, path))
+
+        return Response(
+            ImportJobSerializer(job, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+
+class ImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+    cursor_ordering = ('-created_at', '-id')
+
+class CocktailsViewSet(CatalogueCacheMixin, viewsets.ModelViewSet):
+    queryset = Cocktails.objects.select_related('category')
     serializer_class = CocktailsSerializer
+    cursor_ordering = ('id',)
 
-class OfferViewSet(viewsets.ModelViewSet):
+    def last_modified_expression(self):
+        # Cocktails embed their category's name
+        return Greatest('updated_at', Coalesce('category__updated_at', 'updated_at'))
+
+class OfferViewSet(CatalogueCacheMixin, viewsets.ModelViewSet):
     queryset = Offer.objects.all()
     serializer_class = OfferSerializer
+    cursor_ordering = ('id',)
 
 class CustomerInfoViewSet(viewsets.ModelViewSet):
     queryset = CustomerInfo.objects.all()
     serializer_class = CustomerInfoSerializer
+    cursor_ordering = ('-created_at', '-id')
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+class OrderViewSet(IdempotentCreateMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.select_related('customer').prefetch_related('items')
     serializer_class = OrderSerializer
+    cursor_ordering = ('-created_at', '-id')
+    idempotency_scope = 'orders.create'
+
+    def last_modified_expression(self):
+        # Orders embed their customer, whose details change on repeat checkouts
+        return Greatest('updated_at', Coalesce('customer__updated_at', 'updated_at'))
+
+    @swagger_auto_schema(
+        operation_description="Prompt the customer's phone for M-Pesa payment; the Daraja call runs in the background",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={'phone': openapi.Schema(type=openapi.TYPE_STRING, description="Defaults to the customer's phone")},
+        ),
+        responses={
+            202: 'STK push queued', 400: 'Bad Request', 403: 'Only staff can prompt another phone',
+            429: 'A push was sent for this order within STK_PUSH_INTERVAL',
+        },
+    )
+    # Addressed by order_id, not the sequential pk, so orders cannot be walked
+    @action(detail=False, methods=['post'], url_path=r'(?P<order_id>[^/.]+)/stk-push')
+    def stk_push(self, request, order_id=None):
+        order = get_object_or_404(Order.objects.select_related('customer'), order_id=order_id)
+        phone = normalize_phone(request.data.get('phone') or (order.customer.phone if order.customer else ''))
+        if stk_push_forbidden(order, phone, request.user):
+            return Response({'error': 'Only staff can prompt another phone'}, status=status.HTTP_403_FORBIDDEN)
+        if error := stk_push_error(order, phone):
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        if not claim_stk_push(order.pk):
+            return Response(
+                {'error': 'A payment prompt was already sent for this order'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(settings.STK_PUSH_INTERVAL)},
+            )
+
+        transaction.on_commit(lambda: submit(dispatch_stk_push, order.pk, phone))
+        return Response({'order_id': order.order_id, 'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
 
 class ContactViewSet(viewsets.ModelViewSet):
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
+    cursor_ordering = ('-created_at', '-id')
+
+class MpesaCallbackView(APIView):
+    '''Receives Daraja STK results; always acknowledged so Daraja does not retry.
+
+    Daraja does not sign callbacks, so only posts to the URL carrying
+    MPESA_CALLBACK_TOKEN are applied.
+    '''
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request, token):
+        if not valid_callback_token(token):
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        handle_stk_callback(request.data)
+        return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+
+class CatalogueCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(cache_stats())
+
+class SearchView(APIView):
+    '''Ranked search over drinks and cocktails, backed by core.search.'''
+    pagination_class = NumberedPagination
+    serializers = {'drink': DrinksSerializer, 'cocktail': CocktailsSerializer}
+
+    @swagger_auto_schema(
+        operation_description="Search drink names and descriptions, cocktail titles, descriptions and ingredients, "
+                              "and category names. Words match as prefixes, and misspelt words match close terms.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('type', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(KINDS)),
+            openapi.Parameter('page', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+    )
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        kind = request.query_params.get('type') or None
+        if not query:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if kind and kind not in KINDS:
+            return Response({'error': f"type must be one of {', '.join(KINDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(search(query, kind), request, view=self)
+        documents = SearchDocument.objects.select_related('drink__category', 'cocktail__category').in_bulk(
+            [pk for pk, _ in page]
+        )
+        results = []
+        for pk, score in page:
+            document = documents.get(pk)
+            if document is None:
+                continue  # Deleted since the search ran
+            found = 'drink' if document.drink_id else 'cocktail'
+            results.append({
+                'type': found,
+                'score': round(score, 4),
+                'item': self.serializers[found](getattr(document, found), context={'request': request}).data,
+            })
+        return paginator.get_paginated_response(results)
+
+class MetricsView(APIView):
+    '''Request metrics of this process in Prometheus text format.'''
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(auto_schema=None)
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class SlowRequestsView(APIView):
+    '''Most recent sampled slow requests with their SQL, newest first.'''
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.samples())
+
+class ReportViewSet(viewsets.ViewSet):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_description="Revenue per day, payment method and status",
+        manual_parameters=[
+            openapi.Parameter('start', openapi.IN_QUERY, type=openapi.TYPE_STRING, format='date'),
+            openapi.Parameter('end', openapi.IN_QUERY, type=openapi.TYPE_STRING, format='date'),
+        ],
+    )
+    @action(detail=False, methods=['get'])
+    def revenue(self, request):
+        try:
+            start, end = report_range(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(revenue_report(start, end))
+
+    @swagger_auto_schema(
+        operation_description="Best-selling products by units sold",
+        manual_parameters=[
+            openapi.Parameter('start', openapi.IN_QUERY, type=openapi.TYPE_STRING, format='date'),
+            openapi.Parameter('end', openapi.IN_QUERY, type=openapi.TYPE_STRING, format='date'),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+    )
+    @action(detail=False, methods=['get'], url_path='top-products')
+    def top_products(self, request):
+        try:
+            start, end = report_range(request.query_params)
+            limit = min(100, max(1, int(request.query_params.get('limit', 10))))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(top_products_report(start, end, limit))
+
+    @swagger_auto_schema(
+        operation_description="Daily sales totals by status, payment method and delivery area",
+        manual_parameters=[
+            openapi.Parameter('start', openapi.IN_QUERY, type=openapi.TYPE_STRING, format='date'),
+            openapi.Parameter('end', openapi.IN_QUERY, type=openapi.TYPE_STRING, format='date'),
+        ],
+    )
+    @action(detail=False, methods=['get'], url_path='sales-summary')
+    def sales_summary(self, request):
+        try:
+            start, end = report_range(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(sales_summary_report(start, end))
 
-class UpdateViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+class UpdateViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.select_related('customer').prefetch_related('items')
     serializer_class = OrderSerializer
+    cursor_ordering = ('-created_at', '-id')
 
     @swagger_auto_schema(
         operation_description="Update the status of an order",
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 from dotenv import load_dotenv
 
@@ -44,7 +45,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.middleware.StaticFilesMiddleware',
+    # Below WhiteNoise so static files are not counted
+    'core.metrics.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,23 +85,50 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'drinks_backend.wsgi.application'
+ASGI_APPLICATION = 'drinks_backend.asgi.application'
+# Serve STK push and the M-Pesa callback from async views; set when running
+# drinks_backend.asgi under uvicorn (see render.yaml)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
 
 # Database
-# DATABASES = {
-#     'default': dj_database_url.config(
-#         default='sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3'),
-#         conn_max_age=600,
-#         conn_health_checks=True,
-#     )
-# }
-# If you want to use SQLite instead of PostgreSQL, uncomment the following lines:
+# DATABASE_URL selects the backend (PostgreSQL on Render); without it a
+# local SQLite file is used. Under WSGI connections are kept open between
+# requests and checked before reuse. Under ASGI sync code runs on changing
+# threads, each of which would keep its own connection open, so they are
+# closed after every request; set DB_POOL to reuse them there.
 DATABASES = {
-   'default': {
-       'ENGINE': 'django.db.backends.sqlite3',
-       'NAME': BASE_DIR / 'db.sqlite3',
-   }
+    'default': dj_database_url.config(
+        default='sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3'),
+        conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', 0 if ASYNC_VIEWS else 600)),
+        conn_health_checks=True,
+    )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['OPTIONS'] = {'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5))}
+    if os.getenv('DB_POOL', 'False') == 'True':
+        # Django's built-in pool (psycopg 3); it replaces persistent connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        }
+elif DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # WAL lets reads run beside the single writer; IMMEDIATE takes the write lock
+    # at BEGIN so read-then-write transactions wait for it instead of failing with
+    # "database is locked"; timeout is how long they wait.
+    DATABASES['default']['OPTIONS'] = {
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': int(os.getenv('SQLITE_TIMEOUT', 20)),
+    }
+    # Tests use a file too: the shared in-memory database cannot run WAL, so
+    # concurrent writers there fail at once instead of waiting their turn
+    DATABASES['default']['TEST'] = {
+        'NAME': os.getenv('SQLITE_TEST_NAME', os.path.join(tempfile.gettempdir(), 'test_drinks_backend.sqlite3')),
+    }
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -113,6 +143,8 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
      'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 # Password validation
@@ -178,3 +210,48 @@ MPESA_SHORTCODE= os.getenv("MPESA_SHORTCODE")
 MPESA_CONSUMER_SECRET= os.getenv("MPESA_CONSUMER_SECRET")
 MPESA_CONSUMER_KEY= os.getenv("MPESA_CONSUMER_KEY")
 MPESA_CALLBACK_URL= os.getenv("MPESA_CALLBACK_URL")
+# Secret last path segment of the callback URL given to Daraja; callbacks
+# without it are refused, and none are accepted while it is unset
+MPESA_CALLBACK_TOKEN = os.getenv("MPESA_CALLBACK_TOKEN")
+# Seconds before an order's customer can be prompted again
+STK_PUSH_INTERVAL = int(os.getenv('STK_PUSH_INTERVAL', 60))
+
+# Background work (CSV imports) runs on an in-process thread pool
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))
+BACKGROUND_TASKS_EAGER = False
+# Uploaded CSVs wait here for their import. sweep_import_jobs fails running
+# jobs without progress for IMPORT_JOB_STALE_AFTER seconds, and queued jobs
+# (which may just be waiting behind a long import) after
+# IMPORT_QUEUED_JOB_STALE_AFTER; older uploads no live job will read are deleted.
+IMPORT_UPLOAD_DIR = os.getenv('IMPORT_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'drinks-imports'))
+IMPORT_JOB_STALE_AFTER = int(os.getenv('IMPORT_JOB_STALE_AFTER', 60 * 60))
+IMPORT_QUEUED_JOB_STALE_AFTER = int(os.getenv('IMPORT_QUEUED_JOB_STALE_AFTER', 24 * 60 * 60))
+
+# Catalogue response cache. Local memory is per process; point
+# CATALOGUE_CACHE_BACKEND at FileBasedCache (or any Django cache backend)
+# to share entries and invalidations between gunicorn workers.
+CATALOGUE_CACHE = 'catalogue'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    CATALOGUE_CACHE: {
+        'BACKEND': os.getenv('CATALOGUE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CATALOGUE_CACHE_LOCATION', 'catalogue'),
+        'TIMEOUT': int(os.getenv('CATALOGUE_CACHE_TIMEOUT', 300)),
+    },
+}
+
+# Serve category product counts from the maintained column instead of COUNT(...)
+CATEGORY_COUNTS_DENORMALIZED = os.getenv('CATEGORY_COUNTS_DENORMALIZED', 'False') == 'True'
+
+# Per-request timings and query counts, served to admins at /api/metrics/
+PERFORMANCE_METRICS = os.getenv('PERFORMANCE_METRICS', 'True') == 'True'
+# Requests slower than this are logged and, for a sampled fraction, kept with
+# their SQL at /api/metrics/slow-requests/. 0 disables both.
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 1000)) or None
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv('SLOW_REQUEST_SAMPLE_RATE', 0.1))
+SLOW_REQUEST_SAMPLES = int(os.getenv('SLOW_REQUEST_SAMPLES', 50))
+
+# How long an Idempotency-Key on POST /api/orders/ replays the first response
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))